@@ -41,6 +41,8 @@ class Panel(PlotGrid): #Class name must be Panel
         self.AddOption('show_error', 'radio', 2, ['Only above', 'Only below', 'Both sides'], 'On what sides do we want to show the error bar?')
         self.AddOption('activity_bin', 'radio', 0, ['1', '5', '10', '15', '30', '60'], 'Plot activity in bin count of n minutes')
         self.AddOption('show_hypno_group', 'boolean', 1, ['Show always', 'Show only on single flies'], 'When do you want to show the hypnogram?')
+        self.AddOption('sleep_definition', 'text', 0, ['5'], 'How many minutes of inactivity define sleep? Use minutes:inactivity (5:2) for definitions allowing some activity.\nDefinitions are set in Tools > Sleep Definitions; if the data do not carry this one the first one is used')
+        self.AddOption('hypnogram', 'radio', 0, ['Activity', 'Sleep states'], 'Draw the hypnogram from the activity or from the sleep states (Tools > Calculate Sleep States)\nDarker is deeper sleep')
 
 
 
@@ -70,6 +72,7 @@ class Panel(PlotGrid): #Class name must be Panel
 
         #start setting some variable that we are going to use later
         genotype_set, day_set, mon_set, ch_set = set ([]), set ([]), set ([]), set([])
+        activity_bin = int( self.GetOption('activity_bin') ) # 1,5,10,15,30,60 minutes
 
         #for each one of the selection we want to pull togheter
         for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
@@ -90,16 +93,26 @@ class Panel(PlotGrid): #Class name must be Panel
             # ax -> fly activity (the raw data of beam crossing)
             # s5 -> the 5mins sleep bins
             # s30 -> the sleep for 30 mins across the day
-            ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)  #get the S5 of the currently selected item
+            sleep_definition = cSEL.getSleepDefinition(self.GetOption('sleep_definition'))
+            ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive, sleep_definition=sleep_definition)  #get the S5 of the currently selected item
+            # activity already binned by the DAMslice
+            activity_t, sleep_t = cSEL.getBinned(ds,de,fs,fe, activity_bin, t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive, sleep_definition=sleep_definition)
+            # flies and days excluded from s5 are left out of the states too
+            states_t = cSEL.getSleepStates(ds,de,fs,fe,t0,t1)
+            states_t = np.ma.masked_array(states_t, mask=np.ma.getmaskarray(states_t) | np.ma.getmaskarray(s5_t))
 
             if n_sel == 0:
                 s5 = s5_t
                 ax = ax_t
                 s30 = s30_t
+                activity = activity_t
+                states = states_t
             else:
                 s5 = concatenate ((s5, s5_t))
                 ax = concatenate ((ax, ax_t))
                 s30 = concatenate ((s30, s30_t))
+                activity = concatenate ((activity, activity_t))
+                states = concatenate ((states, states_t))
         
         ## HERE WE ARE OUT OF THE SELECTION LOOP
         # we calculate date by fly
@@ -133,20 +146,13 @@ class Panel(PlotGrid): #Class name must be Panel
         # Finally, we calculate the data to be drawn on the graph
 
         
-        activity_bin = int( self.GetOption('activity_bin') ) # 1,5,10,15,30,60 minutes
-        
-        if activity_bin > 1:
-            d,f,t = ax.shape
-            activity = ax.reshape((d,f,-1,activity_bin)).sum(axis=3)
-            fly_activity = average (average (activity, axis=0), axis=0)
-            fly_activity_std = cStd (average (activity, axis=0), axis=0)
-    
-        else:
-            fly_activity = average (average (ax, axis=0), axis=0)
-            fly_activity_std = cStd (average (ax, axis=0), axis=0)
+        fly_activity = average (average (activity, axis=0), axis=0)
+        fly_activity_std = cStd (average (activity, axis=0), axis=0)
             
         dist_fly30 = average (average (s30, axis=0), axis=0)
         stde_fly30 = cStd (average (s30, axis=0), axis=0)
+
+        fly_states = average (average (states, axis=0), axis=0)
         
         # We set the title of the whole thing
         if num_of_selected > 1 or holdplot:
@@ -156,12 +162,12 @@ class Panel(PlotGrid): #Class name must be Panel
         # We Draw what we need to
         self.canvas.redraw(self.subplot_dailydata, title, str(genotype_set),
                            fly_activity, fly_activity_std, dist_fly30, stde_fly30,
-                           ShowErrorBar, num_flies, col=color)
+                           ShowErrorBar, num_flies, col=color, states=fly_states)
 
         self.WriteComment(cSEL.Comment or '')
 
 
-    def subplot_dailydata(self, fig, title, lbl, activity, activity_std, sleep, sleep_std, errBars, num_flies, col=None):
+    def subplot_dailydata(self, fig, title, lbl, activity, activity_std, sleep, sleep_std, errBars, num_flies, col=None, states=None):
 
         #This in case the data we are passing are actually empty (flies are inactive or dead).
         #Here we determine the length of a day to be able to fill things
@@ -176,6 +182,7 @@ class Panel(PlotGrid): #Class name must be Panel
         activity_bin = int( self.GetOption('activity_bin') ) # 1,5,10,15,30,60 minutes
         activity_limit = self.GetOption('Yactivity')
         show_hypno_group = self.GetOption('show_hypno_group')
+        hypnogram = self.GetOption('hypnogram')
         
         try:
             DayLength = len(sleep)
@@ -218,9 +225,12 @@ class Panel(PlotGrid): #Class name must be Panel
         #Draw the hypnogram at the bottom of the figure and the axis labels
         if show_hypno_group or num_flies == 1:
 
-            ipno = np.zeros(DayLength)
-            indices = np.where(activity < 1)
-            ipno[indices] = 1
+            if hypnogram == 'Sleep states' and np.ma.count(states):
+                ipno = np.ma.filled(states.max() - states, 0)
+            else:
+                ipno = np.zeros(DayLength)
+                indices = np.where(activity < 1)
+                ipno[indices] = 1
             ipno = ipno,
             
             if sync: a3 = fig.add_axes([lm, 0.12, rm, 0.1], yticks=[], sharex=a4)
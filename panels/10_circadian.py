@@ -0,0 +1,167 @@
+'''
+This Panel analyzes the circadian rhythm of the activity of the selected flies.
+The activity of every fly is binned and taken as one series running through all the selected days.
+The upper graph shows the average periodogram of the selected flies according to the chosen method
+(chi-square, Lomb-Scargle or autocorrelation), the lower graph the distribution of their periods.
+'''
+#Default IMPORTED MODULES (DO NOT REMOVE)
+from default_panels import *
+
+class Panel(PlotGrid):
+
+    #Here some variable specific to the PanelType
+
+    def __init__(self, parent):
+
+        PanelProportion = [6,2,1]    #0 = not_show
+        CanvasInitialSize = (10,6)     #size in inches
+        colLabels = ['Genotype','Day','Mon','Ch','n(tot)','n(rhythmic)', 'chi-sq period','st.dv.','Qp - Qp(sig)','st.dv.','LS period','st.dv.','ACF period','st.dv.','RI','st.dv.','color' ]
+        dataTypes = [gridlib.GRID_VALUE_STRING] * 4 + [gridlib.GRID_VALUE_NUMBER] * 2 + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 10 + [gridlib.GRID_VALUE_STRING]
+
+        choiceList = ['Chi-square', 'Lomb-Scargle', 'Autocorrelation']
+
+        PlotGrid.__init__(self, parent,
+                                         PanelProportion,
+                                         CanvasInitialSize,
+                                         colLabels,
+                                         dataTypes,
+                                         choiceList
+                                         )
+        self.name = 'Circadian'
+        self.compatible = 'all'
+
+        self.AddOption('bin_length', 'radio', 2, ['5', '10', '15', '30', '60'], 'Activity is binned in bins of n minutes before computing the periodograms')
+        self.AddOption('period_range', 'text', 0, ['16:32'], 'Range of periods (in hours) to be tested, as min:max')
+        self.AddOption('alpha', 'text', 0, ['0.01'], 'Significance level of the chi-square periodogram')
+
+        self.engines = {}
+        self.reuse_engines = False
+
+    def OnChoice(self, event):
+        '''
+        Changing method does not need to compute the periodograms again
+        '''
+        self.reuse_engines = True
+        try:
+            PlotGrid.OnChoice(self, event)
+        finally:
+            self.reuse_engines = False
+
+
+#-----------------------------------------------
+
+    def Refresh(self):
+        '''
+        This function takes the coordinates coming upon tree item selection
+        and plot the periodograms of the selected flies
+        '''
+
+        allSelections = GUI['dtList']
+        cDAM = GUI['cDAM']
+        holdplot = GUI['holdplot']
+
+        use_dropout = userConfig['use_dropout'] #boolean
+        min_alive = userConfig['min_sleep'] #int
+        max_alive = userConfig['max_sleep'] #int
+
+        genotype_set, day_set, mon_set, ch_set = set ([]), set ([]), set ([]), set([])
+
+        bin_length = int(self.GetOption('bin_length'))
+        min_period, max_period = [float(p) for p in self.GetOption('period_range').split(':')]
+        alpha = float(self.GetOption('alpha'))
+
+        #All the periodograms are computed once for every selection, for all its flies at once.
+        #When only the method to plot changes the engine is reused
+        key = str((allSelections, bin_length, min_period, max_period, alpha))
+        if not (self.reuse_engines and key in self.engines):
+
+            for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+
+                k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+                cSEL = cDAM[k]
+
+                fs, fe = cSEL.getFliesInInterval(m, f)
+                ds, de = cSEL.getDaysInInterval(d)
+
+                ax_t = cSEL.filterbyStatus(ds,de,fs,fe, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)[0]
+
+                #flies are put side by side, all running through the same days
+                if n_sel == 0:
+                    ax = ax_t
+                else:
+                    ax = concatenate ((ax, ax_t), axis=1)
+
+            if not holdplot: self.engines = {}
+            self.engines[key] = CircadianEngine(ax, bin_length, min_period, max_period, alpha)
+
+        engine = self.engines[key]
+
+        for n_sel, selection in enumerate(allSelections):
+            k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+            cSEL = cDAM[k]
+
+            genotype_set.add ( cSEL.getGenotype() )
+            mon_t = cSEL.getMonitorName(m, d, f) or 'All'; mon_set.add(mon_t)
+            day_t = cSEL.getDate(d, f) or 'All'; day_set.add(day_t)
+            ch_t = cSEL.getChannelName(m, f) or 'All'; ch_set.add(ch_t)
+
+        method = GUI['choice'] or 'Chi-square'
+        hours, power, threshold = engine.getPeriodogram(method)
+        period, peak = engine.getPeriod(method)
+
+        self.canExport(engine.getColumns(), 'Circadian periods', 'Period and power of every selected fly according to chi-square, Lomb-Scargle and autocorrelation')
+        self.canExport([('period (h)', hours)] + [('fly %s' % n, p) for n, p in enumerate(power)], 'Periodogram', 'The %s periodogram of every selected fly' % method)
+
+        #In the table: only rhythmic flies contribute to the periods
+        rhythmic = engine.getRhythmic()
+        num_flies = len(rhythmic)
+        num_rhythmic = rhythmic.sum()
+
+        datarow = [list2str(genotype_set), list2str(day_set) , list2str(mon_set), list2str(ch_set), num_flies, num_rhythmic]
+        for each_method in engine.methods:
+            m_period, m_peak = engine.getPeriod(each_method)
+            m_period = np.ma.masked_array(m_period, mask=np.ma.getmaskarray(m_period) | ~rhythmic)
+            m_peak = np.ma.masked_array(m_peak, mask=np.ma.getmaskarray(m_peak) | ~rhythmic)
+            datarow += [average(m_period), std(m_period)]
+            if each_method != 'Lomb-Scargle': datarow += [average(m_peak), std(m_peak)]
+
+        #HOLD vs. NO-HOLD
+        #Do we add the current line to the table or we completely refresh the contents?
+
+        pos = GUI['currentlyDrawn']
+        if holdplot:
+            title = 'Multiple Selection'
+            color, color_name = getPlottingColor(pos-1)
+            datarow.append(color_name)
+            self.sheet.AddRow (datarow)
+        else:
+            title = list2str(genotype_set) +' - Day: '+ list2str(day_set) +', Mon: ' +list2str(mon_set)+ ', Ch. '+list2str(ch_set)
+            color, color_name = getPlottingColor(pos-1)
+            datarow.append(color_name)
+            self.sheet.SetData ([datarow])
+
+        self.canvas.redraw(self.periodogram_plot, title, method, hours, power, threshold, period, color)
+        self.WriteComment(cSEL.Comment or '')
+
+    def periodogram_plot(self, fig, title, method, hours, power, threshold, period, col):
+        '''
+        '''
+        a1 = fig.add_axes([0.1, 0.45, 0.85, 0.45], title = '%s - %s' % (title, method))
+
+        power_avg = average(power, axis=0)
+        a1.plot(hours, power_avg, '-', color=col)
+        if GUI['ErrorBar']:
+            power_std = stde(power, axis=0)
+            a1.fill_between(hours, power_avg - power_std, power_avg + power_std, color=brighten(col), alpha=0.5)
+        if threshold is not None:
+            a1.plot(hours, threshold, ':', color=col)
+
+        a1.set_xlim((hours[0], hours[-1]))
+        a1.set_ylabel({'Chi-square' : 'Qp', 'Lomb-Scargle' : 'Normalized power', 'Autocorrelation' : 'r'}[method])
+
+        a2 = fig.add_axes([0.1, 0.08, 0.85, 0.25], sharex=a1)
+        periods = period.compressed()
+        if len(periods) > 1:
+            a2.hist(periods, len(hours), fc = col)
+        a2.set_xlabel('Period (h)')
+        a2.set_ylabel('n. of flies')
@@ -0,0 +1,141 @@
+'''
+This Panel shows the survival of the selected flies through the whole recording.
+A fly is considered dead from its last activity if it never moves again for the time specified in the options,
+flies still moving at the end of the recording are censored.
+The graph shows the Kaplan-Meier survival curve of every selection; selections drawn together
+are compared with a log-rank test.
+'''
+#Default IMPORTED MODULES (DO NOT REMOVE)
+from default_panels import *
+
+class Panel(PlotGrid):
+
+    #Here some variable specific to the PanelType
+    keepState = ['groups']
+
+    def __init__(self, parent):
+
+        PanelProportion = [6,2,1]    #0 = not_show
+        CanvasInitialSize = (10,6)     #size in inches
+        colLabels = ['Genotype','Mon','Ch','n(tot)','n(dead)','n(censored)','median (days)','mean (days)','st.dv.','color' ]
+        dataTypes = [gridlib.GRID_VALUE_STRING] * 3 + [gridlib.GRID_VALUE_NUMBER] * 3 + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 3 + [gridlib.GRID_VALUE_STRING]
+
+        choiceList = []
+
+        PlotGrid.__init__(self, parent,
+                                         PanelProportion,
+                                         CanvasInitialSize,
+                                         colLabels,
+                                         dataTypes,
+                                         choiceList
+                                         )
+        self.name = 'Survival'
+        self.compatible = 'all'
+
+        self.AddOption('death_inactivity', 'text', 0, ['24'], 'A fly is dead if it does not move again for at least this many hours')
+        self.AddOption('activity_threshold', 'text', 0, ['0'], 'Activity counts up to this value are not considered movement')
+
+        self.groups = []
+
+#-----------------------------------------------
+
+    def Refresh(self):
+        '''
+        This function takes the coordinates coming upon tree item selection
+        and plot the survival of the selected flies
+        '''
+
+        allSelections = GUI['dtList']
+        cDAM = GUI['cDAM']
+        holdplot = GUI['holdplot']
+
+        genotype_set, mon_set, ch_set = set ([]), set ([]), set([])
+
+        death_inactivity = int(float(self.GetOption('death_inactivity')) * 60)
+        threshold = int(self.GetOption('activity_threshold'))
+
+        #longevity is taken on the whole recording, whatever day is selected
+        for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+
+            k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+            cSEL = cDAM[k]
+
+            genotype_set.add ( cSEL.getGenotype() )
+            mon_t = cSEL.getMonitorName(m, d, f) or 'All'; mon_set.add(mon_t)
+            ch_t = cSEL.getChannelName(m, f) or 'All'; ch_set.add(ch_t)
+
+            fs, fe = cSEL.getFliesInInterval(m, f)
+            if fe == -1: fe = None
+            else: fe += 1
+
+            times_t, died_t = survival_times(cSEL.fly[:,fs:fe], death_inactivity, threshold)
+            #flies marked as inactive on all days are left out
+            excluded = (cSEL.flyStatus[:,fs:fe] < 0).all(axis=0)
+            times_t = np.ma.masked_array(times_t, mask=np.ma.getmaskarray(times_t) | excluded)
+
+            if n_sel == 0:
+                times = times_t
+                died = died_t
+            else:
+                times = concatenate ((times, times_t))
+                died = np.concatenate ((died, died_t))
+
+        # times are in minutes, we show them in days
+        days = times / 1440.
+
+        num_flies = days.count()
+        num_dead = (died & ~np.ma.getmaskarray(days)).sum()
+        lifespan = np.ma.masked_array(days, mask=np.ma.getmaskarray(days) | ~died)
+
+        datarow = [list2str(genotype_set), list2str(mon_set), list2str(ch_set), num_flies, num_dead, num_flies - num_dead,
+                   median_survival(days, died), average(lifespan), std(lifespan)]
+
+        #HOLD vs. NO-HOLD
+        #Do we add the current line to the table or we completely refresh the contents?
+
+        pos = GUI['currentlyDrawn']
+        color, color_name = getPlottingColor(pos-1)
+        datarow.append(color_name)
+        label = list2str(genotype_set)
+
+        if holdplot:
+            title = 'Multiple Selection'
+            self.sheet.AddRow (datarow)
+            self.groups.append((label, color, days, died))
+        else:
+            title = label +' - Mon: ' +list2str(mon_set)+ ', Ch. '+list2str(ch_set)
+            self.sheet.SetData ([datarow])
+            self.groups = [(label, color, days, died)]
+
+        km = kaplan_meier(days, died)
+        self.canExport(km, 'Kaplan-Meier', 'Kaplan-Meier survival table of the selected flies (time in days)')
+        self.canExport([('lifespan (days)', days), ('dead', died)], 'Survival times', 'Time every selected fly lived, or was observed for if still alive at the end (dead = False)')
+
+        if len(self.groups) > 1:
+            stat, df, p, observed, expected = log_rank([(g[2], g[3]) for g in self.groups])
+            title = title + ' - log-rank chi2(%s) = %.2f, p = %.4f' % (df, stat, p)
+            self.canExport([('group', np.array([g[0] for g in self.groups])), ('observed', observed), ('expected', expected)],
+                           'Log-rank', 'Observed and expected deaths of every group drawn; chi2(%s) = %.2f, p = %.4f' % (df, stat, p))
+
+        self.canvas.redraw(self.survival_plot, title, self.groups)
+        self.WriteComment(cSEL.Comment or '')
+
+    def survival_plot(self, fig, title, groups):
+        '''
+        '''
+        a1 = fig.add_subplot(111, title = title)
+
+        for label, col, days, died in groups:
+            km = dict(kaplan_meier(days, died))
+            x = np.concatenate(([0], km['time']))
+            y = np.concatenate(([1], km['survival']))
+            a1.step(x, y * 100, where='post', color=col, label=label)
+
+            #censored flies are marked on the curve
+            censored = km['censored'] > 0
+            a1.plot(km['time'][censored], km['survival'][censored] * 100, '|', color=col)
+
+        a1.set_ylim((0, 105))
+        a1.set_xlabel('Days')
+        a1.set_ylabel('Survival (%)')
+        a1.legend(loc='lower left')
@@ -0,0 +1,130 @@
+'''
+This Panel shows the sleep architecture of the selected flies as transition probabilities.
+P(wake) is the probability that an inactive minute is followed by an active one,
+P(doze) the probability that an active minute is followed by an inactive one.
+The table reports both during the day and the night, split at the minute lights go off,
+the graph shows how they change through the day, in windows of the length set in the options.
+'''
+#Default IMPORTED MODULES (DO NOT REMOVE)
+from default_panels import *
+
+class Panel(PlotGrid):
+
+    #Here some variable specific to the PanelType
+
+    def __init__(self, parent):
+
+        PanelProportion = [6,2,1]    #0 = not_show
+        CanvasInitialSize = (10,6)     #size in inches
+        colLabels = ['Genotype','Day','Mon','Ch','n(tot)','P(wake) day','st.dv.','P(wake) night','st.dv.','P(doze) day','st.dv.','P(doze) night','st.dv.','color' ]
+        dataTypes = [gridlib.GRID_VALUE_STRING] * 4 + [gridlib.GRID_VALUE_NUMBER] + [gridlib.GRID_VALUE_FLOAT + ':6,3'] * 8 + [gridlib.GRID_VALUE_STRING]
+
+        choiceList = []
+
+        PlotGrid.__init__(self, parent,
+                                         PanelProportion,
+                                         CanvasInitialSize,
+                                         colLabels,
+                                         dataTypes,
+                                         choiceList
+                                         )
+        self.name = 'Sleep Architecture'
+        self.compatible = 'all'
+
+        self.AddOption('window', 'radio', 2, ['15', '30', '60', '120'], 'Length in minutes of the windows in which the probabilities are plotted')
+        self.AddOption('activity_threshold', 'text', 0, ['0'], 'Activity counts up to this value are considered inactivity')
+        self.AddOption('lightsoff', 'text', 0, ['720'], 'At what minute of the day do lights go off?\nDay and night probabilities are split here')
+
+#-----------------------------------------------
+
+    def Refresh(self):
+        '''
+        This function takes the coordinates coming upon tree item selection
+        and plot the transition probabilities of the selected flies
+        '''
+
+        allSelections = GUI['dtList']
+        cDAM = GUI['cDAM']
+        holdplot = GUI['holdplot']
+
+        use_dropout = userConfig['use_dropout'] #boolean
+        min_alive = userConfig['min_sleep'] #int
+        max_alive = userConfig['max_sleep'] #int
+
+        genotype_set, day_set, mon_set, ch_set = set ([]), set ([]), set ([]), set([])
+
+        window = int(self.GetOption('window'))
+        threshold = int(self.GetOption('activity_threshold'))
+        lightsoff = int(self.GetOption('lightsoff'))
+
+        for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+
+            k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+            cSEL = cDAM[k]
+
+            genotype_set.add ( cSEL.getGenotype() )
+            mon_t = cSEL.getMonitorName(m, d, f) or 'All'; mon_set.add(mon_t)
+            day_t = cSEL.getDate(d, f) or 'All'; day_set.add(day_t)
+            ch_t = cSEL.getChannelName(m, f) or 'All'; ch_set.add(ch_t)
+
+            fs, fe = cSEL.getFliesInInterval(m, f)
+            ds, de = cSEL.getDaysInInterval(d)
+
+            ax_t = cSEL.filterbyStatus(ds,de,fs,fe, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)[0]
+
+            if n_sel == 0:
+                ax = ax_t
+            else:
+                ax = concatenate ((ax, ax_t), axis=0)
+
+        #profile through the day and one value for the day and one for the night
+        p_wake, p_doze = transition_probabilities(ax, window, threshold)
+        lightsoff = int(np.clip(lightsoff, 1, ax.shape[2] - 1)) #neither day nor night can be empty
+        wake_day, doze_day = transition_probabilities(ax[:,:,:lightsoff], None, threshold)
+        wake_night, doze_night = transition_probabilities(ax[:,:,lightsoff:], None, threshold)
+
+        num_flies = (~np.ma.getmaskarray(ax).all(axis=2)).any(axis=0).sum()
+        datarow = [list2str(genotype_set), list2str(day_set) , list2str(mon_set), list2str(ch_set), num_flies]
+        for p in [wake_day, wake_night, doze_day, doze_night]:
+            datarow += [average(p), std(p)]
+
+        d, f, n = p_wake.shape
+        hours = np.arange(n) * window / 60.
+        self.canExport([('day', np.repeat(np.arange(d), f*n)), ('fly', np.tile(np.repeat(np.arange(f), n), d)),
+                        ('minute', np.tile(np.arange(n) * window, d*f)), ('P(wake)', p_wake.ravel()), ('P(doze)', p_doze.ravel())],
+                       'Sleep architecture', 'P(wake) and P(doze) of every selected fly and day, in windows of %s minutes' % window)
+
+        #HOLD vs. NO-HOLD
+        #Do we add the current line to the table or we completely refresh the contents?
+
+        pos = GUI['currentlyDrawn']
+        color, color_name = getPlottingColor(pos-1)
+        datarow.append(color_name)
+
+        if holdplot:
+            title = 'Multiple Selection'
+            self.sheet.AddRow (datarow)
+        else:
+            title = list2str(genotype_set) +' - Day: '+ list2str(day_set) +', Mon: ' +list2str(mon_set)+ ', Ch. '+list2str(ch_set)
+            self.sheet.SetData ([datarow])
+
+        self.canvas.redraw(self.architecture_plot, title, hours, p_wake, p_doze, color)
+        self.WriteComment(cSEL.Comment or '')
+
+    def architecture_plot(self, fig, title, hours, p_wake, p_doze, col):
+        '''
+        '''
+        a1 = fig.add_subplot(211, title = title)
+        a2 = fig.add_subplot(212, sharex=a1)
+
+        for a, p, label in [(a1, p_wake, 'P(wake)'), (a2, p_doze, 'P(doze)')]:
+            p = p.reshape((-1, p.shape[2]))
+            p_avg = average(p, axis=0)
+            a.plot(hours, p_avg, '-o', color=col)
+            if GUI['ErrorBar']:
+                p_std = stde(p, axis=0)
+                a.fill_between(hours, p_avg - p_std, p_avg + p_std, color=brighten(col), alpha=0.5)
+            a.set_ylabel(label)
+
+        a2.set_xlim((0, 24))
+        a2.set_xlabel('Hours')
@@ -0,0 +1,158 @@
+'''
+This Panel draws the actograms of the selected flies, all together as one raster image.
+Every row of an actogram is one day, binned as set in the options; when double plotted
+every row shows one day followed by the next one.
+Actograms can be drawn for the average of every selection or for every single fly,
+showing either activity (normalized on every actogram) or the fraction of time asleep.
+'''
+#Default IMPORTED MODULES (DO NOT REMOVE)
+from default_panels import *
+
+class Panel(PlotGrid):
+
+    #Here some variable specific to the PanelType
+    keepState = ['actograms']
+
+    def __init__(self, parent):
+
+        PanelProportion = [6,2,1]    #0 = not_show
+        CanvasInitialSize = (10,6)     #size in inches
+        colLabels = ['Genotype','Day','Mon','Ch','n(tot)','activity/day','st.dv.','sleep/day','st.dv.','color' ]
+        dataTypes = [gridlib.GRID_VALUE_STRING] * 4 + [gridlib.GRID_VALUE_NUMBER] + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 4 + [gridlib.GRID_VALUE_STRING]
+
+        choiceList = ['Activity', 'Sleep']
+
+        PlotGrid.__init__(self, parent,
+                                         PanelProportion,
+                                         CanvasInitialSize,
+                                         colLabels,
+                                         dataTypes,
+                                         choiceList
+                                         )
+        self.name = 'Actogram'
+        self.compatible = 'all'
+
+        self.AddOption('bin_length', 'radio', 3, ['1', '5', '10', '15', '30', '60'], 'Activity and sleep are binned in bins of n minutes')
+        self.AddOption('double_plot', 'boolean', 0, ['Double plot', 'Single plot'], 'Do you want every row to show two consecutive days?')
+        self.AddOption('actograms', 'radio', 0, ['Average', 'Single flies'], 'Draw one actogram for the average of every selection or one for every fly')
+        self.AddOption('columns', 'text', 0, ['8'], 'How many actograms to draw side by side')
+
+        self.actograms = []
+
+#-----------------------------------------------
+
+    def Refresh(self):
+        '''
+        This function takes the coordinates coming upon tree item selection
+        and draws the actograms of the selected flies
+        '''
+
+        allSelections = GUI['dtList']
+        cDAM = GUI['cDAM']
+        holdplot = GUI['holdplot']
+
+        use_dropout = userConfig['use_dropout'] #boolean
+        min_alive = userConfig['min_sleep'] #int
+        max_alive = userConfig['max_sleep'] #int
+
+        genotype_set, day_set, mon_set, ch_set = set ([]), set ([]), set ([]), set([])
+
+        bin_length = int(self.GetOption('bin_length'))
+        double_plot = self.GetOption('double_plot')
+        single_flies = (self.GetOption('actograms') == 'Single flies')
+        show = GUI['choice'] or 'Activity'
+
+        labels = []
+        for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+
+            k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+            cSEL = cDAM[k]
+
+            genotype_set.add ( cSEL.getGenotype() )
+            mon_t = cSEL.getMonitorName(m, d, f) or 'All'; mon_set.add(mon_t)
+            day_t = cSEL.getDate(d, f) or 'All'; day_set.add(day_t)
+            ch_t = cSEL.getChannelName(m, f) or 'All'; ch_set.add(ch_t)
+
+            fs, fe = cSEL.getFliesInInterval(m, f)
+            ds, de = cSEL.getDaysInInterval(d)
+
+            # activity and sleep come already binned from the DAMslice
+            activity_t, sleep_t = cSEL.getBinned(ds,de,fs,fe, bin_length, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)
+            labels += ['%s - %s:%s' % ((cSEL.getGenotype(),) + tuple(cSEL.getMonitorFlyName(ff))) for ff in range(fs, fs + activity_t.shape[1])]
+
+            #flies are put side by side, all running through the same days
+            if n_sel == 0:
+                activity = activity_t
+                sleep = sleep_t
+            else:
+                activity = concatenate ((activity, activity_t), axis=1)
+                sleep = concatenate ((sleep, sleep_t), axis=1)
+
+        day_length = activity.shape[2] * bin_length
+        activity_by_fly = average(activity.sum(axis=2), axis=0)
+        sleep_by_fly = average(sleep.sum(axis=2), axis=0) * 1440. / (day_length or 1)
+
+        num_flies = activity.shape[1]
+        datarow = [list2str(genotype_set), list2str(day_set) , list2str(mon_set), list2str(ch_set), num_flies,
+                   average(activity_by_fly), std(activity_by_fly), average(sleep_by_fly), std(sleep_by_fly)]
+
+        if show == 'Sleep': values = sleep / float(bin_length)
+        else: values = activity
+
+        self.canExport(values, 'Actogram', '%s of the selected flies (days, flies, bins of %s minutes)' % (show, bin_length))
+
+        # one actogram for every fly or one for the whole selection
+        if single_flies:
+            actograms = [(label, actogram(values[:,n], double_plot)) for n, label in enumerate(labels)]
+        else:
+            actograms = [(list2str(genotype_set), actogram(average(values, axis=1), double_plot))]
+
+        if show == 'Activity':
+            #activity is normalized on every actogram
+            for label, a in actograms:
+                top = np.nanmax(a) if np.isfinite(a).any() else 0
+                if top > 0: a /= top
+
+        #HOLD vs. NO-HOLD
+        #Do we add the current line to the table or we completely refresh the contents?
+
+        pos = GUI['currentlyDrawn']
+        color, color_name = getPlottingColor(pos-1)
+        datarow.append(color_name)
+
+        if holdplot:
+            title = 'Multiple Selection'
+            self.sheet.AddRow (datarow)
+            self.actograms += actograms
+        else:
+            title = list2str(genotype_set) +' - Day: '+ list2str(day_set) +', Mon: ' +list2str(mon_set)+ ', Ch. '+list2str(ch_set)
+            self.sheet.SetData ([datarow])
+            self.actograms = actograms
+
+        columns = int(self.GetOption('columns'))
+        self.canvas.redraw(self.actogram_plot, title, self.actograms, columns, show, bin_length, double_plot)
+        self.WriteComment(cSEL.Comment or '')
+
+    def actogram_plot(self, fig, title, actograms, columns, show, bin_length, double_plot):
+        '''
+        All the actograms are drawn as one image
+        '''
+        #with hold the previous actograms are part of the new image
+        fig.clear()
+
+        image, corners = tile_actograms([a for label, a in actograms], columns)
+
+        a1 = fig.add_subplot(111, title = title)
+        if show == 'Sleep': cmap = mpl.cm.Blues
+        else: cmap = mpl.cm.binary
+        a1.imshow(np.ma.masked_invalid(image), aspect='auto', cmap=cmap, interpolation='nearest', vmin=0, vmax=1)
+
+        #labels are shown only when there is room for them
+        if len(actograms) <= 64:
+            for (label, a), (r, c) in zip(actograms, corners):
+                a1.text(c, r, label, fontsize=7, va='top', ha='left', color='red')
+
+        a1.set_xticks([])
+        a1.set_yticks([])
+        if double_plot: a1.set_xlabel('Every row: two consecutive days in bins of %s min' % bin_length)
+        else: a1.set_xlabel('Every row: one day in bins of %s min' % bin_length)
@@ -29,6 +29,7 @@ class Panel(PlotGrid):
         self.compatible = 'all'
 
         self.AddOption('Yactivity', 'radio', 3, ['Max (dynamic)', '15', '10', '5'], 'Set the upper limit for the Y axis on the Activity plot')
+        self.AddOption('sleep_definition', 'text', 0, ['5'], 'How many minutes of inactivity define sleep? Use minutes:inactivity (5:2) for definitions allowing some activity.\nDefinitions are set in Tools > Sleep Definitions; if the data do not carry this one the first one is used')
 
     def Refresh(self):
         '''This function takes the coordinates from the item selection and plots the data as day by day'''
@@ -58,7 +59,8 @@ class Panel(PlotGrid):
             fs, fe = cSEL.getFliesInInterval(m, f)
             ds, de = cSEL.getDaysInInterval(d)
 
-            ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1)  #get the S5 of the currently selected item
+            sleep_definition = cSEL.getSleepDefinition(self.GetOption('sleep_definition'))
+            ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, sleep_definition=sleep_definition)  #get the S5 of the currently selected item
 
             if n_sel == 0:
                 s5 = s5_t
@@ -27,6 +27,9 @@ class Panel(GridGrid):
         self.name = 'All Data'
         self.compatible = 'all'
 
+        self.AddOption('lightsoff', 'text', 0, ['720'], 'At what minute of the day do lights go off?\nDay and night sleep are split here and sleep latency is calculated from this time')
+        self.AddOption('sleep_definition', 'text', 0, ['5'], 'How many minutes of inactivity define sleep? Use minutes:inactivity (5:2) for definitions allowing some activity.\nDefinitions are set in Tools > Sleep Definitions; if the data do not carry this one the first one is used')
+
     def Refresh(self):
         '''
         This function takes the coordinates coming upon tree item selection
@@ -41,6 +44,7 @@ class Panel(GridGrid):
         genotype_set, day_set, mon_set = set ([]), set ([]), set ([])
         
         t0, t1 = self.limits.isActive() * self.limits.GetVals() or (None, None)
+        lightsoff = int(self.GetOption('lightsoff'))
 
         for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate 
             
@@ -55,39 +59,31 @@ class Panel(GridGrid):
             mon_t = cSEL.getMonitorName(m, d, f) or 'All'; mon_set.add ( mon_t )
 
             #Here we gather the actual data
-            ax_t, s5_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1)[0:2]
+            sleep_definition = cSEL.getSleepDefinition(self.GetOption('sleep_definition'))
+            ax_t, s5_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, sleep_definition=sleep_definition)[0:2]
 
             #Here we set the data for the lower grid (SINGLE FLIES)
-            for d in range(ds,de) or [ds]:
-                day_sl = cSEL.getDate(d, format = 'mm/dd')
-                for f in range(fs, fe) or [fs]:
-                    
-                    mon_sl, ch_sl = cSEL.getMonitorFlyName(f)
-                     
-                    # we need these two rows because fs and ds correspond to row 0 and col 0 of our matrix
-                    fc = f - fs
-                    dc = d - ds
-    
-                    alive = s5_t[dc,fc].sum() < 1430
-                    AI = ax_t[dc,fc].sum() / (1440. - s5_t[dc,fc].sum())
-
-                    len_sleep_episodes_day = all_sleep_episodes (s5_t[dc,fc], 0, 720)
-                    len_sleep_episodes_night = all_sleep_episodes (s5_t[dc,fc], 721, 1440)
-                    num_sleep_episodes_day = number_sleep_episodes (s5_t[dc,fc], 0, 720)
-                    num_sleep_episodes_night = number_sleep_episodes (s5_t[dc,fc], 721, 1440)
-                    latency = sleep_latency(s5_t[dc,fc], lightsoff=720)
-
-                    single_fly_data.append([gen_t, day_sl, mon_sl, ch_sl, alive,
-                                        s5_t[dc,fc].sum(),
-                                        s5_t[dc,fc,0:720].sum(),
-                                        s5_t[dc,fc,720:1440].sum(),
-                                        AI,
-                                        average( len_sleep_episodes_day ),
-                                        average( num_sleep_episodes_day ),
-                                        average( len_sleep_episodes_night ),
-                                        average( num_sleep_episodes_night ),
-                                        latency
-                                        ])
+            #all the values are calculated at once for every day and every fly
+            #and the table is filled column by column, one row for each (day, fly)
+            n_days, n_flies = s5_t.shape[0:2]
+            stats = sleep_stats_by_fly(ax_t, s5_t, lightsoff)
+
+            day_sl = [cSEL.getDate(ds+dc, format = 'mm/dd') for dc in range(n_days)]
+            mon_ch = [cSEL.getMonitorFlyName(fs+fc) for fc in range(n_flies)]
+
+            columns = [np.repeat([gen_t], n_days*n_flies),
+                       np.repeat(day_sl, n_flies),
+                       np.tile([mc[0] for mc in mon_ch], n_days),
+                       np.tile([mc[1] for mc in mon_ch], n_days)]
+            columns += [stats[name].ravel() for name in ['alive', 'sleep', 'day_sleep', 'night_sleep', 'AI',
+                                                         'day_episode_length', 'day_episodes',
+                                                         'night_episode_length', 'night_episodes',
+                                                         'latency']]
+
+            if single_fly_data:
+                single_fly_data = [concatenate((a, b)) for a, b in zip(single_fly_data, columns)]
+            else:
+                single_fly_data = columns
 
             #Here we add data to the pool in case we are dealing with multiple selections
             if n_sel == 0:
@@ -104,10 +100,10 @@ class Panel(GridGrid):
         num_flies = s5.shape[1]
         num_alive = (s5.sum(axis=2)<1430).all(axis=0).sum() 
         dist_tot_sleep_by_fly = average (SleepAmountByFly (s5, t0, t1), axis=0)
-        dist_day_sleep_by_fly = average (SleepAmountByFly (s5, t0=0, t1=720), axis=0)
-        dist_night_sleep_by_fly = average (SleepAmountByFly (s5, t0=720, t1=1440), axis=0)
+        dist_day_sleep_by_fly = average (SleepAmountByFly (s5, t0=0, t1=lightsoff), axis=0)
+        dist_night_sleep_by_fly = average (SleepAmountByFly (s5, t0=lightsoff, t1=1440), axis=0)
         dist_AI_by_fly = average (ActivityIndexByFly(ax, s5), axis=0)
-        latency = sleep_latency(s5, 720)
+        latency = sleep_latency(s5, lightsoff)
         
         AVGdata = ( [list2str(genotype_set), list2str(day_set), list2str(mon_set),
                   num_flies, num_alive,
@@ -122,7 +118,7 @@ class Panel(GridGrid):
         #this places the data in the table        
         if GUI['holdplot']:
             self.sheet[0].AddRow(AVGdata)
-            self.sheet[1].AddRow(single_fly_data)
+            self.sheet[1].AddColumns(single_fly_data)
         else:
             self.sheet[0].SetData([AVGdata])
-            self.sheet[1].SetData(single_fly_data)
+            self.sheet[1].SetColumns(single_fly_data)
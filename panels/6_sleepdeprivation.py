@@ -32,6 +32,20 @@ class Panel(PlotGrid):
         self.compatible = 'all'
 
         self.AddOption('dep_thre', 'text', 0, ['80'], 'Utilize only flies that have at least this value of deprivation score (%)' )
+        self.AddOption('top_right_plot', 'radio', 0, ['Flies above threshold', 'Threshold sweep'], 'What do we show next to the distribution of SD efficiency?\nThe threshold sweep shows the rebound of the flies included at every SD efficiency threshold')
+
+        self.engines = {}
+        self.reuse_engines = False
+
+    def OnChoice(self, event):
+        '''
+        Changing rebound window does not need to extract the data again
+        '''
+        self.reuse_engines = True
+        try:
+            PlotGrid.OnChoice(self, event)
+        finally:
+            self.reuse_engines = False
 
 
 #-----------------------------------------------
@@ -50,75 +64,78 @@ class Panel(PlotGrid):
 
         genotype_set, day_set, mon_set, ch_set = set ([]), set ([]), set ([]), set([])
 
-        if GUI['choice'] == 'rebound 0-3H': tr, tr1 = 1, 180
-        elif GUI['choice'] == 'rebound 0-6H': tr, tr1 = 1, 360
-        elif GUI['choice'] == 'rebound 0-9H': tr, tr1 = 1, 540
-        elif GUI['choice'] == 'rebound TD': tr, tr1 = 1, 1440
-        elif GUI['choice'] == 'rebound RD': tr, tr1 = 1, 720
-        elif GUI['choice'] == 'rebound RN': tr, tr1 = 721, 1440
-        else: tr, tr1 = None, None
-
         #get start and end value in the limit subpanel
         t0, t1 = self.limits.isActive() * self.limits.GetVals() or (None, None)
 
-        for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+        #Baseline, SD and recovery are extracted together, once for every selection.
+        #When only the rebound window changes the engine is reused
+        key = str(allSelections)
+        if not (self.reuse_engines and key in self.engines):
+
+            for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+
+                k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+                cSEL = cDAM[k]
+
+                fs, fe = cSEL.getFliesInInterval(m, f)
+                ds, de = cSEL.getDaysInInterval(d)
+
+                s5_t = cSEL.filterbyStatus(ds,de,fs,fe)[1] #baseline, sleep deprivation and recovery days
+                status_t = cSEL.getStatusSlice(ds,de,fs,fe)
+
+                if n_sel == 0:
+                    s5 = s5_t
+                    status = status_t
+                else:
+                    s5 = concatenate ((s5, s5_t))
+                    status = concatenate ((status, status_t))
+
+            if not holdplot: self.engines = {}
+            self.engines[key] = ReboundEngine(s5, status)
 
+        engine = self.engines[key]
+
+        for n_sel, selection in enumerate(allSelections):
             k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
             cSEL = cDAM[k]
- 
-            fs, fe = cSEL.getFliesInInterval(m, f)
-            ds, de = cSEL.getDaysInInterval(d)
- 
+
             genotype_set.add ( cSEL.getGenotype() )
             mon_t = cSEL.getMonitorName(m, d, f) or 'All'; mon_set.add(mon_t)
             day_t = cSEL.getDate(d, f) or 'All'; day_set.add(day_t)
             ch_t = cSEL.getChannelName(m, f) or 'All'; ch_set.add(ch_t)
-            
-            s5_bs_t = cSEL.filterbyStatus(ds,de,fs,fe, status=1)[1] #only baseline days
-            s5_sd_t = cSEL.filterbyStatus(ds,de,fs,fe, status=2)[1] #only sleep deprivation days
-            s5_re_t = cSEL.filterbyStatus(ds,de,fs,fe, status=3)[1] #only recovery days
-            
-            if n_sel == 0:
-                s5_bs = s5_bs_t
-                s5_sd = s5_sd_t
-                s5_re = s5_re_t
-            else:
-                s5_bs = concatenate ((s5_bs, s5_bs_t))
-                s5_sd = concatenate ((s5_sd, s5_sd_t))
-                s5_re = concatenate ((s5_re, s5_re_t))
-
-                
-        # OUT OF THE LOOP HERE    
+
+        tr, tr1 = engine.getWindow(GUI['choice'])
+
         # First we calculate the SD efficiency
-        bs_sleep = average(SleepAmountByFly (s5_bs, t0=t0, t1=t1), axis=0)
-        sd_sleep = average(SleepAmountByFly (s5_sd, t0=t0, t1=t1), axis=0)
-        dist_sde = (1.0 - (sd_sleep / bs_sleep)) * 100 # FIRST VALUE TO PLOT
+        dist_sde = engine.getEfficiency(t0, t1) # FIRST VALUE TO PLOT
         self.canExport(dist_sde, 'Distribution SD Efficiency', 'The Distribution of Sleep Deprivation efficiency of selected flies')
+        self.canExport(engine.getReboundColumns(t0, t1), 'Rebound all windows', 'SD efficiency, recovery and rebound of every selected fly for all the rebound windows')
+        self.canExport(engine.getReboundCurves(), 'Cumulative rebound', 'The cumulative rebound (%) of every selected fly, minute by minute of the recovery day')
 
         # Now we mask all those flies for which eff. was less than the specified value
         min_sde = int(self.GetOption('dep_thre')) # Minimal sleep dep efficiency for flies to be included (%)
-        mask_sde = dist_sde < min_sde # this is our mask (1-d array, long as many flies we have)
+        mask_sde = np.ma.filled(dist_sde < min_sde, True) # this is our mask (1-d array, long as many flies we have)
 
         #This is what we are going to plot in panel a
         dist_sde_sel = np.ma.masked_array(dist_sde, mask=mask_sde) # dist of only selected (above the threshold)
         dist_sde_rem = np.ma.masked_array(dist_sde, mask= (mask_sde == False)) # dist of only remaining (below the threshold)
 
         #Now we calculate the gain in minutes for recovery day, only in flies above the threshold
-        re_sleep = average(SleepAmountByFly (s5_re, t0=tr, t1=tr1), axis=0)
-        bs_sleep = average(SleepAmountByFly (s5_bs, t0=tr, t1=tr1), axis=0)
-        dist_re_mins_all = re_sleep - bs_sleep
+        dist_re_mins_all = engine.getRecovery(tr, tr1)
         dist_re_mins = np.ma.masked_array(dist_re_mins_all, mask=mask_sde) # dist of only selected (above the threshold) Plot in panel b
     
         #Now we calculate the Rebound, meaning the recovery in mins / effective sleep of sd day
         # Rebound = (RE - BS) / (BS - SD)
-        bs_all = average(SleepAmountByFly (s5_bs), axis=0)
-        sd_all = average(SleepAmountByFly (s5_sd), axis=0)
-        dist_rebound_all = ((re_sleep - bs_sleep) / (bs_all - sd_all)) * 100
+        dist_rebound_all = engine.getRebound(tr, tr1)
         dist_rebound = np.ma.masked_array((dist_rebound_all), mask=mask_sde)
 
+        #Rebound, sleep gain and number of flies included for every threshold between 0 and 100%
+        sweep = engine.getThresholdSweep(np.arange(0, 101), t0, t1, tr, tr1)
+        self.canExport(sweep, 'SD efficiency threshold sweep', 'Number of flies, rebound and sleep gain for every SD efficiency threshold from 0 to 100%')
+
         #In the table
-        num_flies = s5_bs.shape[1]
-        num_alive = (s5_bs.sum(axis=2)<1430).all(axis=0).sum()
+        num_flies = len(dist_sde)
+        num_alive = engine.getAlive()
         num_dep = num_flies - dist_sde_sel.mask.sum()
         rebound_avg = average(dist_rebound)
         rebound_std = stde(dist_rebound)
@@ -144,10 +161,10 @@ class Panel(PlotGrid):
             datarow.append(color_name)
             self.sheet.SetData ([datarow])
 
-        self.canvas.redraw(self.rebound_plot, title, dist_sde_sel.compressed() , dist_sde_rem.compressed(), dist_re_mins, dist_rebound, dist_sde, dist_re_mins_all, pos, color )
+        self.canvas.redraw(self.rebound_plot, title, dist_sde_sel.compressed() , dist_sde_rem.compressed(), dist_re_mins, dist_rebound, dist_sde, dist_re_mins_all, pos, color, sweep, min_sde )
         self.WriteComment(cSEL.Comment or '')
 
-    def rebound_plot(self, fig, t, dist_sde_sel , dist_sde_rem, dist_re_mins, dist_rebound, all_sde, all_reb, pos, col ):
+    def rebound_plot(self, fig, t, dist_sde_sel , dist_sde_rem, dist_re_mins, dist_rebound, all_sde, all_reb, pos, col, sweep, min_sde ):
         '''
         '''
 
@@ -176,16 +193,30 @@ class Panel(PlotGrid):
         
         
         a5 = fig.add_axes([0.70, 0.55, 0.20, 0.35])
-        n_low_sde_thre = len(dist_sde_rem)
-        n_hig_sde_thre = len(dist_sde_sel)
 
-        #if plot_legend:
-        b1 = a5.bar(1, n_low_sde_thre, color=brighten(col) , align='center')
-        b2 = a5.bar(2, n_hig_sde_thre, color=col , align='center')
-        a5.legend( (b1[0], b2[0]), ('<SDE', '>SDE') )
+        if self.GetOption('top_right_plot') == 'Threshold sweep':
+            sweep = dict(sweep)
+            a5.plot(sweep['threshold'], sweep['rebound'], '-', color=col)
+            a5.axvline(min_sde, color=brighten(col))
+            a5.set_xlim((0, 100))
+            a5.set_xlabel('SDE threshold (%)')
+            a5.set_ylabel('Rebound (%)')
+
+            a6 = a5.twinx()
+            a6.plot(sweep['threshold'], sweep['n'], ':', color=col)
+            a6.set_ylabel('n. of flies')
+
+        else:
+            n_low_sde_thre = len(dist_sde_rem)
+            n_hig_sde_thre = len(dist_sde_sel)
+
+            #if plot_legend:
+            b1 = a5.bar(1, n_low_sde_thre, color=brighten(col) , align='center')
+            b2 = a5.bar(2, n_hig_sde_thre, color=col , align='center')
+            a5.legend( (b1[0], b2[0]), ('<SDE', '>SDE') )
 
-        a5.set_xticks([])
-        a5.set_xticklabels([])
+            a5.set_xticks([])
+            a5.set_xticklabels([])
 
         
         
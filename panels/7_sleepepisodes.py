@@ -29,6 +29,8 @@ class Panel(PlotGrid):
         self.name = 'Sleep Episodes'
         self.compatible = 'all'
 
+        self.AddOption('lightsoff', 'text', 0, ['720'], 'At what minute of the day do lights go off?\nSleep latency is calculated from this time')
+
 #-----------------------------------------------
 
     def Refresh(self):
@@ -82,7 +84,7 @@ class Panel(PlotGrid):
         len_sleep_episodes_night = all_sleep_episodes (s5, 721, 1440)
         num_sleep_episodes_day = number_sleep_episodes (s5, 0, 720)
         num_sleep_episodes_night = number_sleep_episodes (s5, 721, 1440)
-        latency = sleep_latency(s5, lightsoff=720)
+        latency = sleep_latency(s5, lightsoff=int(self.GetOption('lightsoff')))
 
         longest_sleep_episode = max( len_sleep_episodes_night )
         frag_factor = 1
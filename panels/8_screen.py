@@ -10,6 +10,9 @@ from default_panels import *
 
 class Panel(PlotGrid): #Class name must be Panel
 
+    #the screen grows with every selection drawn: nothing can be replayed from the cache
+    cacheOverlays = False
+
     def __init__(self, parent):
 
     #Here some variable specific to the PanelType
@@ -18,8 +21,8 @@ class Panel(PlotGrid): #Class name must be Panel
 
         CanvasInitialSize = (-1,-1)# size in inches or userDefined (-1,-1)
 
-        colLabels = ['Genotype','Mon','Ch','alive','sleep TD','st.dv.','sleep RD','st.dv.','sleep RN','st.dv.','AI','st.dv','BA','st.dv.']
-        dataTypes = [gridlib.GRID_VALUE_STRING] * 3 + [gridlib.GRID_VALUE_NUMBER] *1 + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 10
+        colLabels = ['Genotype','Mon','Ch','alive','sleep TD','st.dv.','sleep RD','st.dv.','sleep RN','st.dv.','AI','st.dv','BA','st.dv.','z TD','z RD','z RN','z AI','z BA']
+        dataTypes = [gridlib.GRID_VALUE_STRING] * 3 + [gridlib.GRID_VALUE_NUMBER] *1 + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 15
 
         choiceList = ['sleep TD','sleep RD','sleep RN']
 
@@ -34,6 +37,11 @@ class Panel(PlotGrid): #Class name must be Panel
         self.compatible = '0.9.1'
         
         self.AddOption('use_first_day', 'boolean', 1, ['Use first day', 'Do not use first day'], 'Do you want to include data from the first day?')
+        self.AddOption('ba_length', 'radio', 0, ['1', '2', '3'], 'Longest stretch of wake, in minutes, counted as brief awakening')
+        self.AddOption('hit_threshold', 'text', 0, ['2.5'], 'Lines whose average z-score (normalized on the plate) is at least this far from 0 are listed as hits')
+        self.AddOption('hit_min_flies', 'text', 0, ['8'], 'Minimum number of flies a line needs to be listed as a hit')
+
+        self.screen = None
 
 
     def Refresh(self):
@@ -54,8 +62,6 @@ class Panel(PlotGrid): #Class name must be Panel
         min_alive = userConfig['min_sleep'] #int
         max_alive = userConfig['max_sleep'] #int
         use_std = userConfig['use_std'] #boolean, if False we should use stde
-        if use_std: cStd = std
-        else: cStd = stde 
 
         #get start and end value in the limit subpanel
         t0, t1 = self.limits.isActive() * self.limits.GetVals() or (None, None)
@@ -63,77 +69,33 @@ class Panel(PlotGrid): #Class name must be Panel
         #start setting some variable that we are going to use later
         genotype_set, day_set, mon_set, ch_set = set ([]), set ([]), set ([]), set([])
 
-        #for each one of the selection we want to pull togheter
-        headers = []
-        for k, cSEL in enumerate(cDAM):
-            fs, fe = 0, -1 #it takes all flies
-            
+        #The screen is streamed one DAMslice at a time: for every fly we keep only its
+        #averages over days, for every line and every plate only running sums.
+        #It is computed again only when the table has been cleared
+        if self.screen is None or self.sheet.GetNumberRows() <= 1:
+            self.screen = ScreenEngine(use_std=use_std, ba_length=int(self.GetOption('ba_length')))
+
             use_first_day = self.GetOption('use_first_day')
             if use_first_day:
-                ds, de = 0, -1 #it takes all days but the first one
+                ds, de = 0, -1 #it takes all days
             else:
                 ds, de = 1, -1 #it takes all days but the first one
-                
-            m = -1 #takes all monitors
-            ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive) 
-
-            n_flies = ax_t.shape[1]
-            for fly in range(n_flies):
-                genotype = cSEL.getGenotype()
-                mon, ch = cSEL.getMonitorFlyName(fly)
-                headers.append([genotype, mon, ch])
-    
-            if k == 0:
-                s5 = s5_t
-                ax = ax_t
-                s30 = s30_t
-            else:
-                s5 = concatenate ((s5, s5_t), axis=1)
-                ax = concatenate ((ax, ax_t), axis=1)
-                s30 = concatenate ((s30, s30_t), axis=1)
-
-        # at the end of this loop we have the 3 basic arrays: s5, ax, s30
-        dist_tot_sleep_by_fly = average ( s5[:,:,t0:t1].sum(axis=2), axis=0)
-        dist_std_tot_sleep_by_fly = cStd ( s5[:,:,t0:t1].sum(axis=2), axis=0)
-        dist_day_sleep_by_fly = average( s5[:,:,0:720].sum(axis=2), axis=0)
-        dist_std_day_sleep_by_fly = cStd( s5[:,:,0:720].sum(axis=2), axis=0)
-        dist_night_sleep_by_fly = average( s5[:,:,720:1440].sum(axis=2), axis=0)
-        dist_std_night_sleep_by_fly = cStd( s5[:,:,720:1440].sum(axis=2), axis=0)
-        dist_AI_by_fly = average (ActivityIndexByFly(ax, s5, t0, t1), axis=0)
-        dist_std_AI_by_fly = cStd (ActivityIndexByFly(ax, s5, t0, t1), axis=0)
-        dist_BA_by_fly = average ( ba(s5[:,:,t0:t1]).sum(axis=2), axis=0)  
-        dist_std_BA_by_fly = cStd ( ba(s5[:,:,t0:t1]).sum(axis=2), axis=0)  
-
-        # we now calculate the data to be placed in the table
-        # Single number averages of all flies and their standard deviations
-        if len(self.sheet.GetData()) <= 1:
-            self.sheet.SetData ([])
-
-            datarow = []
-            for fly, heads in enumerate(headers):
-                datarow.append([])
-                genotype, mon, ch = heads
-                tot_sleep = dist_tot_sleep_by_fly[fly]; std_tot_sleep = dist_std_tot_sleep_by_fly[fly]
-                alive = tot_sleep>0
-    
-                day_sleep = dist_day_sleep_by_fly[fly]; std_day_sleep = dist_std_day_sleep_by_fly[fly]
-                night_sleep = dist_night_sleep_by_fly[fly];std_night_sleep = dist_std_night_sleep_by_fly[fly]
-                AI = dist_AI_by_fly[fly]; std_AI = dist_std_AI_by_fly[fly]
-                BA = dist_BA_by_fly[fly]; std_BA = dist_std_BA_by_fly[fly]
-                
-                datarow[-1] = [genotype,
-                           mon,
-                           ch,
-                           alive,
-                           tot_sleep, std_tot_sleep,
-                           day_sleep, std_day_sleep,
-                           night_sleep, std_night_sleep,
-                           AI, std_AI,
-                           BA, std_BA]
-    
-            self.sheet.SetData (datarow)
-        
-            
+
+            fs, fe = 0, -1 #it takes all flies
+            for k, cSEL in enumerate(cDAM):
+                ax_t, s5_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)[0:2]
+                self.screen.addSlice(cSEL, ax_t, s5_t)
+
+            # we now place the data in the table, one row per fly
+            columns = [self.screen.getColumn('genotype'), self.screen.getColumn('monitor'), self.screen.getColumn('channel'),
+                       self.screen.getColumn('sleep TD') > 0]
+            for metric in self.screen.metrics:
+                columns += [self.screen.getColumn(metric), self.screen.getColumn(metric, stdev=True)]
+            for metric in self.screen.metrics:
+                columns.append(self.screen.getZScores(metric))
+
+            self.sheet.SetColumns (columns)
+
         #Here we select what we have to mark blue in the distribution
         for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
             k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
@@ -146,23 +108,26 @@ class Panel(PlotGrid): #Class name must be Panel
 
 
         #Here we pass the data according to what the selection was
-        if GUI['choice'] == 'sleep TD':
-            dist_sleep = dist_tot_sleep_by_fly
-        elif GUI['choice'] == 'sleep RD':
-            dist_sleep =  dist_day_sleep_by_fly
-        elif GUI['choice'] == 'sleep RN':
-            dist_sleep =  dist_night_sleep_by_fly
-
-        dist_AI = dist_AI_by_fly
+        metric = GUI['choice'] or 'sleep TD'
+        dist_sleep = self.screen.getColumn(metric)
+        dist_AI = self.screen.getColumn('AI')
         dist_nSE = 0
-        
-        self.canvas.redraw(self.plot_distributions, selected_sleep, dist_sleep, selected_ai, dist_AI, dist_nSE)
+
+        #Lines whose flies are consistently away from the rest of their plates
+        threshold = float(self.GetOption('hit_threshold'))
+        min_flies = int(self.GetOption('hit_min_flies'))
+        line_scores = self.screen.getLineScores(metric)
+        hits = self.screen.getHits(metric, threshold, min_flies)
+        self.canExport(line_scores, 'Screen lines', 'Average and z-score of %s for every line of the screen' % metric)
+        self.canExport(hits, 'Screen hits', 'Lines of the screen whose z-score of %s is beyond the threshold' % metric)
+
+        self.canvas.redraw(self.plot_distributions, selected_sleep, dist_sleep, selected_ai, dist_AI, dist_nSE, line_scores[-1][1], threshold)
 
 
         self.WriteComment(cSEL.Comment or '')
 
 
-    def plot_distributions(self, fig, selected_sleep, dist_sleep, selected_ai, dist_AI, dist_nSE):
+    def plot_distributions(self, fig, selected_sleep, dist_sleep, selected_ai, dist_AI, dist_nSE, line_z, threshold):
         '''
         '''
         def find_bin_bounds(bins, x):
@@ -195,4 +160,11 @@ class Panel(PlotGrid): #Class name must be Panel
         a2.set_ylabel('n. of flies')
         a2.set_ylim(min(n)*1.1, max(n)*1.1)
 
-    
+        a3 = fig.add_subplot(312)
+        a3.set_title('Lines z-score')
+        line_z = np.sort(line_z.compressed())
+        a3.plot(line_z, 'o', ms=3, color=color)
+        a3.axhline(threshold, color=color1)
+        a3.axhline(-threshold, color=color1)
+        a3.set_ylabel('z-score')
+        a3.set_xlim((-1, len(line_z)))
@@ -15,8 +15,8 @@ class Panel(PlotGrid):
         PanelProportion = [6,2,1]    #0 = not_show
         CanvasInitialSize = (-1,-1)     #size in inches
 
-        colLabels = ['Genotype','Day','Mon','Ch','n(tot)','n(a)','sleep TD','st.dv.','sleep RD','st.dv.','sleep RN','st.dv.','AI','','st.dv','','color' ]
-        dataTypes = [gridlib.GRID_VALUE_STRING] * 4 + [gridlib.GRID_VALUE_NUMBER] *2 + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 10 + [gridlib.GRID_VALUE_STRING]
+        colLabels = ['Genotype','Day','Mon','Ch','n(tot)','n(a)','sleep onset','st.dv.','activity peak','st.dv.','color' ]
+        dataTypes = [gridlib.GRID_VALUE_STRING] * 4 + [gridlib.GRID_VALUE_NUMBER] *2 + [gridlib.GRID_VALUE_FLOAT + ':6,2'] * 4 + [gridlib.GRID_VALUE_STRING]
 
         PlotGrid.__init__(self, parent,
                                          PanelProportion,
@@ -69,70 +69,59 @@ class Panel(PlotGrid):
             ds, de = cSEL.getDaysInInterval(d)
 
             ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1)  #get the S5 of the currently selected item
+            ax30_t, sleep30_t = cSEL.getBinned(ds,de,fs,fe,30,t0,t1) #activity in bins of 30 minutes
 
             if n_sel == 0:
                 s5 = s5_t
-                ax = ax_t
+                ax30 = ax30_t
                 s30 = s30_t
             else:
                 s5 = concatenate ((s5, s5_t))
-                ax = concatenate ((ax, ax_t))
+                ax30 = concatenate ((ax30, ax30_t))
                 s30 = concatenate ((s30, s30_t))
 
         #OUT OF THE LOOP HERE
         
-        d,f,c = ax.shape
+        num_flies = s5.shape[1]
+        num_alive = (s5.sum(axis=2)<1430).all(axis=0).sum()
 
         #
-        #finds the bin where activity peaks within the given mask
+        #finds the bin of 30 minutes where activity peaks within the given mask
+        #and the first minute at which sleep gets consolidated, for every day and every fly
         #
-        ax30 = ax.reshape((d,f,48,c/48)).sum(axis=3) # divides in 48 bins to sum up activity in bin of 30mins
-        peak_mask = ones((d,f,48))
         left = int(self.GetOption('mask_left'))
         right = int(self.GetOption('mask_right'))
-        peak_mask[:,:,left:right] = False
-        ax30.mask = peak_mask
-        peak_30 = ax30.argmax(axis=2)
-        peak_avg = average(peak_30, axis=0)
-        #peak_avg.compressed().tofile('avg1.csv', sep='\n')
-        
+        peak_30, ax30 = activity_peak(ax30, left, right, bin_length=1)
 
-        #this code is very ugly
-        xmin = int(self.GetOption('thre_sleep_onset'))
-        first_xmin_ep = np.zeros((d,f), dtype=np.int)
-        for ds in range(d):
-            for fs in range(f):
-                a = s30[ds,fs].compressed()
-                v = np.where(a >= xmin)
-                try: 
-                    v = np.min(v[0])
-                except: 
-                    v = 0
-                first_xmin_ep[ds,fs] = int(v)
-        
-        print average(first_xmin_ep)
-        first_xmin_ep.tofile('avg1.csv', sep='\n')
-        
-        
+        thre_sleep_onset = int(self.GetOption('thre_sleep_onset'))
+        first_xmin_ep = consolidated_sleep_onset(s30, thre_sleep_onset)
+
+        #both are given in minutes
+        dist_onset_by_fly = average(first_xmin_ep, axis=0)
+        dist_peak_by_fly = average(peak_30, axis=0) * 30
 
+        datarow = [list2str(genotype_set), list2str(day_set),
+                   list2str(mon_set), list2str(ch_set),
+                   num_flies, num_alive,
+                   average(dist_onset_by_fly), std(dist_onset_by_fly),
+                   average(dist_peak_by_fly), std(dist_peak_by_fly)]
 
-       
         if holdplot:
             color, color_name = getPlottingColor(pos-1)
-            #datarow.append(color_name)
-            #self.sheet.AddRow (datarow)
+            datarow.append(color_name)
+            self.sheet.AddRow (datarow)
         else:
             color, color_name = getPlottingColor(pos-1)
-            #datarow.append(color_name)
-            #self.sheet.SetData ([datarow])
+            datarow.append(color_name)
+            self.sheet.SetData ([datarow])
 
         
         title = ''
 
-        self.canvas.redraw(self.plot_peak, title, ax30, color)
+        self.canvas.redraw(self.plot_peak, title, ax30, left, right, color)
         
         
-    def plot_peak(self, fig, title, ax30, col):
+    def plot_peak(self, fig, title, ax30, left, right, col):
         '''
         '''
                 #Draw the Activity plot
@@ -143,12 +132,13 @@ class Panel(PlotGrid):
         
         a1 = fig.add_subplot(311)
 
+        #the part of the profile where we look for the peak is drawn in full color
         ax30_avg = average(average(ax30, axis=1), axis=0) 
-        a1.plot(ax30_avg, color=col)
+        in_mask = np.zeros(ax30_avg.shape, dtype=bool)
+        in_mask[left:right] = True
 
-        ax30.mask = (ax30.mask == False)
-        ax30_avg = average(average(ax30, axis=1), axis=0) 
-        a1.plot(ax30_avg, color=brighten(col))
+        a1.plot(np.ma.masked_where(~in_mask, ax30_avg), color=col)
+        a1.plot(np.ma.masked_where(in_mask, ax30_avg), color=brighten(col))
         
         #a1.grid(use_grid)
         a1.set_title(title)
@@ -19,7 +19,9 @@
 #       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #       MA 02110-1301, USA.
 
-import sys
+import sys, ast
+from copy import copy as shallowcopy #numpy.ma has its own copy
+from cStringIO import StringIO
 sys.path.append('..')
 from pysolo_lib import *
 from pysolo_options import pySoloOption, PreferenceFileFound, SavePreferenceFile, userConfig, customUserConfig
@@ -35,6 +37,17 @@ import matplotlib as mpl
 
 import wx.lib.newevent
 myEVT_OPTIONSB_SHOW_HIDE, EVT_OPTIONSB_SHOW_HIDE = wx.lib.newevent.NewCommandEvent()
+myEVT_FILE_MODIFIED, EVT_FILE_MODIFIED = wx.lib.newevent.NewCommandEvent()
+
+def SetFileAsModified(target):
+    """
+    Starts an EVENT telling around that the file has been
+    modified from its original form
+    """
+    #create the event
+    evt = myEVT_FILE_MODIFIED(wx.NewId(), Modified=True)
+    #post the event
+    wx.PostEvent(target, evt)
 
 
 class FileDrop(wx.FileDropTarget):
@@ -237,6 +250,27 @@ class customDataTable(gridlib.PyGridTableBase):
                 gridlib.GridTableMessage(None,
                 gridlib.GRIDTABLE_REQUEST_VIEW_GET_VALUES))
 
+    def _columnValues(self, column):
+        '''
+        Returns the values of column as a list. Arrays of strings give python strings
+        '''
+        if isinstance(column, np.ndarray) and column.dtype.kind in 'SU':
+            return np.ma.getdata(column).tolist()
+        return list(column)
+
+    def SetColumns(self, columns):
+        '''
+        Set the whole content of the table to the given list of columns
+        '''
+        self.SetData([list(row) for row in zip(*map(self._columnValues, columns))])
+
+    def AddColumns(self, columns):
+        '''
+        Add at the bottom of the table the rows given as a list of columns
+        '''
+        rows = [list(row) for row in zip(*map(self._columnValues, columns))]
+        if rows: self.AddRow(rows)
+
     def SetRow (self, row, data):
         data = self.cleanFromMask(data)
         try:
@@ -296,6 +330,16 @@ class customDataTable(gridlib.PyGridTableBase):
     def CanSetValueAs(self, row, col, typeName):
         return self.CanGetValueAs(row, col, typeName)
 
+    def TextColumns(self, rows=None, cols=None):
+        '''
+        Returns the content of the given rows and cols as a list of
+        (column label, array of strings), the way it is copied or exported
+        '''
+        if rows is None: rows = range(self.GetNumberRows())
+        if cols is None: cols = range(self.GetNumberCols())
+
+        return [(self.colLabels[col], np.array([str(self.GetValue(row, col)) for row in rows], dtype=str)) for col in cols]
+
     def cleanFromMask(self, l):
         '''
         Goes through the list l and make sure it doesn't contain
@@ -318,6 +362,399 @@ class customDataTable(gridlib.PyGridTableBase):
         return l
 
 
+class columnDataTable(customDataTable):
+    '''
+    A read only table that stores its content column by column.
+    Numerical columns are kept in masked numpy arrays, all other columns
+    in numpy arrays of objects. Rows are never moved: sorting and filtering
+    only change self.view, the array of stored rows shown in the grid,
+    and the grid fetches the values of the visible cells only.
+    Masked values are shown as '--', empty numerical values as ''
+    '''
+    numericTypes = [gridlib.GRID_VALUE_NUMBER, gridlib.GRID_VALUE_FLOAT]
+
+    def __init__(self, colLabels, dataTypes, useValueCleaner=True):
+        self.columns = []
+        self.view = np.arange(0)
+        self._ranks = {}
+        customDataTable.__init__(self, colLabels, dataTypes, useValueCleaner)
+
+    #--------------------------------------------------
+    # column store
+
+    def isNumeric(self, col):
+        '''
+        Is the column stored in a numerical array?
+        '''
+        return np.ma.isMaskedArray(self.columns[col])
+
+    def _makeColumn(self, col, values):
+        '''
+        Converts the list of values to be placed in column col
+        A numerical (masked) array is taken as it is, without looking at its values one by one
+        '''
+        isNumeric = self.dataTypes[col].split(':')[0] in self.numericTypes
+
+        if isNumeric and isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+            column = np.ma.masked_array(np.ma.getdata(values).astype(np.float64).ravel(),
+                                        mask=np.ma.getmaskarray(values).ravel().copy())
+            if self.useValueCleaner:
+                with np.errstate(invalid='ignore'):
+                    column[column.filled(0) >= 999999] = np.ma.masked
+            return column
+
+        values = self._columnValues(values)
+        masked = [np.ma.is_masked(v) or (type(v) == str and v == '--') for v in values]
+
+        if isNumeric:
+            try:
+                numbers = [np.nan if (m or v is None or v == '') else v for v, m in zip(values, masked)]
+                column = np.ma.masked_array(np.array(numbers, dtype=np.float64), mask=masked)
+                if self.useValueCleaner:
+                    with np.errstate(invalid='ignore'):
+                        column[column.filled(0) >= 999999] = np.ma.masked
+                return column
+            except (ValueError, TypeError):
+                pass
+
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        if self.useValueCleaner:
+            column[np.array(masked, dtype=bool)] = '--'
+            for n, v in enumerate(column):
+                try:
+                    if type(v) != str and v >= 999999: column[n] = '--'
+                except:
+                    pass
+        return column
+
+    def _appendColumns(self, columns):
+        '''
+        Appends the given columns at the bottom of the stored ones
+        Numerical columns receiving non numerical values are turned into object columns
+        '''
+        for col, new in enumerate(columns):
+            old = self.columns[col]
+            if np.ma.isMaskedArray(old) and np.ma.isMaskedArray(new):
+                self.columns[col] = np.ma.concatenate((old, new))
+            else:
+                self.columns[col] = np.concatenate((self._asObject(col, old), self._asObject(col, new)))
+        self._ranks = {}
+
+    def _asObject(self, col, column):
+        '''
+        Returns column as an array of objects, the way it is shown in the grid
+        '''
+        if not np.ma.isMaskedArray(column): return column
+        obj = np.empty(len(column), dtype=object)
+        obj[:] = column.filled(np.nan).tolist()
+        if self.dataTypes[col].split(':')[0] == gridlib.GRID_VALUE_NUMBER:
+            obj[:] = [int(v) if v == v else v for v in obj]
+        obj[np.isnan(column.filled(0))] = ''
+        obj[np.ma.getmaskarray(column)] = '--'
+        return obj
+
+    def _rowsToColumns(self, rows):
+        '''
+        Transposes a list of rows into a list of new columns
+        '''
+        n_cols = self.GetNumberCols()
+        rows = [list(row[:n_cols]) + [''] * (n_cols - len(row)) for row in rows]
+        if rows:
+            return [self._makeColumn(col, values) for col, values in enumerate(zip(*rows))]
+        else:
+            return [self._makeColumn(col, []) for col in range(n_cols)]
+
+    def _makeColumns(self, columns):
+        '''
+        Converts a list of sequences, one for each column, into a list of new columns
+        Missing columns are left empty
+        '''
+        n_cols = self.GetNumberCols()
+        columns = list(columns[:n_cols])
+        n = len(columns[0]) if columns else 0
+        columns += [[''] * n] * (n_cols - len(columns))
+        return [self._makeColumn(col, values) for col, values in enumerate(columns)]
+
+    def _setRows(self, rows):
+        '''
+        Replaces the content of the table without notifying the grid
+        '''
+        self.columns = self._rowsToColumns(rows or [])
+        self.view = np.arange(self.GetStoredRows())
+        self._ranks = {}
+
+    def _getRows(self):
+        '''
+        Returns the visible content of the table as a list of rows
+        '''
+        return [[self.GetValue(row, col) for col in range(self.GetNumberCols())] for row in range(self.GetNumberRows())]
+
+    data = property(_getRows, _setRows)
+
+    def GetStoredRows(self):
+        '''
+        Return the number of rows stored, including the ones hidden by filtering
+        '''
+        if self.columns:
+            return len(self.columns[0])
+        else:
+            return 0
+
+    def _notifyRows(self, old_rows):
+        '''
+        Tells the grid that the number of visible rows changed from old_rows
+        and that values need to be fetched again
+        '''
+        n_rows = self.GetNumberRows()
+        if n_rows > old_rows:
+            self.GetView().ProcessTableMessage(
+                    gridlib.GridTableMessage(self,
+                    gridlib.GRIDTABLE_NOTIFY_ROWS_APPENDED,
+                    n_rows - old_rows ))
+        elif n_rows < old_rows:
+            self.GetView().ProcessTableMessage(
+                    gridlib.GridTableMessage(self,
+                    gridlib.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                    0, old_rows - n_rows ))
+
+        self.GetView().ProcessTableMessage(
+                gridlib.GridTableMessage(self,
+                gridlib.GRIDTABLE_REQUEST_VIEW_GET_VALUES))
+
+    #--------------------------------------------------
+    # required methods for the wxPyGridTableBase interface
+
+    def GetNumberRows(self):
+        return len(self.view)
+
+    def IsEmptyCell(self, row, col):
+        v = self.GetValue(row, col)
+        return v is None or (type(v) == str and v == '')
+
+    def ClearTable(self):
+        '''
+        Clear the table
+        '''
+        self.GetView().ProcessTableMessage(
+                gridlib.GridTableMessage(self,
+                gridlib.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                0, self.GetNumberRows() ))
+        self._setRows([])
+
+    def GetValue(self, row, col):
+        '''
+        (row, col)
+        Get value at given coordinates
+        '''
+        try:
+            column = self.columns[col]
+            v = column[self.view[row]]
+        except IndexError:
+            return ''
+
+        if not np.ma.isMaskedArray(column):
+            return v
+        elif v is np.ma.masked:
+            return '--'
+        elif np.isnan(v):
+            return ''
+        elif self.dataTypes[col].split(':')[0] == gridlib.GRID_VALUE_NUMBER:
+            return int(v)
+        else:
+            return float(v)
+
+    def InsertColumn(self, col_pos, col_type=gridlib.GRID_VALUE_FLOAT+':6,2', col_label=''):
+        '''
+        Add one grid column before col_pos, with type set to col_type and label col_label
+        '''
+        self.dataTypes.insert(col_pos, col_type)
+        self.colLabels.insert(col_pos, col_label)
+        self.columns.insert(col_pos, self._makeColumn(col_pos, [''] * self.GetStoredRows()))
+        self._ranks = {}
+
+        self.GetView().ProcessTableMessage(
+                gridlib.GridTableMessage(self,
+                gridlib.GRIDTABLE_NOTIFY_COLS_INSERTED,
+                col_pos, 1         ))
+
+    def _sortKey(self, col):
+        '''
+        Returns an integer or float array that sorts as the stored values of col
+        masked and empty values go last
+        '''
+        column = self.columns[col]
+        if np.ma.isMaskedArray(column):
+            return column.filled(np.inf)
+        if col not in self._ranks:
+            try:
+                self._ranks[col] = np.unique(column, return_inverse=True)[1]
+            except TypeError:
+                self._ranks[col] = np.unique(column.astype(str), return_inverse=True)[1]
+        return self._ranks[col]
+
+    def Sort(self, bycols, descending=False):
+        '''
+        sort the table by multiple columns
+            bycols:  a list (or tuple) specifying the column numbers to sort by
+                   e.g. (1,0) would sort by column 1, then by column 0
+            descending: specify sorting order
+        '''
+        if len(self.view) and len(bycols):
+            keys = [self._sortKey(col)[self.view] for col in reversed(bycols)]
+            order = np.lexsort(keys)
+            if descending: order = order[::-1]
+            self.view = self.view[order]
+
+        msg=wx.grid.GridTableMessage(self, wx.grid.GRIDTABLE_REQUEST_VIEW_GET_VALUES)
+        self.GetView().ProcessTableMessage(msg)
+
+    def Filter(self, bycol=None, values=None):
+        '''
+        Show only the rows whose value in column bycol is one of values
+        If bycol is None all the rows are shown again, in their original order
+        '''
+        old_rows = self.GetNumberRows()
+
+        if bycol is None:
+            self.view = np.arange(self.GetStoredRows())
+        else:
+            column = self.columns[bycol]
+            if np.ma.isMaskedArray(column):
+                keep = np.in1d(column.filled(np.nan), values) & ~np.ma.getmaskarray(column)
+            else:
+                keep = np.array([v in values for v in column], dtype=bool)
+            self.view = np.flatnonzero(keep)
+
+        self._notifyRows(old_rows)
+
+    def AddRow (self, rows):
+        '''
+        Add one or more rows at the bottom of the table / sheet
+        row can be an array of values or a 2-dimenstional array of rows and values
+        '''
+        if type(rows[0]) != list:
+            rows = [rows]
+
+        old_rows = self.GetNumberRows()
+        n_stored = self.GetStoredRows()
+        self._appendColumns(self._rowsToColumns(rows))
+        self.view = np.concatenate((self.view, np.arange(n_stored, self.GetStoredRows())))
+        self._notifyRows(old_rows)
+
+    def RemRow (self, rows):
+        '''
+        Remove one or more rows
+        '''
+        old_rows = self.GetNumberRows()
+        drop = self.view[np.array(rows, dtype=int) - 1]
+
+        keep = np.ones(self.GetStoredRows(), dtype=bool)
+        keep[drop] = False
+        self.columns = [column[keep] for column in self.columns]
+        self._ranks = {}
+
+        new_index = np.cumsum(keep) - 1
+        self.view = new_index[self.view[keep[self.view]]]
+        self._notifyRows(old_rows)
+
+    def SetData(self, data=None):
+        '''
+        Set the whole content of the table to data
+        '''
+        self.ClearTable()
+        self._setRows(data)
+        self._notifyRows(0)
+
+    def SetColumns(self, columns):
+        '''
+        Set the whole content of the table to the given list of columns
+        '''
+        self.ClearTable()
+        self.columns = self._makeColumns(columns)
+        self.view = np.arange(self.GetStoredRows())
+        self._ranks = {}
+        self._notifyRows(0)
+
+    def AddColumns(self, columns):
+        '''
+        Add at the bottom of the table the rows given as a list of columns
+        '''
+        old_rows = self.GetNumberRows()
+        n_stored = self.GetStoredRows()
+        self._appendColumns(self._makeColumns(columns))
+        self.view = np.concatenate((self.view, np.arange(n_stored, self.GetStoredRows())))
+        self._notifyRows(old_rows)
+
+    def SetRow (self, row, data):
+        try:
+            stored = self.view[row]
+        except IndexError:
+            self.AddRow(data)
+            return
+
+        for col, value in enumerate(self._rowsToColumns([data])):
+            self._setStored(stored, col, value)
+
+    def SetValue(self, row, col, value):
+        '''
+        (row, col, value)
+        Set Value for cell at given coordinates
+        '''
+        try:
+            stored = self.view[row]
+        except IndexError:
+            # add a new row
+            new_row = [''] * self.GetNumberCols()
+            new_row[col] = value
+            self.AddRow(new_row)
+            return
+
+        self._setStored(stored, col, self._makeColumn(col, [value]))
+
+    def TextColumns(self, rows=None, cols=None):
+        '''
+        Returns the content of the given rows and cols as a list of
+        (column label, array of strings), the way it is copied or exported
+        Numerical columns are formatted all at once
+        '''
+        if rows is None: stored = self.view
+        else: stored = self.view[np.asarray(rows, dtype=int)]
+        if cols is None: cols = range(self.GetNumberCols())
+
+        text = []
+        for col in cols:
+            column = self.columns[col]
+            if not np.ma.isMaskedArray(column):
+                txt = np.array([str(v) for v in column[stored]], dtype=str)
+            else:
+                values = np.ma.getdata(column)[stored]
+                blank = np.isnan(values)
+                mask = np.ma.getmaskarray(column)[stored]
+                values = np.where(blank | mask, 0, values)
+                if self.dataTypes[col].split(':')[0] == gridlib.GRID_VALUE_NUMBER:
+                    values = values.astype(np.int64)
+                txt = values.astype(str)
+                txt = txt.astype('S%s' % (txt.dtype.itemsize + 2))
+                txt[blank] = ''
+                txt[mask] = '--'
+            text.append((self.colLabels[col], txt))
+
+        return text
+
+    def _setStored(self, stored, col, value):
+        '''
+        Replace the stored value of column col at position stored
+        with the single value column value
+        '''
+        if np.ma.isMaskedArray(self.columns[col]) and np.ma.isMaskedArray(value):
+            self.columns[col][stored] = value[0]
+        else:
+            self.columns[col] = self._asObject(col, self.columns[col])
+            self.columns[col][stored] = self._asObject(col, value)[0]
+        self._ranks.pop(col, None)
+
+
 class CustTableGrid(gridlib.Grid):
     '''
     This class describes a CustomGrid. Data are handled thorough a table but
@@ -326,13 +763,18 @@ class CustTableGrid(gridlib.Grid):
     def __init__(self, parent, colLabels, dataTypes, enableEdit = False, useValueCleaner=True):
 
         gridlib.Grid.__init__(self, parent, -1)
-        self.table = customDataTable(colLabels, dataTypes, useValueCleaner)
+        #tables that are not edited by the user are stored column by column
+        if enableEdit:
+            self.table = customDataTable(colLabels, dataTypes, useValueCleaner)
+        else:
+            self.table = columnDataTable(colLabels, dataTypes, useValueCleaner)
         self.SetTable(self.table, True)
         self.EnableEditing(enableEdit)
         self.SetColMinimalAcceptableWidth(0)
         self.SetRowMinimalAcceptableHeight(0)
         self.checkableItems = self.table.dataTypes.count('bool') > 0
 
+        self.autoSizeSample = 500
         self.sortedColumn=1
         self.sortedColumnDescending=False
         self.CtrlDown = False
@@ -414,6 +856,24 @@ class CustTableGrid(gridlib.Grid):
         self.AutoSizeColumns()
 
 
+    def AutoSizeColumns(self, setAsMin=True):
+        '''
+        Fit the columns to their content. Big tables are measured
+        on an evenly spaced sample of rows rather than on every row
+        '''
+        n_rows = self.GetNumberRows()
+        if n_rows <= self.autoSizeSample:
+            gridlib.Grid.AutoSizeColumns(self, setAsMin)
+            return
+
+        dc = wx.ClientDC(self)
+        dc.SetFont(self.GetDefaultCellFont())
+        sample = np.linspace(0, n_rows-1, self.autoSizeSample).astype(int)
+        for col in range(self.GetNumberCols()):
+            widths = [dc.GetTextExtent(str(self.table.GetValue(row, col)))[0] for row in sample]
+            widths.append(dc.GetTextExtent(str(self.table.GetColLabelValue(col)))[0])
+            self.SetColSize(col, np.max(widths) + 10)
+
     def SetColsSize(self, cols_size):
         '''
         '''
@@ -444,6 +904,22 @@ class CustTableGrid(gridlib.Grid):
         self.table.SetData(*kargs, **kwargs)
         self.AutoSizeColumns()
 
+    def SetColumns(self, columns):
+        '''
+        (columns)
+        Set the data of the table to the given list of columns
+        '''
+        self.table.SetColumns(columns)
+        self.AutoSizeColumns()
+
+    def AddColumns(self, columns):
+        '''
+        (columns)
+        Add the rows given as a list of columns at the bottom of the table
+        '''
+        self.table.AddColumns(columns)
+        self.AutoSizeColumns()
+
     def GoToEnd(self):
         '''
         Go to the end of the table
@@ -610,16 +1086,10 @@ class CustTableGrid(gridlib.Grid):
     def OnCopyCol(self, event):
         '''
         Copy to clipboard the content of the entire currently
-        selected column, including the column label
+        selected column
         '''
         self.SelectCol(self.GetGridCursorCol())
-        content = wx.TextDataObject()
-        content.SetText(self.DataToCSV('\t', onlySel = True))
-        if wx.TheClipboard.Open():
-            wx.TheClipboard.SetData(content)
-            wx.TheClipboard.Close()
-        else:
-            wx.MessageBox("Unable to open the clipboard", "Error")
+        self.CopyToClipboard(onlySel = True)
 
     def OnCopyRow(self, event):
         '''
@@ -627,13 +1097,7 @@ class CustTableGrid(gridlib.Grid):
         selected row
         '''
         self.SelectRow(self.GetGridCursorRow())
-        content = wx.TextDataObject()
-        content.SetText(self.DataToCSV('\t', onlySel = True))
-        if wx.TheClipboard.Open():
-            wx.TheClipboard.SetData(content)
-            wx.TheClipboard.Close()
-        else:
-            wx.MessageBox("Unable to open the clipboard", "Error")
+        self.CopyToClipboard(onlySel = True)
 
     # I do this because I don't like the default behaviour of not starting the
     # cell editor on double clicks, but only a second click.
@@ -645,20 +1109,21 @@ class CustTableGrid(gridlib.Grid):
         '''
         Copy the all table to clipboard
         '''
-        content = wx.TextDataObject()
-        content.SetText(self.DataToCSV('\t'))
-        if wx.TheClipboard.Open():
-            wx.TheClipboard.SetData(content)
-            wx.TheClipboard.Close()
-        else:
-            wx.MessageBox("Unable to open the clipboard", "Error")
+        self.CopyToClipboard()
 
     def OnCopySelected(self, event):
         '''
         Copy selected cells to system clipboard
         '''
+        self.CopyToClipboard(onlySel = True)
+
+    def CopyToClipboard(self, onlySel = False):
+        '''
+        Copy the table, or only the selected cells, to the system clipboard
+        as tab separated values. Column labels are copied with the whole table only
+        '''
         content = wx.TextDataObject()
-        content.SetText(self.DataToCSV('\t', onlySel = True))
+        content.SetText(self.DataToCSV('\t', onlySel, header = not onlySel))
         if wx.TheClipboard.Open():
             wx.TheClipboard.SetData(content)
             wx.TheClipboard.Close()
@@ -667,38 +1132,66 @@ class CustTableGrid(gridlib.Grid):
 
     def OnExportToFile(self, event):
         '''
-        Save away the content of the grid as CSV file
+        Save away the content of the grid as CSV or tab separated file
         '''
-        wildcard = 'CSV files (*.csv)|*.csv|All files (*.*)|*.*'
+        wildcard = 'CSV files (*.csv)|*.csv|Tab separated files (*.txt)|*.txt|All files (*.*)|*.*'
         dlg = wx.FileDialog(self, 'Choose a file', '', '', wildcard, wx.SAVE | wx.OVERWRITE_PROMPT)
         if dlg.ShowModal() == wx.ID_OK:
             filename=dlg.GetFilename()
             dirname=dlg.GetDirectory()
-            filehandle=open(os.path.join(dirname, filename),'w')
-            filehandle.write(self.DataToCSV(','))
-            filehandle.close()
+            separator = [',', '\t', ','][dlg.GetFilterIndex()]
+            if not ExportColumnsToCSV(self.TextChunks(), os.path.join(dirname, filename), separator):
+                wx.MessageBox('Could not write the file %s' % filename, 'Error')
         dlg.Destroy()
 
-    def DataToCSV(self, separator=',', onlySel = False):
+    def SelectionMask(self):
         '''
-        Convert the data in the grid to CSV value format (or equivalent)
+        Returns a boolean array (rows, cols) that is True on the selected cells
+        If nothing is selected, the cell under the cursor is used
+        '''
+        selected = np.zeros((self.GetNumberRows(), self.GetNumberCols()), dtype=bool)
+
+        for row in self.GetSelectedRows(): selected[row] = True
+        for col in self.GetSelectedCols(): selected[:,col] = True
+        for cell in self.GetSelectedCells(): selected[cell.GetRow(), cell.GetCol()] = True
+        for tl, br in zip(self.GetSelectionBlockTopLeft(), self.GetSelectionBlockBottomRight()):
+            selected[tl.GetRow():br.GetRow()+1, tl.GetCol():br.GetCol()+1] = True
+
+        row, col = self.GetGridCursorRow(), self.GetGridCursorCol()
+        if not selected.any() and 0 <= row < selected.shape[0] and 0 <= col < selected.shape[1]:
+            selected[row, col] = True
+
+        return selected
+
+    def TextChunks(self, onlySel = False, chunk_rows=10000):
+        '''
+        Yields the content of the grid, or of the selected cells only, in chunks
+        of chunk_rows rows. Every chunk is a list of (column label, array of strings)
+        that can be passed to WriteColumns or ExportColumnsToCSV.
+        When copying a selection, the rows and columns containing selected cells are
+        kept and the cells that are not selected are left empty
         '''
-        csv = ''
-        r, c = 0, 0
+        rows, cols = np.arange(self.GetNumberRows()), np.arange(self.GetNumberCols())
 
-        all_content = [self.table.colLabels] + self.table.data
+        if onlySel:
+            selected = self.SelectionMask()
+            rows, cols = np.flatnonzero(selected.any(axis=1)), np.flatnonzero(selected.any(axis=0))
 
-        for row in all_content:
-            c = 0
-            notEmptyLine = ''
-            for cell in row:
-                if not(onlySel) or self.IsInSelection(r-1, c):
-                    csv += str(cell)+separator
-                    notEmptyLine = '\n'
-                c+=1
-            csv += notEmptyLine
-            r +=1
-        return csv
+        for start in range(0, len(rows), chunk_rows) or [0]:
+            chunk = rows[start:start+chunk_rows]
+            columns = self.table.TextColumns(chunk, cols)
+            if onlySel:
+                for n, (label, txt) in enumerate(columns):
+                    txt[~selected[chunk, cols[n]]] = ''
+            yield columns
+
+    def DataToCSV(self, separator=',', onlySel = False, header = True):
+        '''
+        Convert the data in the grid to CSV value format (or equivalent)
+        '''
+        csv = StringIO()
+        WriteColumns(self.TextChunks(onlySel), csv, separator, header = header)
+        return csv.getvalue()
 
     def OnCheckUncheckItems(self, check_value, event):
         '''
@@ -719,8 +1212,201 @@ class CustTableGrid(gridlib.Grid):
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 from matplotlib.backends.backend_wx import NavigationToolbar2Wx
 from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+from matplotlib.collections import Collection
+
+
+def decimateMinMax(x, y, n_bins):
+    '''
+    Splits the series x, y in n_bins consecutive bins and returns, for each bin,
+    two points placed at the beginning of the bin: the minimum and the maximum value.
+    Peaks and troughs are preserved when the line is drawn one bin per pixel.
+    NaN values are ignored unless the whole bin is NaN
+    '''
+    starts = np.unique((np.arange(n_bins) * len(y)) / n_bins)
+    xs = np.repeat(x[starts], 2)
+    ys = np.empty(len(xs))
+    ys[0::2] = np.fmin.reduceat(y, starts)
+    ys[1::2] = np.fmax.reduceat(y, starts)
+    return xs, ys
+
+def decimateAxes(ax):
+    '''
+    Draws every line of ax that is longer than twice the width of the axes in pixels
+    with two points (min and max) per pixel. The full data are kept on the line
+    and the decimation is repeated on the visible range when the x limits change (zoom)
+    Lines drawn with markers are left untouched.
+    '''
+    if not getattr(ax, 'decimated', False):
+        ax.callbacks.connect('xlim_changed', decimateAxes)
+        ax.decimated = True
+
+    width = int(ax.bbox.width) or 1
+    xmin, xmax = np.sort(ax.get_xlim())
+
+    for line in ax.get_lines():
+        if not hasattr(line, 'full_data'):
+            line.full_data = None
+            x = np.asarray(line.get_xdata(), dtype=np.float64)
+            y = np.ma.filled(np.ma.asarray(line.get_ydata(), dtype=np.float64), np.nan)
+            plain_line = line.get_linestyle() not in ['None', ' ', ''] and line.get_marker() in ['None', None, '', ' ']
+            if plain_line and x.ndim == 1 and x.shape == y.shape and len(x) > 2 * width and (np.diff(x) >= 0).all():
+                line.full_data = (x, y)
+
+        if line.full_data is None: continue
+
+        x, y = line.full_data
+        i0 = np.clip(np.searchsorted(x, xmin) - 1, 0, len(x))
+        i1 = np.clip(np.searchsorted(x, xmax, side='right') + 1, 0, len(x))
+        if i1 - i0 > 2 * width:
+            line.set_data(*decimateMinMax(x[i0:i1], y[i0:i1], width))
+        else:
+            line.set_data(x[i0:i1], y[i0:i1])
+
+
+class BlitCanvas(object):
+    '''
+    Shared drawing logic of the plotting canvases.
+    Every full draw keeps two copies of the rendered figure: the static layer alone
+    (axes, ticks, grids, labels and images such as the light/dark bars) and the whole figure.
+    When a refresh draws a figure whose static layer did not change, only the data are
+    drawn over the static copy. When a new selection is added in hold mode and it only
+    adds lines, bars or collections to axes whose limits, ticks and labels did not change,
+    the new artists are drawn over the copy of the whole figure.
+    In both cases the result is blitted instead of redrawing the whole figure.
+    '''
+    background = None
+    staticLayer = None
+    staticKey = None
+
+    def draw(self, *args, **kwargs):
+        '''
+        Draw the whole figure and keep a copy of it, and of its static layer, for blitting
+        '''
+        self.background = self.staticLayer = None
+        if hasattr(self, 'director') and not self.director.canDraw():
+            super(BlitCanvas, self).draw(*args, **kwargs)
+            return
+
+        data = [artist for artist in self._dataArtists() if artist.get_visible()]
+        for artist in data: artist.set_visible(False)
+        try:
+            super(BlitCanvas, self).draw(*args, **kwargs)
+        finally:
+            for artist in data: artist.set_visible(True)
+
+        fig = self.get_figure()
+        self.staticLayer = self.copy_from_bbox(fig.bbox)
+        self.staticKey = self._staticSignature()
+        self._drawOver(data)
+
+    def redraw(self, plotfunction, *args, **kwargs):
+        '''
+        Update the contents of the canvas
+        '''
+        fig = self.get_figure()
+        if not(GUI['holdplot']):
+            fig.clear()
+            self.background = None
+
+        before = self._figureState()
+        plotfunction(fig, *args, **kwargs)
+        for ax in fig.axes: decimateAxes(ax)
+
+        new_artists = self._addedArtists(before)
+        if new_artists is not None:
+            self.restore_region(self.background)
+            self._drawOver(new_artists)
+        elif self.staticLayer is not None and self._staticSignature() == self.staticKey:
+            self.restore_region(self.staticLayer)
+            self._drawOver(self._dataArtists())
+        else:
+            self.draw()
+
+    def _drawOver(self, artists):
+        '''
+        Draws artists over what is currently rendered, blits the figure and keeps a copy of it
+        '''
+        fig = self.get_figure()
+        renderer = self.get_renderer()
+        for artist in artists: artist.draw(renderer)
+        self.blit(fig.bbox)
+        self.background = self.copy_from_bbox(fig.bbox)
+        # the painters of wxmpl (crosshair etc.) were painted over
+        if hasattr(self, 'crosshairs'):
+            self.location.redraw()
+            self.crosshairs.redraw()
+            self.rubberband.redraw()
+
+    def _dataArtists(self):
+        '''
+        The lines, patches, collections, texts and legends of all the axes, in drawing order
+        '''
+        artists = []
+        for ax in self.get_figure().axes:
+            legend = ax.get_legend() and [ax.get_legend()] or []
+            artists += sorted(list(ax.collections) + list(ax.patches) + list(ax.lines) + list(ax.texts) + legend, key=lambda artist: artist.get_zorder())
+        return artists
+
+    def _staticSignature(self):
+        '''
+        What must not change in the figure for its static layer to be reused.
+        The pixels of the layer depend on the size of the canvas, so resizing draws it again
+        '''
+        fig = self.get_figure()
+        signature = [tuple(fig.bbox.bounds), [t.get_text() for t in fig.texts]]
+        for ax in fig.axes:
+            ax.apply_aspect()
+            signature.append((tuple(ax.get_position().bounds), self._axesSignature(ax),
+                              [l.get_visible() for l in ax.get_xgridlines() + ax.get_ygridlines()],
+                              [t.get_visible() for t in ax.get_xticklabels() + ax.get_yticklabels()],
+                              [(tuple(im.get_extent()), np.ma.getdata(im.get_array()).tobytes()) for im in ax.images]))
+        return signature
+
+    def _axesSignature(self, ax):
+        '''
+        What must not change in ax for new artists to be blitted
+        '''
+        return (tuple(ax.get_xlim()), tuple(ax.get_ylim()),
+                tuple(ax.get_xticks()), tuple(ax.get_yticks()),
+                [t.get_text() for t in ax.get_xticklabels() + ax.get_yticklabels()],
+                ax.get_title(), ax.get_xlabel(), ax.get_ylabel())
+
+    def _figureState(self):
+        '''
+        Records the state of the figure before adding a new plot on top of it
+        Returns None if there is nothing to blit on
+        '''
+        if self.background is None: return None
+        fig = self.get_figure()
+        return (list(fig.axes), len(fig.get_children()),
+                [(self._axesSignature(ax), set(ax.get_children())) for ax in fig.axes])
+
+    def _addedArtists(self, before):
+        '''
+        Compares the figure with the state recorded by _figureState and returns the
+        list of artists that were added, in drawing order, or None if the figure
+        needs to be redrawn completely
+        '''
+        fig = self.get_figure()
+        if before is None or before[0] != list(fig.axes) or before[1] != len(fig.get_children()):
+            return None
+
+        new_artists = []
+        for ax, (signature, children) in zip(fig.axes, before[2]):
+            current = set(ax.get_children())
+            if self._axesSignature(ax) != signature or not children <= current:
+                return None
+            for artist in current - children:
+                if not isinstance(artist, (Line2D, Patch, Collection)): return None
+                new_artists.append(artist)
+
+        new_artists.sort(key=lambda artist: artist.get_zorder())
+        return new_artists
+
 
-class MyWXCanvas(FigureCanvas):
+class MyWXCanvas(BlitCanvas, FigureCanvas):
     '''
     This is the wxmpl canvas where the matplotlib plotting happens.
     '''
@@ -767,19 +1453,9 @@ class MyWXCanvas(FigureCanvas):
         Clear the contents of the canvas
         '''
         self.get_figure().clear()
+        self.background = None
         
 
-    def redraw(self, plotfunction, *args, **kwargs):
-        '''
-        Update the contents of the canvas
-        '''
-
-        if not(GUI['holdplot']): self.get_figure().clear()
-        #GUI['currentData'].append([plotfunction, args, kwargs])
-
-        plotfunction(self.get_figure(),*args, **kwargs)
-        self.draw()
-
     def OnContextMenu(self, event):
         '''
         Creates and handles a popup menu
@@ -895,7 +1571,7 @@ class MyWXCanvas(FigureCanvas):
 
 
 
-class MyWxMPLCanvas(wxmpl.PlotPanel):
+class MyWxMPLCanvas(BlitCanvas, wxmpl.PlotPanel):
     '''
     This is the wxmpl canvas where the matplotlib plotting happens.
     '''
@@ -960,19 +1636,9 @@ class MyWxMPLCanvas(wxmpl.PlotPanel):
         Clear the contents of the canvas
         '''
         self.get_figure().clear()
+        self.background = None
         
 
-    def redraw(self, plotfunction, *args, **kwargs):
-        '''
-        Update the contents of the canvas
-        '''
-
-        if not(GUI['holdplot']): self.get_figure().clear()
-        #GUI['currentData'].append([plotfunction, args, kwargs])
-
-        plotfunction(self.get_figure(),*args, **kwargs)
-        self.draw()
-
     def OnContextMenu(self, event):
         '''
         Creates and handles a popup menu
@@ -1150,15 +1816,20 @@ class ExportVariable(object):
     
     def exportToFile(self, outfile, fileType='binary'):
         '''
-        export to variable as np export object
+        export the variable in chunks, one row per value with its indices,
+        as compressed columns (binary) or as CSV (text). Masked values are left empty.
         if it is not a numpy array, it will be first converted to one
+        a list of (column_name, array) is exported as it is, as one table
         '''
-        if 'binary' in fileType:
-            np.save(outfile, self.variable)
+        if type(self.variable) == list:
+            chunks = [self.variable]
         else:
-            np.savetxt(outfile, self.variable, delimiter=',')   # X is an array
+            chunks = ArrayColumns(self.variable)
 
-        return True
+        if 'binary' in fileType:
+            return ExportColumnsToNPZ(chunks, outfile)
+        else:
+            return ExportColumnsToCSV(chunks, outfile)
 
 
 class pySoloPanel(wx.Panel):
@@ -1167,6 +1838,12 @@ class pySoloPanel(wx.Panel):
     def __init__(self, parent):
         wx.Panel.__init__(self, parent)
 
+    def GetPanel(self):
+        '''
+        Return the panel doing the actual work. See LazyPanel
+        '''
+        return self
+
     def AddOption(self, option_name, option_type, option_checked, option_choices, option_description):
         '''
         Called in from the panel code, will add a new variable option_name of type option_type. Default value
@@ -1209,6 +1886,79 @@ class pySoloPanel(wx.Panel):
         return (pySoloVersion == 'dev') or (self.compatible >= pySoloVersion) or (self.compatible == 'all')
 
 
+def ReadPanelInfo(filename):
+    '''
+    Reads the name, the compatibility and the options of a panel from its source code,
+    without importing the module or building any widget. Returns a dictionary with
+    the keys module, name, compatible, options (a list of AddOption arguments)
+    or None if the panel sets them in a way that cannot be read from the source
+    '''
+    _, f = os.path.split(filename)
+    module_name, ext = os.path.splitext(f)
+
+    try:
+        tree = ast.parse(open(filename).read(), filename)
+    except (IOError, SyntaxError):
+        return None
+
+    def isSelfAttribute(node):
+        return isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'self'
+
+    def evalArgument(node):
+        #some panels give their choices as range(n)
+        return eval(compile(ast.Expression(node), filename, 'eval'), {'__builtins__': {'range': range}})
+
+    info = {'module': module_name, 'name': None, 'compatible': None, 'options': []}
+
+    for cls in tree.body:
+        if not (isinstance(cls, ast.ClassDef) and cls.name == 'Panel'): continue
+        for node in ast.walk(cls):
+            try:
+                if isinstance(node, ast.Assign) and len(node.targets) == 1 and isSelfAttribute(node.targets[0]) and node.targets[0].attr in ['name', 'compatible']:
+                    info[node.targets[0].attr] = ast.literal_eval(node.value)
+                elif isinstance(node, ast.Call) and isSelfAttribute(node.func) and node.func.attr == 'AddOption':
+                    if node.keywords or node.starargs or node.kwargs: return None
+                    info['options'].append([evalArgument(arg) for arg in node.args])
+            except Exception:
+                return None
+
+    if info['name'] is None or info['compatible'] is None:
+        return None
+
+    return info
+
+
+class LazyPanel(pySoloPanel):
+    '''
+    An empty notebook page standing in for a panel that has not been used yet.
+    Name, compatibility and options come from ReadPanelInfo; the panel module
+    is imported and its Panel built inside this page the first time it is needed,
+    that is when its tab is first selected
+    '''
+    def __init__(self, parent, info):
+        pySoloPanel.__init__(self, parent)
+        self.module_name = info['module']
+        self.name = info['name']
+        self.compatible = info['compatible']
+        self.panel = None
+
+        for option in info['options']:
+            self.AddOption(*option)
+
+        self.SetSizer(wx.BoxSizer(wx.VERTICAL))
+
+    def GetPanel(self):
+        '''
+        Return the actual panel, building it if needed
+        '''
+        if self.panel is None:
+            self.panel = __import__(self.module_name).Panel(self)
+            self.GetSizer().Add(self.panel, 1, wx.EXPAND)
+            self.Layout()
+
+        return self.panel
+
+
 class GridGrid(pySoloPanel):
     '''This is the panel composed of n Grid, one above each other.
     Receives Proportions, Labels and dataTypes as lists.'''
@@ -1299,9 +2049,19 @@ class PlotGrid(pySoloPanel):
     a table, a comment textbox and some buttons to control the plotting on the lower side
     '''
 
+    #What Refresh draws for every selection is cached and drawn again without computing it (see CachedRefresh).
+    #Panels whose Refresh depends on more than the selection and the options should set cacheOverlays to False;
+    #attributes the panel keeps from one Refresh to the next go in keepState and are cached along
+    cacheOverlays = True
+    keepState = []
+
+    #calls that change what the panel shows, recorded by RecordRefresh
+    recordedCalls = [('canvas', ['redraw']), ('sheet', ['SetData', 'AddRow', 'Reset', 'InsertCol']), (None, ['canExport', 'WriteComment', 'SetCanvasSize'])]
+
     def __init__(self, parent, PanelProportion, CanvasInitialSize, colLabels, dataTypes, choiceList=[]):
         pySoloPanel.__init__(self, parent)
         self.parent = parent
+        self.overlays = {}
 
         #Create Virtual Window
         self.virtualw = wx.ScrolledWindow(self)
@@ -1477,6 +2237,7 @@ class PlotGrid(pySoloPanel):
 
         if GUI['currentData'] == []:
             self.ClearEverything()
+            self.overlays = {}
 
 
         self.holdBTN.SetValue(GUI['holdplot'])
@@ -1485,9 +2246,11 @@ class PlotGrid(pySoloPanel):
             GUI['holdplot'] = False
             GUI['currentlyDrawn'] = 1
 
+            #only the overlays drawn now are worth keeping
+            overlays, self.overlays = self.overlays, {}
             for GUI['dtList'] in GUI['currentData']:
                 GUI['num_selected'] = len(GUI['dtList'])
-                self.Refresh()
+                self.CachedRefresh(overlays)
                 GUI['holdplot'] = len(GUI['currentData'])>1
                 GUI['currentlyDrawn'] += 1
 
@@ -1498,7 +2261,73 @@ class PlotGrid(pySoloPanel):
             GUI['dtList'] = GUI['currentData'][-1]
             GUI['num_selected'] = len(GUI['dtList'])
             GUI['currentlyDrawn'] = len(GUI['currentData'])
+            if not GUI['holdplot']: self.overlays = {}
+            self.CachedRefresh(self.overlays)
+
+    def OverlayKey(self):
+        '''
+        Everything that changes what Refresh draws for the current selection:
+        the selection, its place among the ones drawn, the options and the revision of the DAMslices
+        (see DAMslice.revision)
+        '''
+        data = sorted(set([GUI['cDAM'][selection[1]].revision for selection in GUI['dtList']]))
+
+        limits = self.limits.isActive() and self.limits.GetVals()
+        view = [GUI.get(name) for name in ['choice', 'holdplot', 'currentlyDrawn', 'num_selected', 'ErrorBar', 'ActivityFilter', 'UseColor', 'inputbox']]
+        return repr((GUI['dtList'], view, limits, sorted(customUserConfig.get(self.name, {}).items()), sorted(userConfig.items()), data))
+
+    def RecordRefresh(self):
+        '''
+        Runs Refresh and returns the list of the calls it made to change what the panel shows
+        (see recordedCalls) as (object, method name, args, kwargs). Lists passed as arguments
+        are copied, so that they are recorded as they were at the time of the call
+        '''
+        calls = []
+        wrapped = []
+
+        def recorder(obj, name):
+            method = getattr(obj, name)
+            def record(*args, **kwargs):
+                calls.append((obj, name, [shallowcopy(a) if isinstance(a, list) else a for a in args], kwargs))
+                return method(*args, **kwargs)
+            return record
+
+        for attr, names in self.recordedCalls:
+            obj = attr and getattr(self, attr) or self
+            for name in names:
+                if hasattr(obj, name):
+                    setattr(obj, name, recorder(obj, name))
+                    wrapped.append((obj, name))
+        try:
+            self.Refresh()
+        finally:
+            for obj, name in wrapped:
+                delattr(obj, name)
+
+        return calls
+
+    def CachedRefresh(self, overlays):
+        '''
+        Draws the current selection replaying what Refresh did for it last time,
+        if it is found in overlays (see OverlayKey), or else runs Refresh recording it.
+        In both cases the overlay ends up in self.overlays
+        '''
+        if not self.cacheOverlays:
             self.Refresh()
+            return
+
+        key = self.OverlayKey()
+        if key in overlays:
+            calls, state = overlays[key]
+            for obj, name, args, kwargs in calls:
+                getattr(obj, name)(*args, **kwargs)
+            for name, value in state.items():
+                setattr(self, name, shallowcopy(value))
+        else:
+            calls = self.RecordRefresh()
+            state = dict([(name, shallowcopy(getattr(self, name))) for name in self.keepState])
+
+        self.overlays[key] = (calls, state)
 
 
 #Some plotting function
@@ -33,7 +33,8 @@ import wx, os, glob
 from pysolo_path import panelPath, imgPath
 os.sys.path.append(panelPath)
 
-from pysolo_lib import pySoloVersion, GUI, userConfig, customUserConfig
+from pysolo_lib import pySoloVersion, GUI
+from pysolo_options import userConfig, customUserConfig
 from default_panels import *
 
 #some specific wx libraries used in this frame
@@ -93,7 +94,7 @@ class ExportVariableSideBar(wx.Panel):
         
         grid1 = wx.FlexGridSizer( 0, 1, 0, 0 )
         self.out_format = []
-        self.out_format.append( wx.RadioButton( self, wx.ID_ANY, 'Binary format', name = 'binary', style = wx.RB_GROUP ) )
+        self.out_format.append( wx.RadioButton( self, wx.ID_ANY, 'Compressed columns (NPZ)', name = 'binary', style = wx.RB_GROUP ) )
         self.out_format.append( wx.RadioButton( self, wx.ID_ANY, 'Text format (CSV)', name = 'text' ) )
 
         for radio in self.out_format:
@@ -162,7 +163,7 @@ class ExportVariableSideBar(wx.Panel):
         """
         if self.out_format[0].GetValue():
             format = 'binary'
-            extension = '.bin'
+            extension = '.npz'
         if self.out_format[1].GetValue():
             format = 'text'
             extension = '.csv'
@@ -204,38 +205,30 @@ class ExportVariableSideBar(wx.Panel):
         use_dropout = userConfig['use_dropout'] #boolean
         min_alive = userConfig['min_sleep'] #int
         max_alive = userConfig['max_sleep'] #int
-        v = [0,0,0]
 
-        
-        for n_sel, selection in enumerate(allSelections): #every selection carries a 5 digits coordinate
+        i = self.defaultvarList.index(var_name) # ax, s5, s30
 
-            k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
-            cSEL = cDAM[k]
-            fs, fe = cSEL.getFliesInInterval(m, f)
-            ds, de = cSEL.getDaysInInterval(d)
-            # take the 3D arrays for
-            # ax -> fly activity (the raw data of beam crossing)
-            # s5 -> the 5mins sleep bins
-            # s30 -> the sleep for 30 mins across the day
-            ax_t, s5_t, s30_t = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)  #get the S5 of the currently selected item
-
-            if n_sel == 0:
-                v[0] = ax_t
-                v[1] = s5_t
-                v[2] = s30_t
-            else:
-                v[0] = concatenate ((v[1], ax_t))
-                v[1] = concatenate ((v[0], s5_t))
-                v[2] = concatenate ((v[2], s30_t))
-        
-        #Export now
-        i = ['Selected Activity', 'Selected Sleep 5min', 'Selected Sleep 30min'].index(var_name)
-        f = ['binary', 'text'].index(export_format)
-        separator = ['','\t'][f] #empty separator means binary, otherwise a tab will be used for text files
+        def selected_chunks():
+            """
+            goes through the selections one by one so that we never hold
+            more than one selection (and one chunk of text) in memory
+            """
+            for selection in allSelections: #every selection carries a 5 digits coordinate
 
-        unmasked_v = np.array(v[i]) #we need to unmask the array as tofile of masked arrays is not implemented yet
-        unmasked_v.tofile(fpath, separator)
-        return True
+                k, m, d, f = selection[1:] #cDAMnumber, monitor, day, fly
+                cSEL = cDAM[k]
+                fs, fe = cSEL.getFliesInInterval(m, f)
+                ds, de = cSEL.getDaysInInterval(d)
+                v = cSEL.filterbyStatus(ds,de,fs,fe,t0,t1, status=5, use_dropout=use_dropout, min_alive=min_alive, max_alive=max_alive)[i]
+
+                for columns in SelectionColumns(cSEL, v, ds, fs):
+                    yield columns
+
+        #Export now
+        if export_format == 'binary':
+            return ExportColumnsToNPZ(selected_chunks(), fpath)
+        else:
+            return ExportColumnsToCSV(selected_chunks(), fpath)
         
     def onBrowse(self, event):
         """
@@ -693,6 +686,10 @@ class pySolo_AnalysisFrame(wx.Frame):
         self.SiblingMode = siblingMode
         self.minpane, self.initpos = 100, 200
 
+        #tree selections are drawn only once the user stops changing them
+        self.selectionDelay = 150 #ms
+        self.selectionTimer = None
+
         #self.mainPanel = wx.Panel(self, -1)
         self.sp = MultiSplitterWindow(self)#, style=wx.SP_LIVE_UPDATE) #wx.SplitterWindow(self, -1, style = wx.SP_BORDER)
 
@@ -758,7 +755,15 @@ class pySolo_AnalysisFrame(wx.Frame):
 
         self.nb = wx.Notebook(self.sp)
         self.GetPanels()
-        self.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.Refresh, self.nb)
+        if self.nb.GetPageCount(): self.getOpenPanel()
+        self.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.onPageChanged, self.nb)
+
+    def onPageChanged(self, event):
+        """
+        Builds the panel of the newly selected page, if needed, and draws on it
+        """
+        self.getOpenPanel()
+        self.Refresh(event)
 
     def GetPanels(self):
         """
@@ -784,10 +789,7 @@ class pySolo_AnalysisFrame(wx.Frame):
             #then go through the list and load the panels
             for cPanel in ordered_Panels:
                 if cPanel != '':
-                    NewPanel = __import__(cPanel)
-                    self.Pages.append (NewPanel.Panel(self.nb))
-                    if self.Pages[-1].isCompatible():
-                        self.nb.AddPage(self.Pages[-1], self.Pages[-1].name)
+                    self.LoadPanel(cPanel)
  
         else:
             # if we have no preference variable yet or if we are adding a new panel, fill
@@ -797,10 +799,7 @@ class pySolo_AnalysisFrame(wx.Frame):
                 _,f = os.path.split(f)
                 module_name, ext = os.path.splitext(f) # Handles no-extension files, etc.
                 if ext == '.py' and module_name != 'default_panels': # Important, ignore .pyc/other files.
-                    NewPanel = __import__(module_name)
-                    self.Pages.append (NewPanel.Panel(self.nb))
-                    if self.Pages[-1].isCompatible():
-                        self.nb.AddPage(self.Pages[-1], self.Pages[-1].name)
+                    self.LoadPanel(module_name)
                     # for every panel check if an entry already exists in the user
                     # config variable and if it does not add a new one, last position
                     # and visible
@@ -808,6 +807,21 @@ class pySolo_AnalysisFrame(wx.Frame):
                         position = len(userConfig['Panels'])
                         userConfig['Panels'][module_name] = [position, True]
 
+    def LoadPanel(self, module_name):
+        """
+        Adds the panel module_name to the notebook.
+        When possible the panel is only described by a LazyPanel and
+        the real panel is built the first time its page is opened
+        """
+        info = ReadPanelInfo(os.path.join(panelPath, module_name + '.py'))
+        if info:
+            self.Pages.append (LazyPanel(self.nb, info))
+        else:
+            self.Pages.append (__import__(module_name).Panel(self.nb))
+
+        if self.Pages[-1].isCompatible():
+            self.nb.AddPage(self.Pages[-1], self.Pages[-1].name)
+
     def MakeTheSideBar(self):
         """
         We create an option panel that will sit on the right side to modify panel specific parameters
@@ -837,7 +851,7 @@ class pySolo_AnalysisFrame(wx.Frame):
         TreeSizer = wx.BoxSizer(wx.VERTICAL)
 
         self.Tree = NavigationTree(self.TreePanel)
-        self.Tree.Bind(wx.EVT_TREE_SEL_CHANGED, self.Refresh)
+        self.Tree.Bind(wx.EVT_TREE_SEL_CHANGED, self.onTreeSelChanged)
 
         imageJoin = wx.Image(imgPath+'/t_hold.png', wx.BITMAP_TYPE_ANY).ConvertToBitmap()
         JoinBtn = GenBitmapToggleButton(self.TreePanel, wx.ID_ANY, bitmap=imageJoin, size = (imageJoin.GetWidth()+2, imageJoin.GetHeight()+2))
@@ -878,6 +892,9 @@ class pySolo_AnalysisFrame(wx.Frame):
         ID_COLORS = wx.NewId()
         ID_TOOLS_ERRBAR = wx.NewId()
         ID_TOOLS_UPDATE = wx.NewId()
+        ID_TOOLS_ARCHITECTURE = wx.NewId()
+        ID_TOOLS_STATES = wx.NewId()
+        ID_TOOLS_DEFINITIONS = wx.NewId()
         ID_WIN_DB = wx.NewId()
         ID_WIN_ANAL = wx.NewId()
         ID_WIN_OPTIonS = wx.NewId()
@@ -924,6 +941,9 @@ class pySolo_AnalysisFrame(wx.Frame):
 
 
         toolmenu. AppendMenu(ID_TOOLS_GRAPH, '&Graphs', sub_tool_menu)
+        toolmenu. Append(ID_TOOLS_DEFINITIONS, 'Sleep &Definitions...', 'Choose the definitions of sleep calculated for all the flies and selectable in the panels')
+        toolmenu. Append(ID_TOOLS_STATES, 'Calculate Sleep &States', 'Infer deep sleep, light sleep and wake of all the flies with a hidden Markov model')
+        toolmenu. Append(ID_TOOLS_ARCHITECTURE, 'Export Sleep &Architecture...', 'Export P(wake) and P(doze) of all the flies in one or more DAD files')
         toolmenu. Append(ID_TOOLS_UPDATE, 'Search for &Update')
 
         #Create the MenuBar
@@ -951,6 +971,9 @@ class pySolo_AnalysisFrame(wx.Frame):
         wx.EVT_MENU(self, ID_TOOLS_ERRBAR, self.onGraphErrBar)
         wx.EVT_MENU(self, ID_TOOLS_FILTER, self.onActivityFilter)
         wx.EVT_MENU(self, ID_TOOLS_UPDATE, partial (self.onCheckVersion, automatic=False))
+        wx.EVT_MENU(self, ID_TOOLS_DEFINITIONS, self.onSleepDefinitions)
+        wx.EVT_MENU(self, ID_TOOLS_STATES, self.onCalculateSleepStates)
+        wx.EVT_MENU(self, ID_TOOLS_ARCHITECTURE, self.onExportArchitecture)
         wx.EVT_MENU(self, ID_WIN_DB, self.onShowDatabase)
         #wx.EVT_MENU(self, ID_WIN_ANAL, self.onShowAnalysis)
         wx.EVT_MENU(self, ID_WIN_OPTIonS, self.onShowOptions)
@@ -1182,6 +1205,89 @@ class pySolo_AnalysisFrame(wx.Frame):
             dlg = wx.MessageDialog(self, message , 'Searching for updates', wx.OK | wx.ICON_QUESTION)
             if dlg.ShowModal() == wx.ID_OK: dlg.Destroy()
 
+    def onSleepDefinitions(self, event):
+        """
+        From Menu: sets the definitions of sleep of all the flies in the open file
+        as minutes of inactivity, optionally followed by the inactivity allowed (5:2).
+        Sleep is calculated again and saved with the file; the first definition is the default one
+        """
+        if not cDAM: return
+
+        current = ', '.join([':'.join([str(v) for v in sd if v is not None]) for sd in cDAM[0].sleepDefinitions])
+        dlg = wx.TextEntryDialog(self, 'Minutes of inactivity defining sleep, separated by commas.\nUse minutes:inactivity (for instance 5:2) to allow some activity counts, as with video data', 'Sleep Definitions', current)
+        if dlg.ShowModal() == wx.ID_OK: text = dlg.GetValue()
+        else: text = ''
+        dlg.Destroy()
+        if not text: return
+
+        try:
+            definitions = []
+            for item in text.split(','):
+                values = [int(v) for v in item.split(':')]
+                if values[0] < 1 or len(values) > 2: raise ValueError
+                definitions.append((values + [None])[:2])
+        except ValueError:
+            wx.MessageBox('%s is not a valid list of sleep definitions' % text, 'Error!', style=wx.OK|wx.ICON_EXCLAMATION)
+            return
+
+        wx.BeginBusyCursor()
+        for n, cSEL in enumerate(cDAM):
+            self.ProgressBarDlg(100 * n / len(cDAM), 'Calculating sleep of %s' % cSEL.getGenotype())
+            cSEL.setSleepDefinitions(definitions)
+        self.ProgressBarDlg(-1, 'Done.')
+        wx.EndBusyCursor()
+
+        if not self.fileisModified:
+            self.fileisModified = True
+            self.title += '(*)'
+            self.SetTitle(self.title)
+        self.Refresh()
+
+    def onCalculateSleepStates(self, event):
+        """
+        From Menu: infers the sleep states of all the flies in the open file
+        they are saved with the file
+        """
+        if not cDAM: return
+
+        wx.BeginBusyCursor()
+        for n, cSEL in enumerate(cDAM):
+            self.ProgressBarDlg(100 * n / len(cDAM), 'Calculating sleep states of %s' % cSEL.getGenotype())
+            cSEL.calculateSleepStates()
+        self.ProgressBarDlg(-1, 'Done.')
+        wx.EndBusyCursor()
+
+        if not self.fileisModified:
+            self.fileisModified = True
+            self.title += '(*)'
+            self.SetTitle(self.title)
+
+    def onExportArchitecture(self, event):
+        """
+        From Menu: exports the sleep architecture of all the flies in the chosen DAD files
+        """
+        wildcard = 'DAD files (*.dad)|*.dad|All files (*.*)|*.*'
+        dlg = wx.FileDialog(self, 'Choose the DAD files to export', defaultDir=userConfig['DAMoutput'], style=wx.OPEN | wx.MULTIPLE, wildcard=wildcard)
+        if dlg.ShowModal() == wx.ID_OK: filenames = dlg.GetPaths()
+        else: filenames = []
+        dlg.Destroy()
+        if not filenames: return
+
+        wildcard = 'Text file (*.txt)|*.txt|Numpy compressed file (*.npz)|*.npz'
+        dlg = wx.FileDialog(self, 'Export the sleep architecture to', userConfig['DAMoutput'], 'sleep_architecture.txt', wildcard, wx.SAVE | wx.OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK: outfile = dlg.GetPath()
+        else: outfile = None
+        dlg.Destroy()
+        if not outfile: return
+
+        wx.BeginBusyCursor()
+        success = ExportArchitecture([str(f) for f in filenames], str(outfile), window=60, binary=outfile.endswith('.npz'),
+                                     status=5, use_dropout=userConfig['use_dropout'], min_alive=userConfig['min_sleep'], max_alive=userConfig['max_sleep'])
+        wx.EndBusyCursor()
+
+        if not success:
+            wx.MessageBox('Error saving the file %s\nDisk may be full or you may not have write rights.' % outfile, 'Error!', style=wx.OK|wx.ICON_EXCLAMATION)
+
     def onAbout(self, event):
         """
         Shows the about dialog
@@ -1247,10 +1353,24 @@ class pySolo_AnalysisFrame(wx.Frame):
         CurPage = self.nb.GetPageText( self.nb.GetSelection() )
 
         for Panel in self.Pages:
-            if CurPage == Panel.name: return Panel
+            if CurPage == Panel.name: return Panel.GetPanel()
+
+
+    def onTreeSelChanged(self, event):
+        """
+        Every change of selection in the tree (keyboard navigation, shift-click ranges)
+        restarts the timer: the tree is drawn only once selections stop changing,
+        reading the selection as it is when the timer fires.
+        A drawing already started runs to the end, events coming meanwhile wait for it
+        """
+        if self.selectionTimer and self.selectionTimer.IsRunning():
+            self.selectionTimer.Restart(self.selectionDelay)
+        else:
+            self.selectionTimer = wx.CallLater(self.selectionDelay, self.Refresh, SelectionChanged=True)
 
+        event.Skip()
 
-    def Refresh(self, event=None):
+    def Refresh(self, event=None, SelectionChanged=False):
         """
         Checks what is the currently selected notebook page and draws data only there
         """
@@ -1263,7 +1383,7 @@ class pySolo_AnalysisFrame(wx.Frame):
             if event:
                 ChangingPage = (event.GetEventType() == wx.EVT_NOTEBOOK_PAGE_CHANGED.typeId)
             else:
-                ChangingPage = True
+                ChangingPage = not SelectionChanged
                 
 
             evtdata = []
@@ -1273,6 +1393,9 @@ class pySolo_AnalysisFrame(wx.Frame):
             for SelItem in self.Tree.GetSelections():
                 evtdata.append (self.Tree.GetItemPyData(SelItem).GetData())
 
+            #flies or days that together make one whole monitor, day or genotype are read as that item
+            evtdata = CompressSelections(evtdata, cDAM)
+
             if GUI['holdplot'] and not ChangingPage:
                 GUI['currentData'].append ( evtdata )
             elif not GUI['holdplot'] and not ChangingPage:
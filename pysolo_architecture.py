@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_architecture.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Sleep architecture as transition probabilities between activity and inactivity.
+# P(doze) is the probability that an active minute is followed by an inactive one,
+# P(wake) the probability that an inactive minute is followed by an active one.
+# Every transition belongs to the minute it starts from; the last minute of the array
+# has no following minute and is not counted. All the counts are sums over
+# shifted boolean arrays, taken in windows of a given number of minutes.
+
+import numpy as np
+
+
+def transition_counts(ax, window=None, threshold=0):
+    '''
+    transition_counts(ax, window=None, threshold=0)
+
+    Takes the 3D array ax (days, flies, minutes) and counts, for every day, fly and window
+    of window minutes (the whole array if None): active minutes, active -> inactive transitions,
+    inactive minutes and inactive -> active transitions. A minute is active if its
+    activity is above threshold. Returns four int arrays of shape (days, flies, windows).
+    Minutes not filling a whole window at the end are left out.
+    '''
+    d, f, t = ax.shape
+    window = window or t
+    n = t / window
+
+    active = np.ma.filled(ax, 0) > threshold
+    now = active[:,:,:n*window]
+
+    # the minute following every minute; the last minute of the array has none
+    after = np.zeros(now.shape, dtype=bool)
+    last = min(n*window, t-1)
+    after[:,:,:last] = active[:,:,1:last+1]
+    has_next = np.arange(n*window) < t-1
+
+    def by_window(a):
+        return a.reshape((d, f, n, window)).sum(axis=3)
+
+    n_active = by_window(now & has_next)
+    doze = by_window(now & ~after & has_next)
+    n_inactive = by_window(~now & has_next)
+    wake = by_window(~now & after)
+
+    return n_active, doze, n_inactive, wake
+
+def transition_probabilities(ax, window=None, threshold=0):
+    '''
+    transition_probabilities(ax, window=None, threshold=0)
+
+    Returns P(wake) and P(doze) as masked arrays (days, flies, windows), see transition_counts.
+    Windows without inactive (active) minutes have no P(wake) (P(doze)) and are masked,
+    as well as days masked in ax.
+    '''
+    n_active, doze, n_inactive, wake = transition_counts(ax, window, threshold)
+
+    row_mask = np.ma.getmaskarray(ax).any(axis=2)[:,:,np.newaxis]
+    p_wake = np.ma.masked_array(wake / np.maximum(n_inactive, 1).astype(np.float64), mask=(n_inactive == 0) | row_mask)
+    p_doze = np.ma.masked_array(doze / np.maximum(n_active, 1).astype(np.float64), mask=(n_active == 0) | row_mask)
+    return p_wake, p_doze
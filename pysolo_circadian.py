@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_circadian.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Circadian analysis of the activity of flies.
+# The activity of every fly is taken as one time series running through all its days,
+# binned at bin_length minutes. Periodograms are computed for all the flies at once:
+# chi-square (Sokolove-Bushell) folds the series of all the flies for one period at a time,
+# Lomb-Scargle uses matrix products shared by all flies and periods and
+# the autocorrelation comes from FFTs. Masked bins (dead or excluded days) are left out
+# by every method, so series do not need to be of the same length.
+
+import numpy as np
+
+
+def activity_series(ax, bin_length=1):
+    '''
+    Takes the 3D array ax (days, flies, minutes) as returned by filterbyStatus and
+    returns a masked 2D array (flies, bins) with the activity of every fly binned
+    at bin_length minutes and running continuously through the days.
+    A bin is masked if any of its minutes is masked. Minutes not filling a whole bin
+    at the end of the day are left out.
+    '''
+    d, f, t = ax.shape
+    n_bins = t / bin_length
+
+    data = np.ma.getdata(ax)[:,:,:n_bins*bin_length].reshape((d, f, n_bins, bin_length))
+    mask = np.ma.getmaskarray(ax)[:,:,:n_bins*bin_length].reshape((d, f, n_bins, bin_length))
+
+    binned = data.sum(axis=3).transpose((1,0,2)).reshape((f, d*n_bins))
+    masked = mask.any(axis=3).transpose((1,0,2)).reshape((f, d*n_bins))
+    return np.ma.masked_array(binned.astype(np.float64), mask=masked)
+
+def _values_and_weights(series):
+    '''
+    Returns the data of series with masked values set to 0 and the weights (1 valid, 0 masked)
+    '''
+    series = np.ma.masked_invalid(np.ma.atleast_2d(series).astype(np.float64))
+    w = (~np.ma.getmaskarray(series)).astype(np.float64)
+    return np.ma.getdata(series) * w, w
+
+def chi_square_periodogram(series, periods, alpha=0.01):
+    '''
+    chi_square_periodogram(series, periods, alpha=0.01)
+
+    Sokolove-Bushell periodogram of every row of series (flies, bins).
+    periods are given in bins and must be integer. For every period the series is folded
+    on its complete cycles and Qp = N * sum_h(n_h * (M_h - M)**2) / sum_i((X_i - M)**2)
+    where M_h is the mean of phase h, n_h its number of valid values and N the valid values used.
+    Returns a tuple with Qp as masked 2D array (flies, periods) and the 1D array of the
+    values of Qp significant at alpha, for every period.
+    '''
+    from scipy.stats import chi2
+
+    x, w = _values_and_weights(series)
+    f, n = x.shape
+    periods = np.asarray(periods, dtype=int)
+
+    qp = np.zeros((f, len(periods)), dtype=np.float64)
+    for i, p in enumerate(periods):
+        k = n / p
+        if k == 0: continue
+        xf = x[:,:k*p].reshape((f, k, p))
+        wf = w[:,:k*p].reshape((f, k, p))
+
+        n_h = wf.sum(axis=1)
+        s_h = xf.sum(axis=1)
+        N = n_h.sum(axis=1)
+        M = s_h.sum(axis=1) / np.maximum(N, 1)
+
+        # sum_h n_h * (M_h - M)**2 = sum_h s_h**2 / n_h - N * M**2
+        between = (s_h**2 / np.maximum(n_h, 1)).sum(axis=1) - N * M**2
+        total = (xf**2).sum(axis=(1,2)) - N * M**2
+        qp[:,i] = N * between / np.where(total > 0, total, 1)
+
+    empty = (w.sum(axis=1) < 2) | ((x**2).sum(axis=1) == 0)
+    qp = np.ma.masked_array(qp, mask=np.repeat(empty[:,np.newaxis], len(periods), axis=1) | (n / np.maximum(periods, 1) == 0))
+    return qp, chi2.ppf(1 - alpha, np.maximum(periods - 1, 1))
+
+def lomb_scargle_periodogram(series, periods):
+    '''
+    lomb_scargle_periodogram(series, periods)
+
+    Normalized Lomb-Scargle periodogram of every row of series (flies, bins), for the
+    given periods (in bins, not necessarily integer). Masked bins are left out, as unevenly
+    sampled times. All the sums over time are matrix products shared by all the flies.
+    Returns the power as masked 2D array (flies, periods).
+    '''
+    x, w = _values_and_weights(series)
+    f, n = x.shape
+    t = np.arange(n, dtype=np.float64)
+    omega = 2 * np.pi / np.asarray(periods, dtype=np.float64)
+
+    N = w.sum(axis=1)
+    y = (x - (x.sum(axis=1) / np.maximum(N, 1))[:,np.newaxis]) * w
+    var = (y**2).sum(axis=1) / np.maximum(N - 1, 1)
+
+    wt = np.outer(omega, t)
+    C2 = np.dot(w, np.cos(2*wt).T)
+    S2 = np.dot(w, np.sin(2*wt).T)
+    YC = np.dot(y, np.cos(wt).T)
+    YS = np.dot(y, np.sin(wt).T)
+
+    # time offset tau making the sine and cosine terms orthogonal
+    two_tau = np.arctan2(S2, C2)
+    c, s = np.cos(two_tau / 2), np.sin(two_tau / 2)
+    c2 = C2 * np.cos(two_tau) + S2 * np.sin(two_tau)
+
+    cc = (N[:,np.newaxis] + c2) / 2
+    ss = (N[:,np.newaxis] - c2) / 2
+    yc = YC * c + YS * s
+    ys = YS * c - YC * s
+
+    power = ((yc**2 / np.where(cc > 0, cc, 1)) + (ys**2 / np.where(ss > 0, ss, 1))) / (2 * np.where(var > 0, var, 1))[:,np.newaxis]
+    empty = (N < 3) | (var <= 0)
+    return np.ma.masked_array(power, mask=np.repeat(empty[:,np.newaxis], len(omega), axis=1))
+
+def autocorrelation(series, max_lag):
+    '''
+    autocorrelation(series, max_lag)
+
+    Autocorrelation of every row of series (flies, bins) for the lags from 0 to max_lag (in bins),
+    computed with FFTs. Products with masked bins are left out and every lag is averaged
+    on the pairs of valid bins it has. Returns a masked 2D array (flies, max_lag+1)
+    '''
+    x, w = _values_and_weights(series)
+    f, n = x.shape
+    N = w.sum(axis=1)
+    z = (x - (x.sum(axis=1) / np.maximum(N, 1))[:,np.newaxis]) * w
+
+    nfft = 1
+    while nfft < 2 * n: nfft *= 2
+
+    Z = np.fft.rfft(z, nfft, axis=1)
+    W = np.fft.rfft(w, nfft, axis=1)
+    prod = np.fft.irfft(Z * Z.conj(), nfft, axis=1)[:,:max_lag+1]
+    pairs = np.round(np.fft.irfft(W * W.conj(), nfft, axis=1)[:,:max_lag+1])
+
+    cov = prod / np.maximum(pairs, 1)
+    r = cov / np.where(cov[:,:1] > 0, cov[:,:1], 1)
+    return np.ma.masked_array(r, mask=(pairs < 1) | (cov[:,:1] <= 0))
+
+def periodogram_peak(power, periods, threshold=None):
+    '''
+    Returns the period where power (flies, periods) is highest for every fly and the power
+    at that period. If threshold is given the power is returned above the threshold.
+    '''
+    periods = np.asarray(periods)
+    filled = np.ma.filled(power, -np.inf)
+    best = np.argmax(filled, axis=1)
+    rows = np.arange(filled.shape[0])
+    peak = filled[rows, best]
+    if threshold is not None:
+        peak = peak - np.asarray(threshold)[best]
+
+    empty = ~np.isfinite(peak)
+    return np.ma.masked_array(periods[best], mask=empty), np.ma.masked_array(np.where(empty, 0, peak), mask=empty)
+
+def rhythmicity_index(acf, min_lag, max_lag):
+    '''
+    Takes the autocorrelation (flies, lags) and returns the lag of its highest peak
+    between min_lag and max_lag and the height of that peak (rhythmicity index) for every fly.
+    Flies without a positive peak in the range are masked.
+    '''
+    r = np.ma.filled(acf, np.nan)
+    lags = np.arange(max(min_lag, 1), min(max_lag, r.shape[1] - 2) + 1)
+    if not len(lags):
+        return np.ma.masked_all(r.shape[0], dtype=int), np.ma.masked_all(r.shape[0])
+
+    here, before, after = r[:,lags], r[:,lags-1], r[:,lags+1]
+    is_peak = (here >= before) & (here >= after) & (here > 0)
+    height = np.where(is_peak, here, -np.inf)
+
+    best = np.argmax(height, axis=1)
+    rows = np.arange(r.shape[0])
+    ri = height[rows, best]
+    empty = ~np.isfinite(ri)
+    return np.ma.masked_array(lags[best], mask=empty), np.ma.masked_array(np.where(empty, 0, ri), mask=empty)
+
+
+class CircadianEngine(object):
+    """
+    Takes the 3D array ax (days, flies, minutes) as returned by filterbyStatus and computes
+    the chi-square, Lomb-Scargle and autocorrelation periodograms of all the flies,
+    for the periods between min_period and max_period hours.
+    """
+
+    methods = ['Chi-square', 'Lomb-Scargle', 'Autocorrelation']
+
+    def __init__(self, ax, bin_length=15, min_period=16, max_period=32, alpha=0.01):
+        """
+        bin_length is in minutes; min_period and max_period are in hours
+        """
+        self.bin_length = bin_length
+        self.alpha = alpha
+        self.series = activity_series(ax, bin_length)
+
+        bins_per_hour = 60. / bin_length
+        self.periods = np.arange(int(np.ceil(min_period * bins_per_hour)), int(max_period * bins_per_hour) + 1)
+        self.hours = self.periods / bins_per_hour
+
+        self.power = {}
+        self.power['Chi-square'], self.threshold = chi_square_periodogram(self.series, self.periods, alpha)
+        self.power['Lomb-Scargle'] = lomb_scargle_periodogram(self.series, self.periods)
+
+        acf = autocorrelation(self.series, self.periods[-1] if len(self.periods) else 0)
+        self.power['Autocorrelation'] = acf[:,self.periods]
+        self.acf = acf
+
+    def getPeriodogram(self, method):
+        """
+        Returns the periods (in hours), the periodogram (flies, periods) of the given method
+        and the significance threshold of each period (None if the method has none)
+        """
+        threshold = None
+        if method == 'Chi-square': threshold = self.threshold
+        return self.hours, self.power[method], threshold
+
+    def getPeriod(self, method):
+        """
+        Returns period (in hours) and power for every fly, according to the given method.
+        For chi-square the power is Qp above the significance threshold,
+        for autocorrelation it is the rhythmicity index
+        """
+        if method == 'Autocorrelation':
+            lag, ri = rhythmicity_index(self.acf, self.periods[0], self.periods[-1])
+            return lag * self.bin_length / 60., ri
+
+        hours, power, threshold = self.getPeriodogram(method)
+        period, peak = periodogram_peak(power, hours, threshold)
+        return period, peak
+
+    def getRhythmic(self):
+        """
+        Returns True for every fly whose chi-square periodogram crosses the significance threshold
+        """
+        period, peak = self.getPeriod('Chi-square')
+        return np.ma.filled(peak > 0, False)
+
+    def getColumns(self):
+        """
+        Returns a list of (column_name, array) with one row for every fly:
+        period and power according to every method
+        """
+        columns = [('fly', np.arange(self.series.shape[0]))]
+        for method, power_name in zip(self.methods, ['Qp - Qp(%s)' % self.alpha, 'LS power', 'RI']):
+            period, power = self.getPeriod(method)
+            columns.append(('%s period (h)' % method, period))
+            columns.append(('%s %s' % (method, power_name), power))
+        return columns
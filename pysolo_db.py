@@ -7,6 +7,7 @@ os.sys.path.append(panelPath)
 
 from default_panels import CustTableGrid, gridlib, SavePreferenceFile, FileDrop
 from pysolo_lib import *
+from pysolo_options import userConfig, customUserConfig
 import wx.lib.calendar
 
 class DAMlist(CustTableGrid):
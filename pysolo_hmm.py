@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_hmm.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Sleep states from a hidden Markov model of the activity counts.
+# Every fly has its own model: n_states hidden states, each emitting activity counts
+# with its own Poisson rate, and a transition matrix between states.
+# All the flies of a batch (flies, minutes) are fitted together with Baum-Welch:
+# the forward-backward recursions loop over time only, each step working on all the
+# flies at once, in log space. Masked minutes emit nothing and only carry the transitions.
+# Once fitted, states are sorted by rate so that state 0 is the deepest sleep and the
+# last state is wake; every minute gets its most likely state.
+# Batches (for instance the monitors of a DAMslice) can be fitted in parallel processes.
+
+import numpy as np
+
+
+def _logsumexp(x, axis):
+    '''
+    log(sum(exp(x))) along axis, without overflow
+    '''
+    m = x.max(axis=axis)
+    m = np.where(np.isfinite(m), m, 0)
+    with np.errstate(divide='ignore'):
+        return m + np.log(np.exp(x - np.expand_dims(m, axis)).sum(axis=axis))
+
+def poisson_log_emissions(obs, rates, mask=None):
+    '''
+    Takes the activity counts obs (flies, minutes) and the rates (flies, states) and returns
+    the log probability of every count in every state (flies, minutes, states).
+    Masked minutes (mask True) have log probability 0 in every state
+    '''
+    obs = np.asarray(obs)
+    log_factorial = np.concatenate(([0.], np.cumsum(np.log(np.arange(1, obs.max() + 1)))))
+    rates = np.maximum(rates, 1e-6)
+
+    log_b = obs[:,:,np.newaxis] * np.log(rates)[:,np.newaxis,:] - rates[:,np.newaxis,:] - log_factorial[obs][:,:,np.newaxis]
+    if mask is not None: log_b[mask] = 0
+    return log_b
+
+def forward_backward(log_b, log_pi, log_a):
+    '''
+    forward_backward(log_b, log_pi, log_a)
+
+    Forward-backward recursions for all the flies at once, in log space.
+    log_b are the emissions (flies, minutes, states), log_pi the initial probabilities (flies, states)
+    and log_a the transitions (flies, states, states).
+    Returns log alpha, log beta (flies, minutes, states) and the log likelihood of every fly.
+    '''
+    f, t, k = log_b.shape
+    a = np.exp(log_a)
+    log_alpha = np.empty((f, t, k))
+    log_beta = np.empty((f, t, k))
+
+    # every step scales by the highest value, multiplies by the transitions and goes back to logs
+    with np.errstate(divide='ignore'):
+        log_alpha[:,0] = log_pi + log_b[:,0]
+        for i in range(1, t):
+            prev = log_alpha[:,i-1]
+            m = prev.max(axis=1)[:,np.newaxis]
+            log_alpha[:,i] = np.log(np.einsum('fk,fkj->fj', np.exp(prev - m), a)) + m + log_b[:,i]
+
+        log_beta[:,-1] = 0
+        for i in range(t-2, -1, -1):
+            nxt = log_b[:,i+1] + log_beta[:,i+1]
+            m = nxt.max(axis=1)[:,np.newaxis]
+            log_beta[:,i] = np.log(np.einsum('fkj,fj->fk', a, np.exp(nxt - m))) + m
+
+    return log_alpha, log_beta, _logsumexp(log_alpha[:,-1], axis=1)
+
+def _initial_parameters(obs, mask, n_states):
+    '''
+    Starting model of every fly: rates spread from almost nothing to the average
+    activity of the fly when active, states that tend to persist
+    '''
+    f = obs.shape[0]
+    valid = ~mask & (obs > 0)
+    active_mean = np.maximum((obs * valid).sum(axis=1) / np.maximum(valid.sum(axis=1), 1.), 1.)
+
+    rates = active_mean[:,np.newaxis] * np.logspace(-3, 0, n_states)[np.newaxis,:]
+    a = np.full((n_states, n_states), 0.05 / max(n_states - 1, 1))
+    a[np.diag_indices(n_states)] = 0.95 if n_states > 1 else 1.
+    log_a = np.repeat(np.log(a)[np.newaxis], f, axis=0)
+    log_pi = np.full((f, n_states), -np.log(n_states))
+    return log_pi, log_a, rates
+
+def baum_welch(obs, mask=None, n_states=3, iterations=30, tolerance=1e-4, chunk=1440):
+    '''
+    baum_welch(obs, mask=None, n_states=3, iterations=30, tolerance=1e-4, chunk=1440)
+
+    Fits a Poisson hidden Markov model to the activity counts obs (flies, minutes) of every fly.
+    mask (flies, minutes) is True where minutes are missing.
+    Stops after iterations or when the log likelihood of every fly improves less than tolerance (relative).
+    The expected transitions are summed chunk minutes at a time.
+    Returns log_pi (flies, states), log_a (flies, states, states), rates (flies, states),
+    the posterior log probabilities of the states (flies, minutes, states) and the log likelihood of every fly.
+    '''
+    obs = np.ma.filled(obs, 0).astype(np.int64)
+    if mask is None: mask = np.zeros(obs.shape, dtype=bool)
+    f, t = obs.shape
+    weights = (~mask).astype(np.float64)
+
+    log_pi, log_a, rates = _initial_parameters(obs, mask, n_states)
+    previous = None
+
+    for iteration in range(iterations):
+        log_b = poisson_log_emissions(obs, rates, mask)
+        log_alpha, log_beta, loglik = forward_backward(log_b, log_pi, log_a)
+        log_gamma = log_alpha + log_beta - loglik[:,np.newaxis,np.newaxis]
+
+        if previous is not None and (np.abs(loglik - previous) <= tolerance * np.abs(previous)).all():
+            break
+        previous = loglik
+
+        # expected number of transitions between every pair of states
+        xi = np.zeros((f, n_states, n_states))
+        for c0 in range(0, t - 1, chunk):
+            c1 = min(c0 + chunk, t - 1)
+            log_xi = (log_alpha[:,c0:c1,:,np.newaxis] + log_a[:,np.newaxis]
+                      + (log_b[:,c0+1:c1+1] + log_beta[:,c0+1:c1+1])[:,:,np.newaxis,:]
+                      - loglik[:,np.newaxis,np.newaxis,np.newaxis])
+            xi += np.exp(log_xi).sum(axis=1)
+
+        gamma = np.exp(log_gamma)
+        with np.errstate(divide='ignore'):
+            log_pi = np.log(gamma[:,0])
+            log_a = np.log(xi / np.maximum(xi.sum(axis=2)[:,:,np.newaxis], 1e-300))
+
+        w = gamma * weights[:,:,np.newaxis]
+        rates = (w * obs[:,:,np.newaxis]).sum(axis=1) / np.maximum(w.sum(axis=1), 1e-300)
+
+    return log_pi, log_a, rates, log_gamma, loglik
+
+def decode_states(log_gamma, rates):
+    '''
+    Returns the most likely state of every minute (flies, minutes), with the states of every fly
+    numbered by rate: 0 is the least active state
+    '''
+    rank = np.argsort(np.argsort(rates, axis=1), axis=1)
+    best = np.argmax(log_gamma, axis=2)
+    return rank[np.arange(rank.shape[0])[:,np.newaxis], best]
+
+def sleep_states(obs, mask=None, n_states=3, iterations=30):
+    '''
+    sleep_states(obs, mask=None, n_states=3, iterations=30)
+
+    Fits the model to obs (flies, minutes) and returns the state of every minute as
+    an int8 array (flies, minutes): 0 the deepest sleep up to n_states-1 for wake.
+    Masked minutes are -1
+    '''
+    log_pi, log_a, rates, log_gamma, loglik = baum_welch(obs, mask, n_states, iterations)
+    states = decode_states(log_gamma, rates).astype(np.int8)
+    if mask is not None: states[mask] = -1
+    return states
+
+def _sleep_states_args(args):
+    '''
+    sleep_states taking one tuple of arguments, for Pool.map
+    '''
+    return sleep_states(*args)
+
+def sleep_states_by_group(obs, mask, groups, n_states=3, iterations=30, processes=None):
+    '''
+    sleep_states_by_group(obs, mask, groups, n_states=3, iterations=30, processes=None)
+
+    Same as sleep_states, with the flies (rows of obs) fitted in batches, one for every
+    different value in groups (for instance the monitor of every fly).
+    Batches are fitted in a pool of processes (as many as the CPUs if None);
+    with processes=1, or if a pool cannot be started, they are fitted one after the other.
+    '''
+    groups = np.asarray(groups)
+    batches = [np.where(groups == g)[0] for g in sorted(set(groups.tolist()))]
+    args = [(obs[rows], mask[rows], n_states, iterations) for rows in batches]
+
+    results = None
+    if processes != 1 and len(batches) > 1:
+        try:
+            from multiprocessing import Pool
+            pool = Pool(processes)
+            try:
+                results = pool.map(_sleep_states_args, args)
+            finally:
+                pool.close()
+                pool.join()
+        except (ImportError, OSError):
+            results = None
+
+    if results is None:
+        results = [_sleep_states_args(a) for a in args]
+
+    states = np.empty(obs.shape, dtype=np.int8)
+    for rows, s in zip(batches, results):
+        states[rows] = s
+    return states
+
+def state_names(n_states):
+    '''
+    Returns the names of the states, from the least active
+    '''
+    if n_states == 2: return ['sleep', 'wake']
+    if n_states == 3: return ['deep sleep', 'light sleep', 'wake']
+    return ['state %s' % n for n in range(n_states)]
@@ -21,21 +21,29 @@
 #       MA 02110-1301, USA.
 
 
+# This is the analysis core of pySolo: it must be importable without wx,
+# without network access and without side effects, so that scripts
+# (see pysolo_nogui.py) and worker processes can use it.
+# Anything GUI related goes in default_panels.py or above.
+
 import os, cPickle, datetime
-from urllib import urlopen
+from io import BytesIO
 from zipfile import ZipFile, ZIP_DEFLATED
 
 import numpy as np
 from numpy.ma import *
 
-import wx.lib.newevent
-myEVT_FILE_MODIFIED, EVT_FILE_MODIFIED = wx.lib.newevent.NewCommandEvent()
-
 from pysolo_path import imgPath
 from pysolo_slices import *
 from pysolo_sleep_fun import *
+from pysolo_stats import *
+from pysolo_screen import *
+from pysolo_rebound import *
+from pysolo_circadian import *
+from pysolo_survival import *
+from pysolo_architecture import *
+from pysolo_hmm import *
 
-from pysolo_options import userConfig, customUserConfig
 GUI = dict()
 
 def logText(text):
@@ -72,16 +80,6 @@ class partial: #AKA curry
 
         return self.fun(*(self.pending + args), **kw)
 
-def SetFileAsModified(target):
-    """
-    Starts an EVENT telling around that the file has been
-    modified from its original form
-    """
-    #create the event
-    evt = myEVT_FILE_MODIFIED(wx.NewId(), Modified=True)
-    #post the event
-    wx.PostEvent(target, evt)
-
 def list2str(l, separator=' + '):
     """
     Takes the items in a list and expand them in a string
@@ -89,10 +87,64 @@ def list2str(l, separator=' + '):
     """
     return separator.join ( [str(el) for el in l] )
 
+def CompressSelections(selections, cDAM):
+    """
+    Takes the coordinates of the items selected in the navigation tree (type, k, m, d, f)
+    and, if together they make exactly one whole monitor, day or genotype, returns the coordinate
+    of that item alone, so that the range of flies or days is read with one call to filterbyStatus.
+    For instance all the flies of monitor m on day d become [(2, k, m, d, -1)].
+    Any other selection is returned as it is: panels join the arrays of the selections
+    one after the other and a partial merge would change their shapes.
+    """
+    def flies(k, m): return cDAM[k].rangeChannel[1].count(cDAM[k].Mon[m])
+    def days(k): return cDAM[k].getTotalDays()
+    def monitors(k): return len(cDAM[k].Mon)
+
+    # type of the items, the whole they belong to with the coordinate that varies, and how many make the whole
+    rules = [(4, lambda k, m, d, f: ((2, k, m, d, -1), f), lambda k, m, d, f: flies(k, m)),
+             (4, lambda k, m, d, f: ((5, k, m, -1, f), d), lambda k, m, d, f: days(k)),
+             (5, lambda k, m, d, f: ((1, k, m, -1, -1), f), lambda k, m, d, f: flies(k, m)),
+             (2, lambda k, m, d, f: ((1, k, m, -1, -1), d), lambda k, m, d, f: days(k)),
+             (2, lambda k, m, d, f: ((3, k, -1, d, -1), m), lambda k, m, d, f: monitors(k)),
+             (3, lambda k, m, d, f: ((0, k, -1, -1, -1), d), lambda k, m, d, f: days(k)),
+             (1, lambda k, m, d, f: ((0, k, -1, -1, -1), m), lambda k, m, d, f: monitors(k))]
+
+    original = selections
+    selections = [tuple(s) for s in selections]
+    changed = True
+    while changed:
+        changed = False
+        unique = []
+        for s in selections:
+            if s not in unique: unique.append(s)
+        selections = unique
+
+        for item_type, group, total in rules:
+            members = {}
+            for s in selections:
+                if s[0] == item_type:
+                    whole, value = group(*s[1:])
+                    members.setdefault(whole, set()).add(value)
+
+            complete = [whole for whole, values in members.items() if len(values) == total(*whole[1:])]
+            if not complete: continue
+
+            compressed = []
+            for s in selections:
+                whole = (s[0] == item_type) and group(*s[1:])[0]
+                if whole not in complete: compressed.append(s)
+                elif whole not in compressed: compressed.append(whole)
+            selections, changed = compressed, True
+
+    if len(selections) == 1: return selections
+    return original
+
 def CheckUpdatedVersion():
     """
     Check for an updated version of the program online
     """
+    from urllib import urlopen
+
     webaddress = 'http://www.pysolo.net/last_version.txt'
     try:
         version = urlopen(webaddress).read().rstrip('\n')
@@ -119,7 +171,7 @@ def SaveDADFile(cDAM, filename):
 
         headerlist = []
         for sDAM in cDAM:
-            newHeader = sDAM.getHeader()
+            newHeader = sDAM.getHeader() + [sDAM.getIndexHeader(), sDAM.getSleepHeader()]
             headerlist.append(newHeader)
 
         cPickle.dump(headerlist, tmpFileHandle)
@@ -127,6 +179,10 @@ def SaveDADFile(cDAM, filename):
         for sDAM in cDAM:
             sDAM.saveRawData(tmpFileHandle)
 
+        #the prefix sums go after all the raw data so that older versions can still read the file
+        for sDAM in cDAM:
+            sDAM.saveIndex(tmpFileHandle)
+
         tmpFileHandle.close()
 
         zipArchive = ZipFile(filename, 'w', compression = ZIP_DEFLATED)
@@ -166,6 +222,11 @@ def LoadDADFile(filename):
             cDAM.append (sliceType(*heads))
             cDAM[-1].loadRawData(damFile)
 
+        #files saved by older versions have no prefix sums nor other sleep definitions: they are built again
+        for sDAM, header in zip(cDAM, headerlist):
+            if len(header) > 3: sDAM.setSleepHeader(header[3])
+            sDAM.loadIndex(damFile, header[2:] and header[2] or [])
+
         damFile.close()
         os.remove(tmpFileName)
         success = cDAM
@@ -177,3 +238,195 @@ def LoadDADFile(filename):
     return success
 
 
+def SelectionColumns(cSEL, values, ds=0, fs=0, chunk_rows=100000):
+    """
+    Takes the 3D array values (days, flies, minutes) as returned by filterbyStatus
+    on the DAMslice cSEL starting from day ds and fly fs and yields it in chunks of
+    about chunk_rows rows. Every chunk is a list of (column_name, array) with the columns
+    genotype, monitor, channel, date, minute, value. value is a masked array.
+    """
+    values = np.ma.asarray(values)
+    d, f, t = values.shape
+    genotype = cSEL.getGenotype()
+    minutes = np.arange(t)
+    flies_per_chunk = (chunk_rows / t) or 1
+
+    for dd in range(d):
+        date = cSEL.getDate(ds+dd, format='yyyy-mm-dd') or str(ds+dd)
+        for f0 in range(0, f, flies_per_chunk):
+            f1 = f0 + flies_per_chunk
+            n = values[dd, f0:f1].shape[0]
+            mon_ch = [cSEL.getMonitorFlyName(fs+ff) for ff in range(f0, f0+n)]
+            yield [('genotype', np.repeat(genotype, n*t)),
+                   ('monitor', np.repeat([str(mc[0]) for mc in mon_ch], t)),
+                   ('channel', np.repeat([str(mc[1]) for mc in mon_ch], t)),
+                   ('date', np.repeat(date, n*t)),
+                   ('minute', np.tile(minutes, n)),
+                   ('value', values[dd, f0:f1].ravel())]
+
+def ArrayColumns(values, chunk_rows=100000):
+    """
+    Yields any N-dimensional (masked) array in chunks of chunk_rows rows.
+    Every chunk is a list of (column_name, array) with one column for the
+    index on each axis (axis0, axis1, ...) and a last masked column named value
+    """
+    values = np.ma.asarray(values)
+    if values.ndim == 0: values = values.reshape(1)
+    flat = values.ravel()
+
+    for start in range(0, values.size, chunk_rows):
+        idx = np.arange(start, values.size)[:chunk_rows]
+        coords = np.unravel_index(idx, values.shape)
+        yield [('axis%s' % n, c) for n, c in enumerate(coords)] + [('value', flat[idx])]
+
+def WriteColumns(chunks, fh, separator=',', null='', header=True):
+    """
+    Writes the chunks yielded by SelectionColumns or ArrayColumns to the open file
+    (or file like object) fh as delimited text, one chunk at a time.
+    If header is True column names are written on the first line.
+    Masked values are written as null.
+    """
+    for columns in chunks:
+        if header:
+            fh.write(separator.join([name for name, col in columns]) + '\n')
+            header = False
+
+        text = []
+        for name, col in columns:
+            txt = np.ma.getdata(col).astype(str)
+            mask = np.ma.getmaskarray(col)
+            if mask.any():
+                txt = txt.astype('S%s' % (txt.dtype.itemsize + len(null)))
+                txt[mask] = null
+            text.append(txt)
+
+        if text and len(text[0]):
+            lines = text[0]
+            for txt in text[1:]:
+                lines = np.char.add(np.char.add(lines, separator), txt)
+            fh.write('\n'.join(lines.tolist()) + '\n')
+
+def ExportColumnsToCSV(chunks, filename, separator=',', null=''):
+    """
+    Writes the chunks yielded by SelectionColumns or ArrayColumns to a text file,
+    one chunk at a time. Masked values are written as null.
+    Returns True on success, False if the file cannot be written
+    """
+    try:
+        fh = open(filename, 'w')
+        try:
+            WriteColumns(chunks, fh, separator, null)
+        finally:
+            fh.close()
+        success = True
+    except (IOError, OSError):
+        success = False
+
+    return success
+
+def ExportColumnsToNPZ(chunks, filename):
+    """
+    Writes the chunks yielded by SelectionColumns or ArrayColumns to a compressed
+    numpy archive, one chunk at a time. Every column of every chunk is stored
+    as a separate array (name_00000, name_00001, ...) and the mask of every masked
+    column is stored as the boolean array name_mask_00000, name_mask_00001, ...
+    The file can be read back with LoadExportedColumns or with numpy.load
+    Returns True on success, False if the file cannot be written
+    """
+    try:
+        zipArchive = ZipFile(filename, 'w', compression = ZIP_DEFLATED, allowZip64 = True)
+        try:
+            for n, chunk in enumerate(chunks):
+                masks = [('%s_mask' % name, np.ma.getmaskarray(col)) for name, col in chunk if np.ma.isMaskedArray(col)]
+                for name, col in chunk + masks:
+                    buf = BytesIO()
+                    np.save(buf, np.ma.getdata(col))
+                    zipArchive.writestr('%s_%05d.npy' % (name, n), buf.getvalue())
+        finally:
+            zipArchive.close()
+        success = True
+    except (IOError, OSError):
+        success = False
+
+    return success
+
+def LoadExportedColumns(filename):
+    """
+    Reads a file written by ExportColumnsToNPZ and returns a dictionary of columns.
+    Columns that were exported as masked arrays are returned as masked arrays.
+    """
+    npz = np.load(filename)
+    chunks = dict()
+    for n in npz.files:
+        name, chunk = n.rsplit('_', 1)
+        chunks.setdefault(name, []).append((chunk, n))
+
+    #files written before every column had its mask carry the mask of value as masked
+    if 'masked' in chunks and 'value_mask' not in chunks:
+        chunks['value_mask'] = chunks.pop('masked')
+
+    columns = dict()
+    for name in chunks:
+        if name.endswith('_mask') and name[:-5] in chunks: continue
+        data, mask = [], []
+        masks = dict(chunks.get(name + '_mask', []))
+        for chunk, n in sorted(chunks[name]):
+            data.append(npz[n])
+            if chunk in masks: mask.append(npz[masks[chunk]])
+            else: mask.append(np.zeros(len(data[-1]), dtype=bool))
+
+        if masks: columns[name] = np.ma.masked_array(np.concatenate(data), mask=np.concatenate(mask))
+        else: columns[name] = np.concatenate(data)
+    npz.close()
+
+    return columns
+
+def ArchitectureColumns(cDAM, window=60, threshold=0, **filter):
+    """
+    Takes a list of DAMslice and yields the sleep architecture of all their flies,
+    one chunk for every day of every DAMslice. Every chunk is a list of (column_name, array)
+    with the columns genotype, monitor, channel, date, minute (start of the window),
+    p_wake, p_doze, active, doze, inactive, wake.
+    filter is passed to filterbyStatus. Masked probabilities are nan.
+    """
+    for cSEL in cDAM:
+        ax = cSEL.filterbyStatus(0, -1, 0, -1, **filter)[0]
+        d, f, t = ax.shape
+        counts = transition_counts(ax, window, threshold)
+        p_wake, p_doze = transition_probabilities(ax, window, threshold)
+        n = p_wake.shape[2]
+
+        genotype = cSEL.getGenotype()
+        mon_ch = [cSEL.getMonitorFlyName(ff) for ff in range(f)]
+        minutes = np.arange(n) * window
+
+        for dd in range(d):
+            date = cSEL.getDate(dd, format='yyyy-mm-dd') or str(dd)
+            columns = [('genotype', np.repeat(genotype, f*n)),
+                       ('monitor', np.repeat([str(mc[0]) for mc in mon_ch], n)),
+                       ('channel', np.repeat([str(mc[1]) for mc in mon_ch], n)),
+                       ('date', np.repeat(date, f*n)),
+                       ('minute', np.tile(minutes, f))]
+            for name, p in [('p_wake', p_wake), ('p_doze', p_doze)]:
+                columns.append((name, np.ma.masked_array(p[dd].filled(np.nan).ravel(), mask=np.ma.getmaskarray(p[dd]).ravel())))
+            for name, c in zip(['active', 'doze', 'inactive', 'wake'], counts):
+                columns.append((name, c[dd].ravel()))
+            yield columns
+
+def ExportArchitecture(filenames, outfile, window=60, threshold=0, binary=False, **filter):
+    """
+    Batch export of the sleep architecture (see ArchitectureColumns) of all the flies
+    in the given DAD files, one file at a time, to a text or compressed numpy file.
+    Returns True on success
+    """
+    def all_chunks():
+        for filename in filenames:
+            cDAM = LoadDADFile(filename)
+            if not cDAM: continue
+            for columns in ArchitectureColumns(cDAM, window, threshold, **filter):
+                yield columns
+
+    if binary:
+        return ExportColumnsToNPZ(all_chunks(), outfile)
+    else:
+        return ExportColumnsToCSV(all_chunks(), outfile)
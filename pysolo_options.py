@@ -351,7 +351,7 @@ class OptionsVideoPanel(wx.ScrolledWindow):
             items.append ( wx.StaticText(self, -1, '\nMinimum and Maximum distances to be called movement.') )
             titleFont = wx.Font(10, wx.SWISS, wx.NORMAL, wx.BOLD)
             items[-1].SetFont(titleFont)
-            items.append ( wx.StaticText(self, -1, 'Tweak the values here to define the the minimum and maximum distance (in pixel) for the movement range.\nDetected movements that will have a smaller or bigger threshold will be considered noise and ignored.\nThis setting depends on the quality of your acquisition and on your desire to detect small fly movements'))
+            items.append ( wx.StaticText(self, -1, 'Tweak the values here to define the the minimum and maximum distance (in pixel) for the movement range.\nDetected movements that will have a smaller or bigger threshold will be considered noise and ignored.\nThis setting depends on the quality of your acquisition and on your desire to detect small fly movements.\nFrames are binned minute by minute: the minimum distance applies to the total movement over the 5 minutes of a sleep window.'))
             
             grid2 = wx.BoxSizer(wx.HORIZONTAL)
             mins = str(self.temp_userconfig['min_distance'])
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_rebound.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Rebound engine for sleep deprivation experiments.
+# Baseline, sleep deprivation and recovery days are taken from one extraction of the data
+# and reduced, for every fly, to the cumulative sleep curve of an average day of each kind.
+# The amount of sleep in any window is then the difference of two points of a curve,
+# so every rebound window and every efficiency threshold comes at no cost.
+
+import numpy as np
+
+BASELINE, DEPRIVATION, RECOVERY = 1, 2, 3
+
+
+class ReboundEngine(object):
+    """
+    Takes the 3D array s5 (days, flies, minutes) as returned by filterbyStatus
+    and the 2D array of the status of each fly on each day (see DAMslice.getStatusSlice)
+    and computes for every fly the cumulative sleep curve of its average baseline,
+    deprivation and recovery day.
+    """
+
+    windows = [('rebound TD', 1, 1440),
+               ('rebound 0-3H', 1, 180),
+               ('rebound 0-6H', 1, 360),
+               ('rebound 0-9H', 1, 540),
+               ('rebound RD', 1, 720),
+               ('rebound RN', 721, 1440)]
+
+    def __init__(self, s5, status):
+        """
+        """
+        d, f, t = s5.shape
+        self.length = t
+
+        # cumulative sleep of every day, with a 0 in front so that sleep between
+        # minute t0 and minute t1 is curve[t1] - curve[t0]
+        cs = np.zeros((d, f, t+1), dtype=np.float64)
+        np.cumsum(np.ma.filled(s5, 0), axis=2, out=cs[:,:,1:])
+
+        valid = ~np.ma.getmaskarray(s5).any(axis=2)
+        status = np.asarray(status)
+
+        self.curves = {}
+        self.days = {}
+        for kind in [BASELINE, DEPRIVATION, RECOVERY]:
+            use = valid & (status == kind)
+            n = use.sum(axis=0)
+            total = np.einsum('dft,df->ft', cs, use.astype(np.float64))
+            curve = total / np.maximum(n, 1)[:,np.newaxis]
+            self.curves[kind] = np.ma.masked_array(curve, mask=np.repeat((n == 0)[:,np.newaxis], t+1, axis=1))
+            self.days[kind] = n
+
+        # a fly is alive if it sleeps less than 1430 minutes on every baseline day
+        daily = cs[:,:,-1]
+        baseline = valid & (status == BASELINE)
+        self.alive = ((daily < 1430) | ~baseline).all(axis=0) & baseline.any(axis=0)
+
+    def _bounds(self, t0=None, t1=None):
+        """
+        Converts t0, t1 into positions on the curves, as slicing s5[:,:,t0:t1] would
+        """
+        t0, t1, step = slice(t0, t1).indices(self.length)
+        return t0, max(t0, t1)
+
+    def sleepAmount(self, kind, t0=None, t1=None):
+        """
+        Minutes of sleep between t0 and t1 of the average day of the given kind, for every fly
+        """
+        t0, t1 = self._bounds(t0, t1)
+        return self.curves[kind][:,t1] - self.curves[kind][:,t0]
+
+    def getEfficiency(self, t0=None, t1=None):
+        """
+        Sleep deprivation efficiency (%) of every fly, that is the fraction of
+        baseline sleep lost during the deprivation day, between t0 and t1
+        """
+        bs_sleep = self.sleepAmount(BASELINE, t0, t1)
+        sd_sleep = self.sleepAmount(DEPRIVATION, t0, t1)
+        return (1.0 - (sd_sleep / bs_sleep)) * 100
+
+    def getAlive(self):
+        """
+        Number of flies alive through their baseline days
+        """
+        return self.alive.sum()
+
+    def getWindow(self, choice):
+        """
+        Returns t0, t1 of the rebound window with the given name
+        """
+        for name, t0, t1 in self.windows:
+            if name == choice: return t0, t1
+        return None, None
+
+    def getRecovery(self, t0=None, t1=None):
+        """
+        Minutes of sleep gained on the recovery day compared to baseline, between t0 and t1
+        """
+        return self.sleepAmount(RECOVERY, t0, t1) - self.sleepAmount(BASELINE, t0, t1)
+
+    def getRebound(self, t0=None, t1=None):
+        """
+        Rebound (%) = sleep gained during recovery / sleep lost during deprivation
+        Rebound = (RE - BS) / (BS - SD)
+        """
+        lost = self.sleepAmount(BASELINE) - self.sleepAmount(DEPRIVATION)
+        return (self.getRecovery(t0, t1) / lost) * 100
+
+    def getReboundCurves(self):
+        """
+        Returns the 2D array (flies, minutes+1) with the cumulative rebound (%) of every fly:
+        the sleep gained on the recovery day from its beginning to each minute, over the sleep lost
+        """
+        lost = self.sleepAmount(BASELINE) - self.sleepAmount(DEPRIVATION)
+        gained = self.curves[RECOVERY] - self.curves[BASELINE]
+        return gained / lost[:,np.newaxis] * 100
+
+    def getReboundColumns(self, t0=None, t1=None):
+        """
+        Returns a list of (column_name, array) with one row for every fly: its SD efficiency
+        between t0 and t1, then sleep gained and rebound for every window
+        """
+        columns = [('fly', np.arange(len(self.days[BASELINE]))),
+                   ('SD efficiency', self.getEfficiency(t0, t1))]
+        for name, w0, w1 in self.windows:
+            columns.append(('%s (min)' % name.replace('rebound ', 'recovery '), self.getRecovery(w0, w1)))
+            columns.append(('%s (%%)' % name, self.getRebound(w0, w1)))
+        return columns
+
+    def getThresholdSweep(self, thresholds, t0=None, t1=None, tr=None, tr1=None):
+        """
+        Returns a list of (column_name, array) with one row for every SD efficiency threshold:
+        threshold, number of flies included (efficiency between t0 and t1 at least the threshold),
+        their average rebound and sleep gain in the window tr, tr1 and the st.dev. of both.
+        Flies are sorted once by efficiency and the averages come from prefix sums,
+        so the whole sweep costs about as much as one threshold.
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        sde = self.getEfficiency(t0, t1)
+        valid = ~np.ma.getmaskarray(sde) & np.isfinite(np.ma.getdata(sde))
+
+        # flies sorted from the most to the least deprived
+        order = np.argsort(-np.ma.getdata(sde)[valid], kind='mergesort')
+        sorted_sde = np.ma.getdata(sde)[valid][order]
+        # number of flies at or above each threshold
+        n = np.searchsorted(-sorted_sde, -thresholds, side='right')
+
+        columns = [('threshold', thresholds), ('n', n)]
+        for name, values in [('rebound', self.getRebound(tr, tr1)), ('sleep gain', self.getRecovery(tr, tr1))]:
+            v = np.ma.masked_invalid(values)[valid][order]
+            ok = ~np.ma.getmaskarray(v)
+            x = np.ma.getdata(v) * ok
+            count = np.concatenate(([0], np.cumsum(ok)))[n]
+            s = np.concatenate(([0.], np.cumsum(x)))[n]
+            ss = np.concatenate(([0.], np.cumsum(x**2)))[n]
+
+            mean = s / np.maximum(count, 1)
+            sd = np.sqrt(np.maximum(ss / np.maximum(count, 1) - mean**2, 0))
+            columns.append((name, np.ma.masked_array(mean, mask=(count == 0))))
+            columns.append(('%s st.dv.' % name, np.ma.masked_array(sd, mask=(count == 0))))
+
+        return columns
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_screen.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Screen engine: takes the DAMslices of a screen (one line / genotype each) one at a time
+# and keeps only a handful of numbers for every fly, plus running sums for every line
+# and every plate (a monitor in one run). The population array of all the flies is
+# never built, so the size of a screen is limited by the number of flies and not by
+# their minutes.
+
+import numpy as np
+from pysolo_sleep_fun import std, stde, ActivityIndexByFly, brief_awakenings
+
+
+class ScreenEngine(object):
+    """
+    Collects the statistics of a genome scale screen one DAMslice at a time.
+    For every fly it keeps the average over days (and its st.dev.) of every metric;
+    for every line and every plate it keeps running sums (n, sum, sum of squares).
+    Z-scores are normalized on the plate the fly was in: the same monitor recorded
+    in runs starting on different dates counts as different plates.
+    """
+
+    metrics = ['sleep TD', 'sleep RD', 'sleep RN', 'AI', 'BA']
+
+    def __init__(self, lightsoff=720, use_std=True, ba_length=1):
+        """
+        ba_length is the longest awakening (in minutes) counted as brief awakening
+        """
+        self.lightsoff = lightsoff
+        self.ba_length = ba_length
+        self.cStd = use_std and std or stde
+
+        self.headers = dict([(key, []) for key in ['genotype', 'monitor', 'channel', 'plate']])
+        self.values = dict([(metric, []) for metric in self.metrics])
+        self.stdevs = dict([(metric, []) for metric in self.metrics])
+
+        self.lines = dict([(metric, {}) for metric in self.metrics])
+        self.plates = dict([(metric, {}) for metric in self.metrics])
+
+        self._cache = {}
+
+    def addSlice(self, cSEL, ax, s5):
+        """
+        Adds the flies of the DAMslice cSEL, whose data ax and s5 (days, flies, minutes)
+        were returned by filterbyStatus. Only the summaries are kept.
+        """
+        d, n_flies, c = s5.shape
+        lightsoff = self.lightsoff
+
+        by_day = {'sleep TD' : s5.sum(axis=2),
+                  'sleep RD' : s5[:,:,0:lightsoff].sum(axis=2),
+                  'sleep RN' : s5[:,:,lightsoff:1440].sum(axis=2),
+                  'AI' : ActivityIndexByFly(ax, s5),
+                  'BA' : brief_awakenings(s5, length=self.ba_length)}
+
+        genotype = cSEL.getGenotype()
+        mon_ch = [cSEL.getMonitorFlyName(fly) for fly in range(n_flies)]
+        monitors = np.array([str(mc[0]) for mc in mon_ch])
+
+        #slices of the same run share their plates, the start date tells runs apart
+        start = '%s/%s/%s' % (cSEL.StartYear, cSEL.StartMonth, cSEL.StartDay)
+        plates = np.array(['%s@%s' % (monitor, start) for monitor in monitors])
+
+        self.headers['genotype'].append(np.repeat([genotype], n_flies))
+        self.headers['monitor'].append(monitors)
+        self.headers['plate'].append(plates)
+        self.headers['channel'].append(np.array([str(mc[1]) for mc in mon_ch]))
+
+        for metric in self.metrics:
+            value = np.ma.average(np.ma.masked_invalid(by_day[metric]), axis=0)
+            value = np.ma.masked_array(value, mask=np.ma.getmaskarray(value))
+            self.values[metric].append(value)
+            self.stdevs[metric].append(self.cStd(by_day[metric], axis=0))
+
+            self._accumulate(self.lines[metric], np.repeat([genotype], n_flies), value)
+            self._accumulate(self.plates[metric], plates, value)
+
+        self._cache = {}
+
+    def _accumulate(self, table, keys, value):
+        """
+        Adds the valid values to the running sums [n, sum, sum of squares] of their key
+        """
+        valid = ~np.ma.getmaskarray(value)
+        keys = np.asarray(keys)[valid]
+        value = np.ma.getdata(value)[valid].astype(np.float64)
+        if not len(keys): return
+
+        names, idx = np.unique(keys, return_inverse=True)
+        n = np.bincount(idx, minlength=len(names))
+        s = np.bincount(idx, weights=value, minlength=len(names))
+        ss = np.bincount(idx, weights=value**2, minlength=len(names))
+
+        for name, sums in zip(names, np.array([n, s, ss]).T):
+            table[name] = table.get(name, np.zeros(3)) + sums
+
+    def _stats(self, table, keys):
+        """
+        Returns n, mean and st.dev. of the running sums in table, for every key.
+        Keys not in table (all their values were masked) have n, mean and st.dev. 0
+        """
+        names, idx = np.unique(np.asarray(keys), return_inverse=True)
+        sums = np.array([table.get(name, np.zeros(3)) for name in names]).reshape(-1, 3)
+        n, s, ss = sums.T
+        mean = s / np.maximum(n, 1)
+        sd = np.sqrt(np.maximum(ss - n * mean**2, 0) / np.maximum(n - 1, 1))
+
+        return n[idx], mean[idx], sd[idx]
+
+    def getColumn(self, key, stdev=False):
+        """
+        Returns a header (genotype, monitor, channel, plate) or a metric for all the flies seen so far.
+        If stdev is True returns the st.dev. of the metric across days instead
+        """
+        if (key, stdev) not in self._cache:
+            if key in self.headers:
+                parts = self.headers[key]
+                column = np.concatenate(parts) if parts else np.array([], dtype=str)
+            else:
+                parts = (stdev and self.stdevs or self.values)[key]
+                column = np.ma.concatenate(parts) if parts else np.ma.masked_array([])
+            self._cache[(key, stdev)] = column
+        return self._cache[(key, stdev)]
+
+    def getNumberFlies(self):
+        """
+        """
+        return len(self.getColumn('genotype'))
+
+    def getZScores(self, metric):
+        """
+        Returns the z-score of every fly for the given metric, normalized on the mean
+        and st.dev. of the plate it was in. Masked where the value is masked
+        or the plate has no spread (or no valid values at all).
+        """
+        key = (metric, 'z')
+        if key not in self._cache:
+            value = self.getColumn(metric)
+            n, mean, sd = self._stats(self.plates[metric], self.getColumn('plate'))
+            z = (np.ma.getdata(value) - mean) / np.where(sd > 0, sd, 1)
+            self._cache[key] = np.ma.masked_array(z, mask=np.ma.getmaskarray(value) | (sd <= 0))
+        return self._cache[key]
+
+    def getLineScores(self, metric):
+        """
+        Returns a list of (column_name, array) with one row for every line:
+        genotype, n, mean, st.dev. and the average plate normalized z-score of its flies
+        """
+        names = np.array(sorted(self.lines[metric].keys()), dtype=str)
+        n, mean, sd = self._stats(self.lines[metric], names)
+
+        z = self.getZScores(metric)
+        valid = ~np.ma.getmaskarray(z)
+        genotype = self.getColumn('genotype')[valid]
+        pos = np.searchsorted(names, genotype)
+        n_z = np.bincount(pos, minlength=len(names))
+        sum_z = np.bincount(pos, weights=np.ma.getdata(z)[valid], minlength=len(names))
+        line_z = np.ma.masked_array(sum_z / np.maximum(n_z, 1), mask=(n_z == 0))
+
+        return [('genotype', names), ('n', n.astype(int)), ('mean', mean), ('st.dev.', sd), ('z', line_z)]
+
+    def getHits(self, metric, threshold=2.5, min_flies=1):
+        """
+        Returns the line scores of the lines whose average z-score is at least threshold
+        away from 0, based on at least min_flies flies, sorted from the strongest
+        """
+        columns = self.getLineScores(metric)
+        z = columns[-1][1]
+        n = columns[1][1]
+        hit = (np.abs(z.filled(0)) >= threshold) & ~np.ma.getmaskarray(z) & (n >= min_flies)
+        order = np.argsort(-np.abs(z.filled(0)[hit]), kind='mergesort')
+        return [(name, col[hit][order]) for name, col in columns]
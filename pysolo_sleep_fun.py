@@ -6,7 +6,6 @@
 ## hopefully they soon will be obsolete
 
 import numpy as np
-import scipy.stats.stats as stats
 from numpy.ma import *
 
 
@@ -90,6 +89,105 @@ def stde(a, axis=None):
 
 ## Sleep Specific Functions
 
+def _window_sum(a, width):
+    '''
+    Returns the sum of every run of width consecutive bins along the last axis.
+    Output is width-1 bins shorter than the input: bin i holds a[...,i:i+width].sum()
+    There is no wrapping around the edges.
+    '''
+    cs = np.zeros(a.shape[:-1] + (a.shape[-1]+1,), dtype=np.float64)
+    np.cumsum(a, axis=-1, out=cs[...,1:])
+    return cs[...,width:] - cs[...,:-width]
+
+def bin_activity_by_minute(activity, timestamps=None, day_length=1440):
+    '''
+    bin_activity_by_minute(activity, timestamps=None, day_length=1440)
+
+    Takes the 3D array activity (d,f,c) sampled at any rate and returns a 3D array (d,f,day_length)
+    with the activity summed minute by minute.
+    timestamps is an optional 1D array of length c giving the minute of the day (as float)
+    at which each sample was taken. If not given the c samples are assumed to be evenly
+    spread along the day, so that recordings with missing frames do not need to be padded.
+    '''
+    d, f, c = activity.shape
+
+    if timestamps is None:
+        if c % day_length == 0:
+            return activity.reshape((d, f, day_length, c / day_length)).sum(axis=3)
+        timestamps = np.arange(c) * float(day_length) / c
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    order = np.argsort(timestamps, kind='mergesort')
+    if (order != np.arange(c)).any():
+        activity = activity[:,:,order]
+        timestamps = timestamps[order]
+
+    minutes = np.clip(np.floor(timestamps).astype(int), 0, day_length-1)
+    #position of the first sample of each minute. Empty minutes will sum to 0
+    edges = np.searchsorted(minutes, np.arange(day_length+1))
+
+    cs = np.zeros((d, f, c+1), dtype=np.float64)
+    np.cumsum(activity, axis=2, out=cs[:,:,1:])
+    return cs[:,:,edges[1:]] - cs[:,:,edges[:-1]]
+
+def sleep_from_activity(activity, sleep_length=5, inactivity=0):
+    '''
+    sleep_from_activity(activity, sleep_length=5, inactivity=0)
+
+    Takes an array of activity counts binned by minute, with time running on the last axis,
+    and returns a boolean array of the same shape marking the minutes of sleep, that is every
+    minute belonging to at least one stretch of sleep_length minutes in which the overall
+    activity did not exceed inactivity.
+    The array is computed in one pass through cumulative sums; edges are not wrapped around.
+    '''
+    return sleep_by_definitions(activity, [(sleep_length, inactivity)])[0]
+
+def sleep_by_definitions(activity, definitions):
+    '''
+    sleep_by_definitions(activity, definitions)
+
+    Same as sleep_from_activity but for a list of definitions of sleep, each given as
+    (sleep_length, inactivity). Returns a list with the sleep array of every definition.
+    The cumulative sum of activity is computed once and shared by all of them.
+    '''
+    n = activity.shape[-1]
+    cs = np.zeros(activity.shape[:-1] + (n+1,), dtype=np.float64)
+    np.cumsum(activity, axis=-1, out=cs[...,1:])
+
+    return [_sleep_from_cumsum(cs, sleep_length, inactivity) for sleep_length, inactivity in definitions]
+
+def _sleep_from_cumsum(cs, sleep_length, inactivity):
+    '''
+    Sleep minutes for one definition, from the cumulative sum of activity (see sleep_by_definitions)
+    '''
+    n = cs.shape[-1] - 1
+    if n < sleep_length:
+        return np.zeros(cs.shape[:-1] + (n,), dtype=bool)
+
+    # qualifying stretches, indexed by their first minute
+    still = ((cs[...,sleep_length:] - cs[...,:-sleep_length]) <= inactivity)
+
+    # minute i is asleep if any stretch starting between i-sleep_length+1 and i qualifies
+    cq = np.zeros(still.shape[:-1] + (still.shape[-1]+1,), dtype=np.int32)
+    np.cumsum(still, axis=-1, out=cq[...,1:])
+    i = np.arange(n)
+    first = np.clip(i - sleep_length + 1, 0, n - sleep_length)
+    last = np.clip(i, 0, n - sleep_length) + 1
+    return (cq[...,last] - cq[...,first]) > 0
+
+def sleep_in_window(s5, window=30):
+    '''
+    Returns, for each minute, the amount of sleep in the window minutes centred on it
+    (the fly30min array). The window is truncated at the edges.
+    '''
+    n = s5.shape[-1]
+    cs = np.zeros(s5.shape[:-1] + (n+1,), dtype=np.int32)
+    np.cumsum(s5, axis=-1, out=cs[...,1:])
+    i = np.arange(n)
+    first = np.clip(i - int(np.ceil(window / 2.)), 0, n)
+    last = np.clip(i + int(np.floor(window / 2.)), 0, n)
+    return cs[...,last] - cs[...,first]
+
 def isAllMasked(a):
     '''
     Return true if all the contents of the given array are masked objects
@@ -145,17 +243,118 @@ def number_sleep_episodes(s5, t0 = None, t1 = None):
 
     return w2s.sum(axis = 2)
 
+def sleep_onset(s5, t0=0, t1=None):
+    """
+    Returns the position of the first minute of sleep in the interval (t0,t1), counted from t0,
+    for every row of s5 (that is for every (day, fly) of a 3D array).
+    The search is done with a single argmax on a view of the data, so the only extra memory
+    is of the size of the result.
+    The result is masked where there is no sleep in the interval or where the row is masked.
+    """
+    window = s5[...,t0:t1]
+    data = np.ma.getdata(window)
+
+    if data.shape[-1] == 0:
+        return np.ma.masked_all(data.shape[:-1], dtype=int)
+
+    first = np.argmax(data, axis=-1)
+    # argmax returns 0 also when there is no sleep at all, so we check the value it points to
+    rows = tuple(np.indices(first.shape))
+    nosleep = data[rows + (first,)] <= 0
+
+    mask = np.ma.getmask(window)
+    if mask is not np.ma.nomask:
+        nosleep = nosleep | mask.any(axis=-1)
+
+    return np.ma.masked_array(first, mask=nosleep)
+
 def sleep_latency(s5, lightsoff=720):
     """
     returns sleep latency in minutes, that is time between lights off and first recorded sleep episode of at least 5 minutes
+    flies already asleep when lights go off have latency 0; flies that do not sleep are masked
     """
-    grid = np.indices(s5.shape)[-1] # compile a grid containing the indices of the array
-    k = grid * s5 # keep only the indices where s5 is 1
-    
-    sl = np.argmax(k > lightsoff, axis=-1) - lightsoff
-    return np.ma.masked_less(sl, 0)
+    return sleep_onset(s5, lightsoff)
+
+def morning_latency(s5, lightson=0, lightsoff=720):
+    """
+    returns morning sleep latency in minutes, that is time between lights on and first recorded sleep episode
+    of at least 5 minutes during the light phase; flies that do not sleep before lights off are masked
+    """
+    return sleep_onset(s5, lightson, lightsoff)
     
 
+def consolidated_sleep_onset(s30, threshold=25, t0=0, t1=None):
+    """
+    returns the first minute in the interval (t0,t1), counted from t0, at which the amount of sleep
+    in the surrounding 30 minutes (s30) reaches threshold, for every (day, fly).
+    The result is masked where the threshold is never reached or where the row is masked
+    """
+    window = s30[...,t0:t1]
+    above = np.ma.masked_array(np.ma.getdata(window) >= threshold, mask=np.ma.getmask(window))
+    return sleep_onset(above)
+
+def activity_peak(ax, left=0, right=None, bin_length=30):
+    """
+    Sums the activity along the last axis in bins of bin_length minutes and returns a tuple
+    with the bin between left and right where the activity peaks, for every (day, fly),
+    and the binned activity. Minutes not filling a whole bin at the end are left out.
+    The peak is masked where there is no activity between left and right or where the row is masked
+    With bin_length=1 ax is taken as already binned (see DAMslice.getBinned)
+    """
+    if bin_length > 1:
+        n_bins = ax.shape[-1] / bin_length
+        binned = ax[...,:n_bins*bin_length].reshape(ax.shape[:-1] + (n_bins, bin_length)).sum(axis=-1)
+    else:
+        binned = ax
+
+    window = np.ma.getdata(binned)[...,left:right]
+    if window.shape[-1] == 0:
+        return np.ma.masked_all(window.shape[:-1], dtype=int), binned
+
+    peak = np.argmax(window, axis=-1)
+    nopeak = window.max(axis=-1) <= 0
+
+    mask = np.ma.getmask(binned)
+    if mask is not np.ma.nomask:
+        nopeak = nopeak | mask.any(axis=-1)
+
+    return np.ma.masked_array(peak + (left or 0), mask=nopeak), binned
+
+def actogram(values, double_plot=True):
+    """
+    Takes the binned values of one fly or group (days, bins) and returns the rows of its actogram
+    as a 2D float array, masked values as nan. When double plotted every row has a day followed
+    by the next one and the second half of the last row is empty (nan)
+    """
+    rows = np.ma.filled(np.ma.asarray(values).astype(np.float64), np.nan)
+    if double_plot:
+        following = np.empty(rows.shape)
+        following[:-1] = rows[1:]
+        following[-1] = np.nan
+        rows = np.concatenate((rows, following), axis=1)
+    return rows
+
+def tile_actograms(actograms, columns=8, gap=1):
+    """
+    Puts a list of actograms (see actogram) in one 2D image, columns actograms per row,
+    separated by gap rows and columns of nan. Shorter actograms are padded with nan.
+    Returns the image and the (row, column) of the top left corner of every actogram
+    """
+    n = len(actograms)
+    columns = int(np.clip(columns, 1, n))
+    lines = (n + columns - 1) / columns
+    h = np.max([a.shape[0] for a in actograms])
+    w = np.max([a.shape[1] for a in actograms])
+
+    image = np.empty((lines * (h + gap) - gap, columns * (w + gap) - gap))
+    image.fill(np.nan)
+    corners = []
+    for i, a in enumerate(actograms):
+        r, c = (i / columns) * (h + gap), (i % columns) * (w + gap)
+        image[r:r+a.shape[0], c:c+a.shape[1]] = a
+        corners.append((r, c))
+    return image, corners
+
 def all_sleep_episodes(s5, t0 = None, t1 = None):
     '''
     Returns the length of all sleep episodes in the given interval (t0,t1)
@@ -183,24 +382,107 @@ def all_sleep_episodes(s5, t0 = None, t1 = None):
     #subtract one from the other to know length in minutes
     return (s2w - w2s)
 
+def sleep_episodes_by_fly(s5, t0 = None, t1 = None):
+    '''
+    Returns two 2D arrays (days, flies) with the number of sleep episodes in the interval (t0,t1)
+    and the minutes of sleep they cover, for the whole 3D array s5 at once.
+    As in all_sleep_episodes the first minute of the interval is taken as awake;
+    episodes still going on at t1 are closed there.
+    '''
+    window = np.ma.getdata(s5[...,t0:t1]) > 0
+
+    if window.shape[-1] < 2:
+        empty = np.zeros(window.shape[:-1], dtype=int)
+        return empty, empty.copy()
+
+    # a wake to sleep transition is a minute of sleep following a minute awake
+    onsets = (window[...,2:] & ~window[...,1:-1]).sum(axis=-1) + window[...,1]
+    minutes = window[...,1:].sum(axis=-1)
+
+    mask = np.ma.getmask(s5)
+    if mask is not np.ma.nomask:
+        mask = mask[...,t0:t1].any(axis=-1)
+        onsets = np.ma.masked_array(onsets, mask=mask)
+        minutes = np.ma.masked_array(minutes, mask=mask)
+
+    return onsets, minutes
+
+def sleep_stats_by_fly(ax, s5, lightsoff=720):
+    '''
+    sleep_stats_by_fly(ax, s5, lightsoff=720)
+
+    Takes the 3D arrays ax and s5 and returns a dictionary of 2D arrays (days, flies)
+    with the basic sleep statistics of each fly, on each day:
+    alive, sleep, day_sleep, night_sleep, AI, day_episode_length, day_episodes,
+    night_episode_length, night_episodes, latency
+    Day is the interval 0-lightsoff, night is lightsoff-1440.
+    Average length of episodes is masked where there are no episodes.
+    '''
+    sleep = s5.sum(axis=-1)
+    stats = dict(alive = sleep < 1430,
+                 sleep = sleep,
+                 day_sleep = SleepAmountByFly(s5, 0, lightsoff),
+                 night_sleep = SleepAmountByFly(s5, lightsoff, 1440),
+                 AI = ax.sum(axis=-1) / (1440. - sleep),
+                 latency = sleep_latency(s5, lightsoff))
+
+    for name, t0, t1 in [('day', 0, lightsoff), ('night', lightsoff+1, 1440)]:
+        onsets, minutes = sleep_episodes_by_fly(s5, t0, t1)
+        stats[name+'_episodes'] = onsets
+        stats[name+'_episode_length'] = np.ma.masked_where(onsets == 0, minutes / np.maximum(onsets, 1.))
+
+    return stats
+
+
 def ba(s5, t0 = None, t1 = None):
     '''
     Compute brief awakenings analysis.
     A brief awakening is defined as 1 minute of activity between two stretches of sleep.
-    returns an array "ba". the number of ba can be obtained as ba.sum(axis=2) 
+    returns an array "ba". the number of ba can be obtained as ba.sum(axis=2)
+    or directly with brief_awakenings
+    The first and last minute of the interval are never brief awakenings: there is no wrapping around
     '''
-    
-    s5_1 = s5[:,:,t0:t1]
-    s5_2 = np.roll(s5_1, -1, axis=2)
-    s5_3 = np.roll(s5_1, +1, axis=2)
-    
-    # we subtract the value of position +1 and -1 frm position 0
-    ba_1 = s5_1 - (s5_2 + s5_3)
-    ba_2 = (ba_1 == -2)
-    
-    # lastly we convert the data_type from boolean to integer and we return it 
-    dt = s5.dtype
-    return ba_2.astype(dt)
+    s5_1 = s5[...,t0:t1]
+    data = np.ma.getdata(s5_1)
+
+    ba_2 = np.zeros(data.shape, dtype=s5.dtype)
+    ba_2[...,1:-1] = (data[...,1:-1] == 0) & (data[...,:-2] == 1) & (data[...,2:] == 1)
+
+    return np.ma.masked_array(ba_2, mask=np.ma.getmask(s5_1))
+
+def brief_awakenings(s5, t0 = None, t1 = None, length = 1, chunk_rows = 256):
+    '''
+    brief_awakenings(s5, t0 = None, t1 = None, length = 1)
+
+    Counts the brief awakenings in the interval (t0,t1) for every (day, fly):
+    stretches of 1 up to length minutes of wake between two minutes of sleep.
+    length should be 1 to 3 minutes. Stretches must be enclosed in the interval;
+    there is no wrapping around.
+    Rows are processed chunk_rows at a time so that temporary arrays stay small.
+    Returns an array with the shape of s5 without its last axis, masked where s5 is.
+    '''
+    window = s5[...,t0:t1]
+    data = np.ma.getdata(window)
+    n = data.shape[-1]
+    rows = data.reshape(-1, n)
+    count = np.zeros(rows.shape[0], dtype=int)
+
+    for r0 in range(0, rows.shape[0], chunk_rows):
+        asleep = rows[r0:r0+chunk_rows] > 0
+        # awake[:,p] is True when the l minutes following p are all awake
+        awake = ~asleep[:,1:]
+        for l in range(1, length+1):
+            if l > 1: awake = awake[:,:-1] & ~asleep[:,l:]
+            if n < l + 2: break
+            count[r0:r0+chunk_rows] += (asleep[:,:n-l-1] & awake[:,:n-l-1] & asleep[:,l+1:]).sum(axis=1)
+
+    count = count.reshape(data.shape[:-1])
+
+    mask = np.ma.getmask(window)
+    if mask is not np.ma.nomask:
+        count = np.ma.masked_array(count, mask=mask.any(axis=-1))
+
+    return count
 
 
 def concatenate(arrays, axis=0):
@@ -247,6 +529,8 @@ def ttest_ind(a, b, axis=0):
     """
 
 
+    import scipy.stats.stats as stats
+
     a, b, axis = _chk2_asarray(a, b, axis)
 
     x1 = np.average( a, axis)
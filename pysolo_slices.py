@@ -21,10 +21,16 @@
 #       MA 02110-1301, USA.
 
 import datetime
+import itertools
 import numpy as np
+from pysolo_sleep_fun import bin_activity_by_minute, sleep_by_definitions, sleep_in_window
+from pysolo_hmm import sleep_states_by_group, state_names
 
 pySoloVersion = 'dev'
 
+#every DAMslice takes a new number from here whenever its data change, see DAMslice.revision
+_revisions = itertools.count()
+
 
 class DAMslice(object):
     """
@@ -46,6 +52,18 @@ class DAMslice(object):
     5        3        1            60
     
     """
+
+    #definitions of sleep as (minutes, inactivity). The first one is used for fly5min and fly30min
+    #inactivity None means the inactivity given to __CalculateSleep__
+    sleepDefinitions = [(5, None), (10, None), (15, None)]
+
+    #prefix sums and binned data kept along with the data and saved in the DAD file (see buildIndex)
+    binLengths = [5, 10, 15, 30, 60]
+    indexArrays = ['flyCumActivity', 'flyCumSleep',
+                   'flyActivityBin5', 'flyActivityBin10', 'flyActivityBin15', 'flyActivityBin30', 'flyActivityBin60',
+                   'flySleepBin5', 'flySleepBin10', 'flySleepBin15', 'flySleepBin30', 'flySleepBin60',
+                   'flyAltSleep', 'flyStates']
+
     def __init__(self, mon, sch, ech, genotype, comment, smont, sd, emont, eday, year, version=pySoloVersion):
 
         #Data coming from outside
@@ -86,12 +104,27 @@ class DAMslice(object):
         self.fly30min = np.zeros((self.totDays, self.totFlies, self.datalenght), dtype=self.datatype)
         self.flyStatus = np.ones((self.totDays, self.totFlies), dtype=self.datatype) # fly is enabled or not?
 
+        #sleep according to the other definitions, see sleepDefinitions, and its 30 minutes windows
+        self.inactivity = 0
+        self.flyAltSleep = np.zeros((len(self.sleepDefinitions)-1, self.totDays, self.totFlies, self.datalenght), dtype=self.datatype)
+        self.flyAlt30min = np.zeros(self.flyAltSleep.shape, dtype=self.datatype)
+
+        #sleep states inferred by calculateSleepStates, -1 where not calculated
+        self.flyStates = -np.ones((self.totDays, self.totFlies, self.datalenght), dtype=np.int8)
+
+        #changes every time sleep, status or states change; unique among all the DAMslices
+        self.revision = next(_revisions)
+
+        self.buildIndex()
+
 #TODO
     def __CalculateSleep__(self, fly_to_calc=None, inactivity=0, use_legacy_algorithm=False):
         """
         This function will calculate sleep5mins and sleep30mins array
         for all the flies of the current DAM
         inactivity could be higher than 0 if there is a noise in the activty level (for instance with video analysis).
+        Sleep according to all the definitions in sleepDefinitions is calculated in the same pass:
+        the first one goes in fly5min and fly30min, the others in flyAltSleep and flyAlt30min
         """
 
 
@@ -110,63 +143,161 @@ class DAMslice(object):
         bins = c
         minute = bins / 1440. #this is the number of counts per minute. this value is not userdefined! 
 
+        sleep_length = self.sleepDefinitions[0][0]
+        bpm = max(int(round(minute)), 1)
+        self.inactivity = inactivity
+
         # a + b = number of bins spanning a 5 mins period
         # if sample rate is 1440/day then a1 = 2, b1 = 3
-        a1 = int(np.floor((minute * 5 ) / 2))
-        b1 = int(np.ceil((minute * 5 ) / 2))
+        a1 = int(np.floor((minute * sleep_length ) / 2))
+        b1 = int(np.ceil((minute * sleep_length ) / 2))
 
         # c + d = number of bins spanning a 30 mins period
         # if sample rate is 1440/day then a2 = 15, b2 = 15
         a2 = int(np.floor((minute * 30) / 2))
         b2 = int(np.ceil((minute * 30) / 2))
 
-        #t1 = single_flies.transpose
-
         if use_legacy_algorithm:
 
             for fly in fc:
                 single_flies5min[fly] = [( single_flies[fly][i-b1:i+a1].sum() <= inactivity ) for i in range (d*c)]
                 single_flies30min[fly]  = [ single_flies5min[fly][i-b2:i+a2].sum() for i in range (d*c)]
 
+            alt_sleep = self.__SleepByDefinitions__(single_flies[fc], self.sleepDefinitions[1:], bpm)
+
         else:
+            # all flies at once: a bin is sleep if it belongs to at least one stretch
+            # of 5 minutes without activity, then we count sleep in a 30 minutes window
+            all_sleep = self.__SleepByDefinitions__(single_flies[fc], self.sleepDefinitions, bpm)
+            single_flies5min[fc] = all_sleep[0]
+            single_flies30min[fc] = sleep_in_window(single_flies5min[fc], window=30*bpm)
+            alt_sleep = all_sleep[1:]
 
-            for fly in fc:
-                
-                sf_1 = np.array([( single_flies[fly][i:i+5].sum() <= inactivity ) for i in range (d*c)])
-                sf_2 = np.array([( single_flies[fly][i-1:i+4].sum() <= inactivity ) for i in range (d*c)])
-                sf_3 = np.array([( single_flies[fly][i-2:i+3].sum() <= inactivity ) for i in range (d*c)])
-                sf_4 = np.array([( single_flies[fly][i-3:i+2].sum() <= inactivity ) for i in range (d*c)])
-                sf_5 = np.array([( single_flies[fly][i-4:i+1].sum() <= inactivity ) for i in range (d*c)])
+        self.fly = self.fly.transpose((1,0,2))
+        self.fly5min = single_flies5min.reshape((f,d,c)).transpose((1,0,2))
+        self.fly30min = single_flies30min.reshape((f,d,c)).transpose((1,0,2))
 
-                single_flies5min[fly] = sf_1 + sf_2 + sf_3 + sf_4 + sf_5
+        self.__SetAltSleep__(fc, alt_sleep)
+        self.buildIndex()
 
-                single_flies30min[fly]  = [ single_flies5min[fly][i-b2:i+a2].sum() for i in range (d*c)]
+    def __SleepByDefinitions__(self, single_flies, definitions, bpm=1):
+        """
+        Takes the activity of some flies as 2D array (flies, bins) and returns a list with
+        their sleep according to each of the given definitions, from one shared cumulative sum
+        bpm is the number of bins per minute
+        """
+        definitions = [(sleep_length*bpm, (self.inactivity if inactivity is None else inactivity)) for sleep_length, inactivity in definitions]
+        return sleep_by_definitions(single_flies, definitions)
 
+    def __CalculateAltSleep__(self):
+        """
+        Calculates sleep according to the alternative definitions only, for all the flies
+        """
+        d,f,c = self.fly.shape
+        single_flies = self.fly.transpose((1,0,2)).reshape((f, d*c))
+        bpm = max(int(round(c / 1440.)), 1)
+        self.__SetAltSleep__(range(f), self.__SleepByDefinitions__(single_flies, self.sleepDefinitions[1:], bpm))
 
-        #single_flies5min = single_flies5min * 1./minute #this is necessary to have all values properly referring to minutes
-        #single_flies30min = single_flies30min * 1./minute
+    def __SetAltSleep__(self, fc, alt_sleep):
+        """
+        Stores in flyAltSleep the sleep of flies fc (a list of 2D arrays (flies, bins), one per alternative definition)
+        and its 30 minutes windows in flyAlt30min
+        """
+        d,f,c = self.fly.shape
+        n = len(self.sleepDefinitions) - 1
+        if self.flyAltSleep.shape != (n, d, f, c):
+            self.flyAltSleep = np.zeros((n, d, f, c), dtype=self.datatype)
 
-        self.fly = self.fly.transpose((1,0,2))
-        self.fly5min = single_flies5min.reshape((f,d,c)).transpose((1,0,2))
-        self.fly30min = single_flies30min.reshape((f,d,c)).transpose((1,0,2))
+        single_alt = self.flyAltSleep.transpose((0,2,1,3)).reshape((n, f, d*c))
+        for k in range(n):
+            single_alt[k][fc] = alt_sleep[k]
+        self.flyAltSleep = single_alt.reshape((n,f,d,c)).transpose((0,2,1,3))
+        self.__SetAlt30min__()
 
+    def __SetAlt30min__(self):
+        """
+        Calculates flyAlt30min from flyAltSleep. As for fly30min, the window runs
+        over the days one after the other
+        """
+        n,d,f,c = self.flyAltSleep.shape
+        single_alt = self.flyAltSleep.transpose((0,2,1,3)).reshape((n, f, d*c))
+        single_alt30 = sleep_in_window(single_alt, window=30*max(int(round(c / 1440.)), 1))
+        self.flyAlt30min = single_alt30.reshape((n,f,d,c)).transpose((0,2,1,3)).astype(self.datatype)
+        self.revision = next(_revisions)
 
-    def ___resampleAllto1440__(self):
+    def setSleepDefinitions(self, definitions):
         """
-        This function can be used to resample all our arrays to 1440 bins per day (1 bin per minute)
+        Change the definitions of sleep as a list of (minutes, inactivity) and recalculate sleep.
+        The first definition is the one used for fly5min and fly30min.
+        inactivity can be None to use the same inactivity given to __CalculateSleep__
         """
-        
+        self.sleepDefinitions = [tuple(sd) for sd in definitions]
+        self.__CalculateSleep__(inactivity=self.inactivity)
+
+    def getSleepDefinitionNames(self):
+        """
+        Return the names of the definitions of sleep, in the order they are stored
+        """
+        names = []
+        for sleep_length, inactivity in self.sleepDefinitions:
+            if inactivity is None: names.append('%s min' % sleep_length)
+            else: names.append('%s min (inactivity %s)' % (sleep_length, inactivity))
+        return names
+
+    def getSleepDefinition(self, name):
+        """
+        Return the position of the sleep definition with the given name (see getSleepDefinitionNames),
+        of its number of minutes or of its minutes:inactivity (as in "5:2").
+        Unknown definitions fall back to the first one
+        """
+        names = self.getSleepDefinitionNames()
+        lengths = [str(sleep_length) for sleep_length, inactivity in self.sleepDefinitions]
+        short = ['%s:%s' % (sleep_length, self.inactivity if inactivity is None else inactivity) for sleep_length, inactivity in self.sleepDefinitions]
+        if name in names: return names.index(name)
+        name = str(name).replace(' ', '')
+        if name in short: return short.index(name)
+        if name in lengths: return lengths.index(name)
+        return 0
+
+    def getSleepHeader(self):
+        """
+        Return the definitions of sleep and the inactivity used for them
+        It goes in the header of the DAD file
+        """
+        return [self.sleepDefinitions, self.inactivity]
+
+    def setSleepHeader(self, sleepHeader):
+        """
+        Restores the definitions of sleep saved with getSleepHeader
+        """
+        definitions, self.inactivity = sleepHeader
+        self.sleepDefinitions = [tuple(sd) for sd in definitions]
         d,f,c = self.fly.shape
-        c1 = c / 1440
-        
-        self.fly = self.fly.reshape((d,f,1440,c1)).sum(axis=3)
-        self.fly5min = self.fly5min.reshape((d,f,1440,c1)).sum(axis=3) / c1
-        self.fly30min = np.average(self.fly30min.reshape((d,f,1440,c1)),axis=3) / c1
-        
-        self.fly = self.fly.astype(np.int32)
-        self.fly5min = self.fly5min.astype(np.int32)
-        self.fly30min = self.fly30min.astype(np.int32)
-        
+        self.flyAltSleep = np.zeros((len(self.sleepDefinitions)-1, d, f, c), dtype=self.datatype)
+        self.flyAlt30min = np.zeros(self.flyAltSleep.shape, dtype=self.datatype)
+
+    def buildIndex(self):
+        """
+        Builds the prefix sums of activity and sleep of every fly on every day.
+        flyCumActivity[d,f,t] is the activity of fly f on day d before bin t, starting from 0,
+        so that the activity between bins t0 and t1 is flyCumActivity[d,f,t1] - flyCumActivity[d,f,t0].
+        The same for flyCumSleep with the sleep bins of fly5min.
+        From the prefix sums we also take activity and sleep binned at every length in binLengths
+        (flyActivityBin5, flySleepBin5 ... flySleepBin60), see getBinned.
+        """
+        d,f,c = self.fly.shape
+
+        self.flyCumActivity = np.zeros((d, f, c+1), dtype=self.datatype)
+        self.flyCumSleep = np.zeros((d, f, c+1), dtype=self.datatype)
+        np.cumsum(self.fly, axis=2, out=self.flyCumActivity[:,:,1:])
+        np.cumsum(self.fly5min, axis=2, out=self.flyCumSleep[:,:,1:])
+
+        for bin_length in self.binLengths:
+            edges = np.arange(0, c+1, bin_length)
+            setattr(self, 'flyActivityBin%s' % bin_length, np.diff(self.flyCumActivity[:,:,edges], axis=2))
+            setattr(self, 'flySleepBin%s' % bin_length, np.diff(self.flyCumSleep[:,:,edges], axis=2))
+
+        self.revision = next(_revisions)
 
     def getHeader(self):
         """
@@ -330,7 +461,7 @@ class DAMslice(object):
             m0 = self.getMonitorName(m)
             f0 = self.getChannelName(m, f)
             f = self.rangeChannel[1].index(m0)
-            f1 = self.getFliesInMon(m0)[-1] + 1
+            f1 = self.getFliesInMon(m0)[-1]
 
         elif f != -1:
             m0 = self.getMonitorName(m)
@@ -388,7 +519,7 @@ class DAMslice(object):
         if f1 ==-1:
             f1 = self.totFlies
         else:
-            f1 = f1 + (f==f1)
+            f1 = min(f1 + 1, self.totFlies)
 
         if d1 ==-1:
             d1 = self.totDays
@@ -407,6 +538,8 @@ class DAMslice(object):
                     if self.flyStatus[day,sf] <= 0 : self.flyStatus[day,sf] = 0 - status
                     if self.flyStatus[day,sf] > 0 : self.flyStatus[day,sf] = status
 
+        self.revision = next(_revisions)
+
 
 
     def allinStatus(self, mon=None, day=None, fly=None, status=-5):
@@ -458,7 +591,7 @@ class DAMslice(object):
 
 
 
-    def filterbyStatus(self, d, d1, f, f1, t0=None, t1=None, status=5, use_dropout = True, min_alive = 0, max_alive = 1400, useFilter = True):
+    def filterbyStatus(self, d, d1, f, f1, t0=None, t1=None, status=5, use_dropout = True, min_alive = 0, max_alive = 1400, useFilter = True, sleep_definition = 0):
         """
         RETURN MASKED ARRAY
         This function filters the fly raw data by fly status and returns the distribution
@@ -478,9 +611,40 @@ class DAMslice(object):
             4 - Active None
             5 - All Active
 
+        sleep_definition is the position of the definition of sleep to use (see sleepDefinitions)
+
         """
 
+        if f1 == -1: f1 = None
+        else: f1 += 1
+        if d1 == -1: d1 = None
+        else: d1 += 1
+
+        if sleep_definition:
+            fly30_full = self.flyAlt30min[sleep_definition-1,d:d1,f:f1]
+            fly5_slice = self.flyAltSleep[sleep_definition-1,d:d1,f:f1,t0:t1]
+            mask_t = self.__statusMask__(d, d1, f, f1, t0, t1, status, use_dropout, min_alive, max_alive, useFilter, sleep=fly5_slice.sum(axis=2))
+        else:
+            fly30_full = self.fly30min[d:d1,f:f1]
+            fly5_slice =  self.fly5min[d:d1,f:f1,t0:t1]
+            mask_t = self.__statusMask__(d, d1, f, f1, t0, t1, status, use_dropout, min_alive, max_alive, useFilter)
+
+        mask_f = np.zeros(fly5_slice.shape)
+        indices = np.where(mask_t == True)
+        mask_f[indices] = True
+
+        fly5_slice = np.ma.masked_array(fly5_slice, mask=mask_f)
+
+        fly_slice = np.ma.masked_array(self.fly[d:d1,f:f1,t0:t1], mask=mask_f)
+        fly30_slice = np.ma.masked_array(fly30_full[:,:,t0:t1], mask=mask_f)
 
+        return fly_slice, fly5_slice, fly30_slice
+
+    def __statusMask__(self, d, d1, f, f1, t0, t1, status, use_dropout, min_alive, max_alive, useFilter, sleep=None):
+        """
+        Returns the 2D mask (days, flies) used by filterbyStatus; d1 and f1 are already slice ends.
+        Unless given, the sleep of every fly in the window comes from the prefix sums.
+        """
         if useFilter: ## Do we exclude inactive flies from our harvesting?
             if status == 5: s0, s1 = 1, 4
             elif status == -5: s0, s1 = -1, -4
@@ -490,19 +654,14 @@ class DAMslice(object):
             if status == 5: s0, s1 = -1, 4
             else: s0,s1 = status, status
 
-        if f1 == -1: f1 = None
-        else: f1 += 1
-        if d1 == -1: d1 = None
-        else: d1 += 1
-
-        fly5_slice =  self.fly5min[d:d1,f:f1,t0:t1]
         fly_Status_slice =  self.flyStatus[d:d1,f:f1]
 
         # Here we create a mask to be applied to the other array to exclude
         # those flies that died at a certain point (the dropouts).
         if not useFilter: min_alive, max_alive = 0, 1440
 
-        fly_alive_through = ((fly5_slice.sum(axis=2) > min_alive) & (fly5_slice.sum(axis=2) < max_alive)) #shape = (f,d)
+        if sleep is None: sleep = self.__windowSum__(self.flyCumSleep, d, d1, f, f1, t0, t1)
+        fly_alive_through = ((sleep > min_alive) & (sleep < max_alive)) #shape = (f,d)
         
         if use_dropout:
             # If we decided to use the dropout we at least have to change their value to NaN
@@ -521,17 +680,144 @@ class DAMslice(object):
         # we asked for. All those flies will be NaN
         StatusMask = (fly_Status_slice >=s0) & (fly_Status_slice <=s1)
 
-        mask_t = mask_do | (StatusMask==False)
-        mask_f = np.zeros(fly5_slice.shape)
-        indices = np.where(mask_t == True)
-        mask_f[indices] = True
+        return mask_do | (StatusMask==False)
 
-        fly5_slice = np.ma.masked_array(fly5_slice, mask=mask_f)
+    def __windowSum__(self, cumsum, d, d1, f, f1, t0, t1):
+        """
+        Returns the 2D array (days, flies) with the sum of the bins between t0 and t1,
+        as slicing [:,:,t0:t1] would, from the given prefix sums
+        """
+        t0, t1, step = slice(t0, t1).indices(cumsum.shape[2] - 1)
+        t1 = max(t0, t1)
+        return cumsum[d:d1,f:f1,t1] - cumsum[d:d1,f:f1,t0]
 
-        fly_slice = np.ma.masked_array(self.fly[d:d1,f:f1,t0:t1], mask=mask_f)
-        fly30_slice = np.ma.masked_array(self.fly30min[d:d1,f:f1,t0:t1], mask=mask_f)
+    def getWindowTotals(self, d, d1, f, f1, t0=None, t1=None, status=5, use_dropout = True, min_alive = 0, max_alive = 1400, useFilter = True):
+        """
+        RETURN MASKED ARRAYS
+        Same as filterbyStatus but instead of the bins returns, for every day and every fly,
+        the total activity and the total minutes of sleep between t0 and t1.
+        They come from the prefix sums of the slice so they cost the same for any window.
+        """
+        if f1 == -1: f1 = None
+        else: f1 += 1
+        if d1 == -1: d1 = None
+        else: d1 += 1
 
-        return fly_slice, fly5_slice, fly30_slice
+        mask_t = self.__statusMask__(d, d1, f, f1, t0, t1, status, use_dropout, min_alive, max_alive, useFilter)
+
+        activity = np.ma.masked_array(self.__windowSum__(self.flyCumActivity, d, d1, f, f1, t0, t1), mask=mask_t)
+        sleep = np.ma.masked_array(self.__windowSum__(self.flyCumSleep, d, d1, f, f1, t0, t1), mask=mask_t)
+
+        return activity, sleep
+
+    def getBinned(self, d, d1, f, f1, bin_length, t0=None, t1=None, status=5, use_dropout = True, min_alive = 0, max_alive = 1400, useFilter = True, sleep_definition = 0):
+        """
+        RETURN MASKED ARRAYS
+        Same as filterbyStatus but returns activity and minutes of sleep summed in bins
+        of bin_length minutes, starting from t0. Minutes not filling a whole bin at the end are left out.
+        Bins of a standard length starting on a bin edge are read as they are from the binned arrays,
+        all the others come from the prefix sums.
+        sleep_definition is the position of the definition of sleep to use (see sleepDefinitions)
+        """
+        if f1 == -1: f1 = None
+        else: f1 += 1
+        if d1 == -1: d1 = None
+        else: d1 += 1
+
+        if sleep_definition:
+            alt_sleep = self.flyAltSleep[sleep_definition-1,d:d1,f:f1]
+            mask_t = self.__statusMask__(d, d1, f, f1, t0, t1, status, use_dropout, min_alive, max_alive, useFilter, sleep=alt_sleep[:,:,t0:t1].sum(axis=2))
+        else:
+            mask_t = self.__statusMask__(d, d1, f, f1, t0, t1, status, use_dropout, min_alive, max_alive, useFilter)
+
+        t0, t1, step = slice(t0, t1).indices(self.fly.shape[2])
+        n = max(t1 - t0, 0) / bin_length
+
+        if bin_length == 1:
+            activity = self.fly[d:d1,f:f1,t0:t0+n]
+            sleep = self.fly5min[d:d1,f:f1,t0:t0+n]
+
+        elif bin_length in self.binLengths and t0 % bin_length == 0:
+            b0 = t0 / bin_length
+            activity = getattr(self, 'flyActivityBin%s' % bin_length)[d:d1,f:f1,b0:b0+n]
+            sleep = getattr(self, 'flySleepBin%s' % bin_length)[d:d1,f:f1,b0:b0+n]
+
+        else:
+            edges = t0 + np.arange(n+1) * bin_length
+            activity = np.diff(self.flyCumActivity[d:d1,f:f1][:,:,edges], axis=2)
+            sleep = np.diff(self.flyCumSleep[d:d1,f:f1][:,:,edges], axis=2)
+
+        if sleep_definition:
+            #binned sleep is kept for the first definition only
+            ds, fs, c = alt_sleep.shape
+            sleep = alt_sleep[:,:,t0:t0+n*bin_length].reshape((ds, fs, n, bin_length)).sum(axis=3)
+
+        mask_f = np.repeat(mask_t[:,:,np.newaxis], n, axis=2)
+        return np.ma.masked_array(activity, mask=mask_f), np.ma.masked_array(sleep, mask=mask_f)
+
+    def getWindowAI(self, d, d1, f, f1, t0=None, t1=None, **kwargs):
+        """
+        Activity index (activity / minutes awake) of every fly on every day between t0 and t1.
+        Takes the same arguments as getWindowTotals
+        """
+        activity, sleep = self.getWindowTotals(d, d1, f, f1, t0, t1, **kwargs)
+        t0, t1, step = slice(t0, t1).indices(self.fly.shape[2])
+        return activity / (float(max(t1 - t0, 0)) - sleep)
+
+    def getWindowSleepFraction(self, d, d1, f, f1, t0=None, t1=None, **kwargs):
+        """
+        Fraction of the minutes between t0 and t1 every fly spent asleep, on every day.
+        Takes the same arguments as getWindowTotals
+        """
+        activity, sleep = self.getWindowTotals(d, d1, f, f1, t0, t1, **kwargs)
+        t0, t1, step = slice(t0, t1).indices(self.fly.shape[2])
+        return sleep / float(max(t1 - t0, 1))
+
+    def calculateSleepStates(self, n_states=3, iterations=30, processes=None):
+        """
+        Infers the sleep state of every minute of all the flies with a hidden Markov model
+        of their activity (see pysolo_hmm). The flies of every monitor are fitted as one batch,
+        monitors in parallel processes. Days marked as inactive are left out.
+        States go in flyStates: 0 is the deepest sleep, n_states-1 is wake, -1 means no state
+        """
+        d,f,c = self.fly.shape
+        single_flies = self.fly.transpose((1,0,2)).reshape((f, d*c))
+        missing = np.repeat(self.flyStatus.T < 0, c, axis=1)
+        monitors = [str(self.getMonitorFlyName(ff)[0]) for ff in range(f)]
+
+        states = sleep_states_by_group(single_flies, missing, monitors, n_states, iterations, processes)
+        self.flyStates = states.reshape((f,d,c)).transpose((1,0,2)).copy()
+        self.revision = next(_revisions)
+
+    def getSleepStates(self, d, d1, f, f1, t0=None, t1=None):
+        """
+        Returns the sleep states (see calculateSleepStates) as 3D masked array (days, flies, bins),
+        taken in the same interval filterbyStatus would use. Minutes without a state are masked
+        """
+        if f1 == -1: f1 = None
+        else: f1 += 1
+        if d1 == -1: d1 = None
+        else: d1 += 1
+
+        return np.ma.masked_less(self.flyStates[d:d1,f:f1,t0:t1], 0)
+
+    def getSleepStateNames(self):
+        """
+        Return the names of the sleep states, from the deepest sleep to wake
+        """
+        return state_names(int(self.flyStates.max()) + 1)
+
+    def getStatusSlice(self, d, d1, f, f1):
+        """
+        Returns the 2D array (days, flies) with the status of the flies,
+        taken in the same interval filterbyStatus would use
+        """
+        if f1 == -1: f1 = None
+        else: f1 += 1
+        if d1 == -1: d1 = None
+        else: d1 += 1
+
+        return self.flyStatus[d:d1,f:f1]
 
     def saveRawData(self, tmpFileHandle):
         """
@@ -555,6 +841,46 @@ class DAMslice(object):
         self.fly30min = np.fromfile(tmpFileHandle, count = size, dtype=datatype).reshape(shape)
         self.flyStatus = np.fromfile(tmpFileHandle, count = sizeStatus, dtype=datatype).reshape(shapeStatus)
 
+    def getIndexHeader(self):
+        """
+        Return the list of the prefix sums saved by saveIndex, as (name, dtype, shape)
+        It goes in the header of the DAD file
+        """
+        return [(name, getattr(self, name).dtype.str, getattr(self, name).shape) for name in self.indexArrays]
+
+    def saveIndex(self, tmpFileHandle):
+        """
+        """
+        for name in self.indexArrays:
+            getattr(self, name).tofile(tmpFileHandle)
+
+    def loadIndex(self, tmpFileHandle, indexHeader):
+        """
+        Reads back the prefix sums listed in indexHeader (see getIndexHeader)
+        Arrays that are missing or do not fit the data are built again
+        """
+        missing = set(self.indexArrays)
+        for name, dtype, shape in indexHeader:
+            count = int(np.prod(shape))
+            values = np.fromfile(tmpFileHandle, count = count, dtype=dtype)
+            if name in missing and values.size == count and tuple(shape) == getattr(self, name).shape:
+                setattr(self, name, values.reshape(shape))
+                missing.remove(name)
+
+        #flyAlt30min is not saved: it is cheap to build again from flyAltSleep
+        if 'flyAltSleep' in missing:
+            self.__CalculateAltSleep__()
+            missing.remove('flyAltSleep')
+        else:
+            self.__SetAlt30min__()
+
+        #sleep states are expensive: they are calculated only when asked (see calculateSleepStates)
+        if 'flyStates' in missing:
+            self.flyStates = -np.ones(self.fly.shape, dtype=np.int8)
+            missing.remove('flyStates')
+
+        if missing: self.buildIndex()
+
 class videoSlice(DAMslice):
     """
     This is the class modified to handle pysolo Video files.
@@ -609,9 +935,11 @@ class videoSlice(DAMslice):
         """
         open a file containing the raw coordinates and populates the DAMslice with the data
         inside then computes the activity of the flies
+        Activity is binned minute by minute, so min_act is compared to the summed
+        distance over the sleep window (5 minutes by default) when scoring sleep
         """
         #open the filename and stores the coords
-        self.coords = self.getCoordinatesArray(filename)
+        self.coords, frames = self.getCoordinatesArray(filename)
         
         #transform coords to activity
         #uses the virtual monitor
@@ -622,9 +950,10 @@ class videoSlice(DAMslice):
         else:
             self.fly = self.getActivityFromCoords(self.coords)
 
-        #fills in holes in the reading (likely for missing frames)
-        self.fly = self.expandToProperSize(self.fly)
-        self.datalenght = self.fly.shape[2]
+        #bins the frames minute by minute. Frame numbers are spread along the day
+        #so that missing frames leave a gap instead of shifting the following ones
+        timestamps = (frames - frames[0]) * float(self.datalenght) / (frames[-1] - frames[0] + 1)
+        self.fly = np.round(bin_activity_by_minute(self.fly, timestamps=timestamps, day_length=self.datalenght)).astype(self.datatype)
         
         genotype = filename.split('/')[-1][:-4]
         self.__updateHeaderData__(genotype)
@@ -633,61 +962,25 @@ class videoSlice(DAMslice):
         self.fly30min = np.zeros((self.totDays, self.totFlies, self.datalenght), dtype=self.datatype)
         
         self.__CalculateSleep__(inactivity=min_act)
-        self.___resampleAllto1440__()
-
-    def expandToProperSize(self, in_array, size=None):
-        """
-        If the recording has missed some frames then we need to fill in here and there with some other values
-        will do this on the activity array
-        Can calculate the proper size or can be suggested what size expand to
-        this is not a Fourier based resampling, it's just interpolation
-        """
-        
-        d,f,c = in_array.shape
-        
-        #do we need to guess the best size?
-        if not size: size = int(np.ceil(c / 1440.)*1440)
-        
-        if size > c:
-
-            new_array = np.zeros((d,f,size), dtype = np.int32)
-            
-            missing_frames = size - c
-            #fragments = int(np.ceil(c / missing_frames * 1.0))
-            fragments = int(np.ceil(size / missing_frames * 1.0))
-    
-            #pos1 = range(0, c, fragments)
-            pos = range(0, size+1, fragments)
-           
-            for i in range(missing_frames)[:]:
-                a = pos[i]; b = pos[i+1]-1
-                c = a - i; d = b - i
-                #print 'frag: %s\t%s:%s in %s:%s'%(i,a,b,c,d)
-                new_array[:,:,a:b] = in_array[:,:,c:d]
-            
-            return new_array
-        
-        else:
-            
-            return in_array
-    
-
 
     def getCoordinatesArray(self, filename):
         """
-        open a file with one day worth of data and returns a 3D numpy array with the data inside
-        Array coordinates are (num_flies, num_frames, 2)
+        open a file with one day worth of data and returns a 4D numpy array with the data inside
+        and a 1D array with the frame numbers
+        Array coordinates are (1, num_flies, num_frames, 2)
         """
         
         n_day = 1
         f = open (filename, 'r')
         coord_list = []
+        frame_list = []
         
         #read the file line by line (that is frame by frame)
         for line in f.readlines():
             #remove the last entry (newline char) and the first (frame number)
-            l = line.split('\t')[1:-1]
-            coord_list.append(l)
+            l = line.split('\t')
+            frame_list.append(int(l[0]))
+            coord_list.append(l[1:-1])
         
         #understand how many flies we have and how many frames    
         n_frame = len(coord_list)
@@ -702,7 +995,7 @@ class videoSlice(DAMslice):
                 x, y = coord_list[fr][fl].split(',')
                 coords[0,fl,fr] = int(x), int(y)
     
-        return coords
+        return coords, np.array(frame_list)
     
     
     def getActivityFromCoords(self, coords):
@@ -744,53 +1037,16 @@ class videoSlice(DAMslice):
 
 
 class sixminsSlice(DAMslice):
-    
+    """
+    DAMslice where sleep is defined by 6 minutes of inactivity
+    """
+
+    sleepDefinitions = [(6, None)]
+
     def __init__(self, mon, sch, ech, genotype, comment, smont, sd, emont, eday, year, version=pySoloVersion):
         """
         """
         DAMslice.__init__(self, mon, sch, ech, genotype, comment, smont, sd, emont, eday, year, version=pySoloVersion)
-    
-    
-    def __CalculateSleep__(self, fly_to_calc=None):
-        """
-        This function will calculate sleep5mins and sleep30mins array
-        for all the flies of the current DAM
-        """
-
-        if fly_to_calc:
-            fc = range(fly_to_calc, fly_to_calc+1)
-        else:
-            fc = range(self.totFlies)
-
-        d,f,c = self.fly.shape
-        self.fly = self.fly.transpose((1,0,2)) #d,f,c -> f,d,c
-
-        single_flies = self.fly.reshape((f, d*c))
-        single_flies5min = self.fly5min.reshape((f, d*c))
-        single_flies30min = self.fly30min.reshape((f, d*c))
-
-        bins = c
-        minute = bins / 1440. #this value is not userdefined!
-
-        # a + b = number of bins spanning a 5 mins period
-        # if sample rate is 1440/day then a1 = 2, b1 = 3
-        a1 = int(np.floor((minute * 6 ) / 2))
-        b1 = int(np.ceil((minute * 6 ) / 2))
-
-        # c + d = number of bins spanning a 30 mins period
-        # if sample rate is 1440/day then a2 = 15, b2 = 15
-        a2 = int(np.floor((minute * 30) / 2))
-        b2 = int(np.ceil((minute * 30) / 2))
-
-        t1 = single_flies.transpose
-
-        for fly in fc:
-            single_flies5min[fly] = [( single_flies[fly][i-b1:i+a1].sum() == 0 ) for i in range (d*c)] #1440 * n_days
-            single_flies30min[fly]  = [ single_flies5min[fly][i-b2:i+a2].sum() for i in range (d*c)]
-
-        self.fly = self.fly.transpose((1,0,2))
-        self.fly5min = single_flies5min.reshape((f,d,c)).transpose((1,0,2))
-        self.fly30min = single_flies30min.reshape((f,d,c)).transpose((1,0,2))
 
 
 class plusSlice(DAMslice):
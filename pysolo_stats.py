@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_stats.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Resampling statistics to compare groups of flies (genotypes, lines of a screen...)
+# Every group is a 1D sequence of values, one for each fly: sleep amount, AI, rebound,
+# length or number of episodes etc. Masked values are left out.
+# All the groups are resampled together: random indices are drawn as matrices of
+# (resamples, groups, flies) a chunk of resamples at a time, so memory is bounded by
+# chunk_size and not by the number of resamples. Chunks can be spread over a pool of processes.
+# Every chunk has its own seed, derived from the given one, so results do not depend
+# on the number of processes used.
+
+import numpy as np
+
+
+def pad_groups(groups):
+    '''
+    Takes a list of 1D sequences of different lengths and returns a tuple (values, sizes)
+    where values is a 2D array (groups, max size) with the valid values of each group
+    packed on the left and sizes is the number of valid values in each group.
+    Masked and NaN values are left out.
+    '''
+    clean = []
+    for g in groups:
+        g = np.ma.masked_invalid(np.ma.ravel(g).astype(np.float64))
+        clean.append(g.compressed())
+
+    sizes = np.array([len(g) for g in clean], dtype=int)
+    values = np.zeros((len(clean), sizes.max() if len(clean) else 0), dtype=np.float64)
+    for n, g in enumerate(clean):
+        values[n, :len(g)] = g
+
+    return values, sizes
+
+def _chunk_seeds(n_resamples, chunk_size, seed):
+    '''
+    Splits n_resamples in chunks and returns a list of (chunk length, seed)
+    '''
+    n_chunks = (n_resamples + chunk_size - 1) / chunk_size
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=n_chunks)
+    lengths = [chunk_size] * (n_chunks - 1) + [n_resamples - chunk_size * (n_chunks - 1)]
+    return zip(lengths, seeds)
+
+def _map_chunks(function, jobs, processes):
+    '''
+    Runs function over every job, in a pool of processes if processes is more than 1
+    '''
+    if processes and processes > 1 and len(jobs) > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+        try:
+            return pool.map(function, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        return map(function, jobs)
+
+def bootstrap_indices(sizes, n_resamples, random=np.random):
+    '''
+    Returns an int array (n_resamples, groups, max size) of random indices drawn with
+    replacement, for every group, among its first sizes[group] positions
+    Positions beyond the size of a group are filled but should be ignored
+    '''
+    sizes = np.asarray(sizes)
+    width = sizes.max() if len(sizes) else 0
+    u = random.random_sample((n_resamples, len(sizes), width))
+    return (u * sizes[:,np.newaxis]).astype(int)
+
+def permutation_indices(size, n_resamples, random=np.random):
+    '''
+    Returns an int array (n_resamples, groups, max size) where each row is a random
+    permutation of the first size[group] positions. Positions beyond the size of
+    a group are placed at the end of the row
+    '''
+    size = np.asarray(size)
+    width = size.max() if len(size) else 0
+    keys = random.random_sample((n_resamples, len(size), width))
+    keys[:,np.arange(width) >= size[:,np.newaxis]] = 2. #invalid positions sort last
+    return keys.argsort(axis=-1)
+
+def _bootstrap_chunk(job):
+    '''
+    Means of one chunk of bootstrap resamples; job is (values, sizes, length, seed)
+    '''
+    values, sizes, length, seed = job
+    idx = bootstrap_indices(sizes, length, np.random.RandomState(seed))
+    valid = np.arange(values.shape[1]) < sizes[:,np.newaxis]
+    rows = np.arange(values.shape[0])[:,np.newaxis]
+    drawn = values[rows, idx] * valid
+    return drawn.sum(axis=-1) / np.maximum(sizes, 1)
+
+def bootstrap_means(groups, n_resamples=10000, seed=None, chunk_size=500, processes=None):
+    '''
+    Takes a list of groups and returns a 2D array (n_resamples, groups) with the mean
+    of every bootstrap resample of every group
+    '''
+    values, sizes = pad_groups(groups)
+    jobs = [(values, sizes, length, s) for length, s in _chunk_seeds(n_resamples, chunk_size, seed)]
+    means = np.concatenate(_map_chunks(_bootstrap_chunk, jobs, processes), axis=0)
+    means[:, sizes == 0] = np.nan
+    return means
+
+def bootstrap_ci(groups, n_resamples=10000, ci=95, seed=None, chunk_size=500, processes=None):
+    '''
+    bootstrap_ci(groups, n_resamples=10000, ci=95, seed=None, chunk_size=500, processes=None)
+
+    Percentile bootstrap confidence interval of the mean of every group.
+    Returns three 1D arrays: mean, lower and upper limit of the interval.
+    Groups without valid values are masked.
+    '''
+    values, sizes = pad_groups(groups)
+    means = bootstrap_means(groups, n_resamples, seed, chunk_size, processes)
+    tail = (100. - ci) / 2.
+    empty = sizes == 0
+
+    mean = values.sum(axis=1) / np.maximum(sizes, 1)
+    low, high = np.zeros((2, len(sizes)))
+    if not empty.all():
+        low[~empty], high[~empty] = np.percentile(means[:, ~empty], [tail, 100. - tail], axis=0)
+
+    return (np.ma.masked_array(mean, mask=empty),
+            np.ma.masked_array(low, mask=empty),
+            np.ma.masked_array(high, mask=empty))
+
+def _permutation_chunk(job):
+    '''
+    Differences of the means in one chunk of permutations; job is (pooled, sizes, n_test, length, seed)
+    '''
+    pooled, sizes, n_test, length, seed = job
+    perm = permutation_indices(sizes, length, np.random.RandomState(seed))
+    rows = np.arange(pooled.shape[0])[:,np.newaxis]
+    shuffled = pooled[rows, perm]
+
+    #the first n_test values of every permutation go to the test group, the others to the control
+    cs = np.cumsum(shuffled, axis=-1)
+    sum_test = cs[:, np.arange(pooled.shape[0]), np.maximum(n_test, 1) - 1]
+    sum_test[:, n_test == 0] = 0
+    total = pooled.sum(axis=1)
+    n_control = sizes - n_test
+    return sum_test / np.maximum(n_test, 1) - (total - sum_test) / np.maximum(n_control, 1)
+
+def permutation_test(groups, control, n_resamples=10000, seed=None, chunk_size=200, processes=None):
+    '''
+    permutation_test(groups, control, n_resamples=10000, seed=None, chunk_size=200, processes=None)
+
+    Two sided permutation test of the difference between the mean of every group and the
+    mean of control. control is either one group, used for all the comparisons, or a list
+    of groups as long as groups.
+    Returns two 1D arrays: the observed differences and their p values.
+    Comparisons where one of the two groups has no valid values are masked.
+    '''
+    if len(control) == 0 or np.ndim(control[0]) == 0:
+        control = [control] * len(groups)
+
+    test, n_test = pad_groups(groups)
+    ctrl, n_ctrl = pad_groups(control)
+
+    #put the two groups of every comparison one after the other, on the same row
+    sizes = n_test + n_ctrl
+    pooled = np.zeros((len(sizes), sizes.max() if len(sizes) else 0), dtype=np.float64)
+    pooled[:, :test.shape[1]] = test
+    for n in range(len(sizes)):
+        pooled[n, n_test[n]:sizes[n]] = ctrl[n, :n_ctrl[n]]
+
+    observed = test.sum(axis=1) / np.maximum(n_test, 1) - ctrl.sum(axis=1) / np.maximum(n_ctrl, 1)
+
+    jobs = [(pooled, sizes, n_test, length, s) for length, s in _chunk_seeds(n_resamples, chunk_size, seed)]
+    extreme = np.zeros(len(sizes), dtype=int)
+    for diffs in _map_chunks(_permutation_chunk, jobs, processes):
+        extreme += (np.abs(diffs) >= np.abs(observed) - 1e-12).sum(axis=0)
+
+    p = (extreme + 1.) / (n_resamples + 1.)
+    empty = (n_test == 0) | (n_ctrl == 0)
+    return np.ma.masked_array(observed, mask=empty), np.ma.masked_array(p, mask=empty)
+
+def compare_groups(groups, control, n_resamples=10000, ci=95, seed=None, processes=None):
+    '''
+    compare_groups(groups, control, n_resamples=10000, ci=95, seed=None, processes=None)
+
+    Compares every group to control with bootstrap confidence intervals and permutation tests.
+    Returns a list of (column_name, array) with one row for each group:
+    n, mean, ci_low, ci_high, difference, p
+    '''
+    values, sizes = pad_groups(groups)
+    mean, low, high = bootstrap_ci(groups, n_resamples, ci, seed, processes=processes)
+    difference, p = permutation_test(groups, control, n_resamples, seed, processes=processes)
+
+    return [('n', sizes), ('mean', mean), ('ci_low', low), ('ci_high', high),
+            ('difference', difference), ('p', p)]
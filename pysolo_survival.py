@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       pysolo_survival.py
+#
+#       Copyright 2011 Giorgio Gilestro <giorgio@gilest.ro>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+# Longevity and survival.
+# A fly is dead from its last activity if it stays inactive for at least death_inactivity minutes
+# until the end of the recording, otherwise it is still alive at the end (censored).
+# The last activity of all the flies comes from one reverse scan of the whole recording:
+# first the last active minute of every day, then the last active day of every fly.
+# Kaplan-Meier tables and log-rank tests work on all the times of a group at once.
+
+import numpy as np
+
+
+def last_activity(fly, threshold=0):
+    '''
+    Takes the 3D array fly (days, flies, minutes) with the activity of a whole recording
+    and returns for every fly the minute of its last activity above threshold, counted
+    from the beginning of the recording. Flies never active are masked.
+    '''
+    d, f, t = fly.shape
+    active = np.ma.filled(fly, 0) > threshold
+
+    # last active minute of every day, then last active day of every fly
+    day_active = active.any(axis=2)
+    last_minute = t - 1 - np.argmax(active[:,:,::-1], axis=2)
+    last_day = d - 1 - np.argmax(day_active[::-1], axis=0)
+
+    flies = np.arange(f)
+    last = last_day * t + last_minute[last_day, flies]
+    return np.ma.masked_array(last, mask=~day_active.any(axis=0))
+
+def survival_times(fly, death_inactivity=1440, threshold=0):
+    '''
+    survival_times(fly, death_inactivity=1440, threshold=0)
+
+    Takes the 3D array fly (days, flies, minutes) of a whole recording and returns two
+    1D arrays: the time (in minutes) every fly lived or was observed for and True where
+    the fly died, False where it was still alive at the end of the recording (censored).
+    A fly is dead at its last activity if it never moved again for at least death_inactivity minutes.
+    Flies never active are masked.
+    '''
+    d, f, t = fly.shape
+    last = last_activity(fly, threshold)
+    end = d * t
+
+    died = np.ma.filled((end - 1 - last) >= death_inactivity, False)
+    times = np.where(died, np.ma.getdata(last) + 1, end)
+    return np.ma.masked_array(times, mask=np.ma.getmaskarray(last)), died
+
+def _clean(times, events):
+    '''
+    Returns times and events with masked and invalid times left out
+    '''
+    times = np.ma.masked_invalid(np.ma.ravel(times).astype(np.float64))
+    valid = ~np.ma.getmaskarray(times)
+    return np.ma.getdata(times)[valid], np.asarray(np.ravel(events), dtype=bool)[valid]
+
+def kaplan_meier(times, events):
+    '''
+    kaplan_meier(times, events)
+
+    Kaplan-Meier table of one group of flies.
+    Returns a list of (column_name, array) with one row for every time at which at least
+    one fly died or was censored: time, at risk, deaths, censored, survival and its
+    standard error (Greenwood).
+    '''
+    times, events = _clean(times, events)
+    t, idx = np.unique(times, return_inverse=True)
+    deaths = np.bincount(idx, weights=events, minlength=len(t)).astype(int)
+    total = np.bincount(idx, minlength=len(t))
+    censored = total - deaths
+
+    #flies still alive just before each time
+    at_risk = len(times) - np.concatenate(([0], np.cumsum(total)[:-1]))
+
+    survival = np.cumprod(1. - deaths / at_risk.astype(np.float64))
+    alive_after = at_risk - deaths
+    greenwood = np.cumsum(deaths / np.maximum(at_risk * alive_after, 1).astype(np.float64))
+    se = survival * np.sqrt(np.where(alive_after > 0, greenwood, np.nan))
+
+    return [('time', t), ('at risk', at_risk), ('deaths', deaths), ('censored', censored),
+            ('survival', survival), ('st.err.', np.ma.masked_invalid(se))]
+
+def median_survival(times, events):
+    '''
+    Returns the first time at which the Kaplan-Meier survival falls to 0.5 or below
+    Masked if survival never goes that low
+    '''
+    km = dict(kaplan_meier(times, events))
+    below = km['survival'] <= 0.5
+    if not below.any(): return np.ma.masked
+    return km['time'][np.argmax(below)]
+
+def log_rank(groups):
+    '''
+    log_rank(groups)
+
+    Log-rank test of the difference in survival among groups of flies.
+    groups is a list of (times, events), one for each group.
+    Returns a tuple: chi-square statistic, degrees of freedom, p value
+    and the observed and expected number of deaths of every group.
+    '''
+    from scipy.stats import chi2
+
+    groups = [_clean(times, events) for times, events in groups]
+    k = len(groups)
+    t = np.unique(np.concatenate([times[events] for times, events in groups] + [np.array([])]))
+
+    # deaths and flies at risk of every group at every time of death
+    d = np.zeros((k, len(t)))
+    n = np.zeros((k, len(t)))
+    for j, (times, events) in enumerate(groups):
+        st = np.sort(times)
+        n[j] = len(st) - np.searchsorted(st, t, side='left')
+        dt = np.sort(times[events])
+        d[j] = np.searchsorted(dt, t, side='right') - np.searchsorted(dt, t, side='left')
+
+    D = d.sum(axis=0)
+    N = n.sum(axis=0)
+    observed = d.sum(axis=1)
+    expected = (n * (D / np.maximum(N, 1))).sum(axis=1)
+
+    # variance-covariance matrix of observed - expected
+    factor = D * (N - D) / np.maximum(N**2 * (N - 1), 1)
+    V = np.dot(n * factor, n.T) * -1
+    V[np.diag_indices(k)] += (n * N * factor).sum(axis=1)
+
+    diff = (observed - expected)[:-1]
+    df = k - 1
+    if df < 1 or not len(t):
+        return 0., df, np.ma.masked, observed, expected
+
+    stat = np.dot(diff, np.dot(np.linalg.pinv(V[:-1,:-1]), diff))
+    return stat, df, chi2.sf(stat, df), observed, expected